@@ -57,6 +57,19 @@ class CocoPart(Enum):
 #---------------------------------------
 
 
+def _get_valid_mask(meta):
+    # a joint is dropped once it is masked out or moved beyond -100
+    joints = meta.joint_list
+    return meta.joint_mask & (joints[:, :, 0] >= -100) & (joints[:, :, 1] >= -100)
+
+
+def _set_joints(meta, joints, joint_mask):
+    joints = joints.astype(np.float32)
+    joints[~joint_mask] = -1000
+    meta.joint_list = joints
+    meta.joint_mask = joint_mask
+
+
 def pose_random_scale(meta):
     scalew = random.uniform(0.8, 1.2)
     scaleh = random.uniform(0.8, 1.2)
@@ -66,17 +79,9 @@ def pose_random_scale(meta):
     dst = cv2.resize(meta.img, (neww, newh), interpolation=cv2.INTER_AREA)
 
     # adjust meta data
-    adjust_joint_list = []
-    for joint in meta.joint_list:
-        adjust_joint = []
-        for point in joint:
-            if point[0] < -100 or point[1] < -100:
-                adjust_joint.append((-1000, -1000))
-                continue
-            adjust_joint.append((int(point[0] * scalew + 0.5), int(point[1] * scaleh + 0.5)))
-        adjust_joint_list.append(adjust_joint)
-
-    meta.joint_list = adjust_joint_list
+    joints = np.trunc(meta.joint_list.astype(np.float64) * [scalew, scaleh] + 0.5)
+    _set_joints(meta, joints, _get_valid_mask(meta))
+
     meta.width, meta.height = neww, newh
     meta.img = dst
     return meta
@@ -101,27 +106,23 @@ def pose_rotation(meta,preproc_config):
     img = ret[newy:newy + newh, newx:newx + neww]
 
     # adjust meta data
-    adjust_joint_list = []
-    for joint in meta.joint_list:
-        adjust_joint = []
-        for point in joint:
-            if point[0] < -100 or point[1] < -100:
-                adjust_joint.append((-1000, -1000))
-                continue
-            # if point[0] <= 0 or point[1] <= 0:
-            #     adjust_joint.append((-1, -1))
-            #     continue
-            x, y = _rotate_coord((meta.width, meta.height), (newx, newy), point, deg)
-            adjust_joint.append((x, y))
-        adjust_joint_list.append(adjust_joint)
-
-    meta.joint_list = adjust_joint_list
+    joints = _rotate_coord((meta.width, meta.height), (newx, newy), meta.joint_list, deg)
+    _set_joints(meta, joints, _get_valid_mask(meta))
+
     meta.width, meta.height = neww, newh
     meta.img = img
 
     return meta
 
 
+# joint order after the horizontal flip
+FLIP_JOINT_ORDER = [CocoPart.Top.value, CocoPart.Neck.value,
+                    CocoPart.LShoulder.value, CocoPart.LElbow.value, CocoPart.LWrist.value,
+                    CocoPart.RShoulder.value, CocoPart.RElbow.value, CocoPart.RWrist.value,
+                    CocoPart.LHip.value, CocoPart.LKnee.value, CocoPart.LAnkle.value,
+                    CocoPart.RHip.value, CocoPart.RKnee.value, CocoPart.RAnkle.value]
+
+
 def pose_flip(meta):
     r = random.uniform(0, 1.0)
     if r > 0.5:
@@ -131,33 +132,12 @@ def pose_flip(meta):
     img = cv2.flip(img, 1)
 
     # flip meta
-    flip_list = [CocoPart.Top, CocoPart.Neck, CocoPart.LShoulder, CocoPart.LElbow, CocoPart.LWrist, CocoPart.RShoulder,
-                 CocoPart.RElbow, CocoPart.RWrist,
-                 CocoPart.LHip, CocoPart.LKnee, CocoPart.LAnkle, CocoPart.RHip, CocoPart.RKnee, CocoPart.RAnkle
-                 ]
-
     # print('width =%s'% meta.width)
     # print('joint =%s'% meta.joint_list)
-
-    adjust_joint_list = []
-    for joint in meta.joint_list:
-        adjust_joint = []
-        for cocopart in flip_list:
-            point = joint[cocopart.value]
-            if point[0] < -100 or point[1] < -100:
-                adjust_joint.append((-1000, -1000))
-                # print('cocopart = %s' % cocopart)
-                # print('---------------------------')
-                continue
-            # if point[0] <= 0 or point[1] <= 0:
-            #     adjust_joint.append((-1, -1))
-            #     continue
-            adjust_joint.append((meta.width - point[0], point[1]))
-        adjust_joint_list.append(adjust_joint)
-
-    # print('adjust_joint_list =%s'% adjust_joint_list)
-
-    meta.joint_list = adjust_joint_list
+    joint_mask  = _get_valid_mask(meta)[:, FLIP_JOINT_ORDER]
+    joints      = meta.joint_list[:, FLIP_JOINT_ORDER].astype(np.float64)
+    joints[:, :, 0] = meta.width - joints[:, :, 0]
+    _set_joints(meta, joints, joint_mask)
 
     meta.img = img
     return meta
@@ -175,11 +155,15 @@ def pose_resize_shortestedge_random(meta):
     return pose_resize_shortestedge(meta, target_size)
 
 
-def _rotate_coord(shape, newxy, point, angle):
+def _rotate_coord(shape, newxy, points, angle):
+    '''
+        rotates the (..., 2) points about the center of shape
+        and shifts them by -newxy, rounding as int(x + 0.5)
+    '''
     angle = -1 * angle / 180.0 * math.pi
 
     ox, oy = shape
-    px, py = point
+    px, py = points[..., 0].astype(np.float64), points[..., 1].astype(np.float64)
 
     ox /= 2
     oy /= 2
@@ -192,7 +176,7 @@ def _rotate_coord(shape, newxy, point, angle):
     qx += ox - new_x
     qy += oy - new_y
 
-    return int(qx + 0.5), int(qy + 0.5)
+    return np.stack([np.trunc(qx + 0.5), np.trunc(qy + 0.5)], axis=-1)
 
 
 def pose_resize_shortestedge(meta, target_size):
@@ -223,20 +207,9 @@ def pose_resize_shortestedge(meta, target_size):
         dst = cv2.copyMakeBorder(dst, ph, ph + mh, pw, pw + mw, cv2.BORDER_CONSTANT, value=(color1, color2, color3))
 
     # adjust meta data
-    adjust_joint_list = []
-    for joint in meta.joint_list:
-        adjust_joint = []
-        for point in joint:
-            if point[0] < -100 or point[1] < -100:
-                adjust_joint.append((-1000, -1000))
-                continue
-            # if point[0] <= 0 or point[1] <= 0 or int(point[0]*scale+0.5) > neww or int(point[1]*scale+0.5) > newh:
-            #     adjust_joint.append((-1, -1))
-            #     continue
-            adjust_joint.append((int(point[0] * scale + 0.5) + pw, int(point[1] * scale + 0.5) + ph))
-        adjust_joint_list.append(adjust_joint)
-
-    meta.joint_list = adjust_joint_list
+    joints = np.trunc(meta.joint_list.astype(np.float64) * scale + 0.5) + [pw, ph]
+    _set_joints(meta, joints, _get_valid_mask(meta))
+
     meta.width, meta.height = neww + pw * 2, newh + ph * 2
     meta.img = dst
     return meta
@@ -250,24 +223,9 @@ def pose_crop(meta, x, y, w, h):
     resized = img[y:y + target_size[1], x:x + target_size[0], :]
 
     # adjust meta data
-    adjust_joint_list = []
-    for joint in meta.joint_list:
-        adjust_joint = []
-        for point in joint:
-            if point[0] < -100 or point[1] < -100:
-                adjust_joint.append((-1000, -1000))
-                continue
-            # if point[0] <= 0 or point[1] <= 0:
-            #     adjust_joint.append((-1000, -1000))
-            #     continue
-            new_x, new_y = point[0] - x, point[1] - y
-            # if new_x <= 0 or new_y <= 0 or new_x > target_size[0] or new_y > target_size[1]:
-            #     adjust_joint.append((-1, -1))
-            #     continue
-            adjust_joint.append((new_x, new_y))
-        adjust_joint_list.append(adjust_joint)
-
-    meta.joint_list = adjust_joint_list
+    joints = meta.joint_list.astype(np.float64) - [x, y]
+    _set_joints(meta, joints, _get_valid_mask(meta))
+
     meta.width, meta.height = target_size
     meta.img = resized
     return meta
@@ -297,18 +255,194 @@ def pose_crop_random(meta):
     return pose_crop(meta, x, y, target_size[0], target_size[1])
 
 
-def pose_to_img(meta_l):
+def _get_resize_affine(src_w, src_h, dst_w, dst_h):
+    # pixel index mapping of cv2.resize() from (src_w, src_h) to (dst_w, dst_h)
+    scale_x = float(dst_w) / float(src_w)
+    scale_y = float(dst_h) / float(src_h)
+    return np.array([[scale_x, 0.0, 0.5 * scale_x - 0.5],
+                     [0.0, scale_y, 0.5 * scale_y - 0.5],
+                     [0.0, 0.0, 1.0]])
+
+
+def _get_translate_affine(tx, ty):
+    return np.array([[1.0, 0.0, tx],
+                     [0.0, 1.0, ty],
+                     [0.0, 0.0, 1.0]])
+
+
+def pose_affine_random(meta, preproc_config):
+    '''
+        pose_affine_random()
+
+        the fused version of the chain in preprocess_image():
+        pose_random_scale() -> pose_rotation() -> pose_flip()
+        -> pose_resize_shortestedge_random() -> pose_crop_random()
+        The random parameters and the intermediate image sizes are drawn as in the chain,
+        but the steps are composed into a single 3x3 affine matrix
+        which is applied once by cv2.warpAffine() straight into the network input size,
+        and once to all the joints by a matrix multiply.
+        The joints are kept as float instead of being rounded at every step.
+    '''
+    global _network_w, _network_h
+    width, height   = meta.width, meta.height
+    affine          = np.eye(3)
+    is_flipped      = False
+
+    # affine and size at the rotated crop, out of which the chain has no image
+    crop_affine     = None
+    crop_size       = None
+
+    if preproc_config.is_scale:
+        scalew = random.uniform(0.8, 1.2)
+        scaleh = random.uniform(0.8, 1.2)
+        neww = int(width * scalew)
+        newh = int(height * scaleh)
+
+        affine          = _get_resize_affine(width, height, neww, newh).dot(affine)
+        width, height   = neww, newh
+
+    if preproc_config.is_rotate:
+        deg = random.uniform(preproc_config.MIN_AUGMENT_ROTATE_ANGLE_DEG, \
+                             preproc_config.MAX_AUGMENT_ROTATE_ANGLE_DEG)
+
+        center = (width * 0.5, height * 0.5)  # x, y
+        rot_m = cv2.getRotationMatrix2D((int(center[0]), int(center[1])), deg, 1)
+        neww, newh = RotationAndCropValid.largest_rotated_rect(width, height, deg)
+        neww = min(neww, width)
+        newh = min(newh, height)
+        newx = int(center[0] - neww * 0.5)
+        newy = int(center[1] - newh * 0.5)
+
+        affine          = _get_translate_affine(-newx, -newy).dot(np.vstack([rot_m, [0.0, 0.0, 1.0]])).dot(affine)
+        width, height   = neww, newh
+
+        crop_affine     = affine
+        crop_size       = (width, height)
+
+    if preproc_config.is_flipping and random.uniform(0, 1.0) <= 0.5:
+        affine          = np.array([[-1.0, 0.0, width - 1.0],
+                                    [0.0, 1.0, 0.0],
+                                    [0.0, 0.0, 1.0]]).dot(affine)
+        is_flipped      = True
+
+    border_color = (0, 0, 0)
+    if preproc_config.is_resize_shortest_edge:
+        ratio_w = float(_network_w) / float(width)
+        ratio_h = float(_network_h) / float(height)
+        ratio = min(ratio_w, ratio_h)
+
+        target_size = int(min(width * ratio + 0.5, height * ratio + 0.5))
+        target_size = int(target_size * random.uniform(0.95, 1.2))
+
+        scale = float(target_size) / float(min(height, width))
+        if height < width:
+            newh, neww = target_size, int(scale * width + 0.5)
+        else:
+            newh, neww = int(scale * height + 0.5), target_size
+
+        affine = _get_resize_affine(width, height, neww, newh).dot(affine)
+
+        pw = ph = mw = mh = 0
+        if neww < _network_w or newh < _network_h:
+            pw = max(0, (_network_w - neww) // 2)
+            ph = max(0, (_network_h - newh) // 2)
+            mw = (_network_w - neww) % 2
+            mh = (_network_h - newh) % 2
+            color1 = random.randint(0, 255)
+            color2 = random.randint(0, 255)
+            color3 = random.randint(0, 255)
+            border_color = (color1, color2, color3)
+
+        affine          = _get_translate_affine(pw, ph).dot(affine)
+        width, height   = neww + pw * 2 + mw, newh + ph * 2 + mh
+
+    if preproc_config.is_crop:
+        x = random.randrange(0, width - _network_w) if width > _network_w else 0
+        y = random.randrange(0, height - _network_h) if height > _network_h else 0
+        affine = _get_translate_affine(-x, -y).dot(affine)
+    else:
+        affine = _get_resize_affine(width, height, _network_w, _network_h).dot(affine)
+
+    img         = meta.img
+    img_affine  = affine
+    # bilinear warping aliases on a large shrink.
+    # In that case the image is first shrunk by INTER_AREA close to the output scale
+    pre_scale = max(np.hypot(affine[0, 0], affine[1, 0]), np.hypot(affine[0, 1], affine[1, 1]))
+    if pre_scale < 0.5:
+        neww = max(1, int(img.shape[1] * pre_scale + 0.5))
+        newh = max(1, int(img.shape[0] * pre_scale + 0.5))
+        img = cv2.resize(img, (neww, newh), interpolation=cv2.INTER_AREA)
+        img_affine = affine.dot(np.linalg.inv(_get_resize_affine(meta.img.shape[1], meta.img.shape[0], neww, newh)))
+
+    dst = cv2.warpAffine(img, img_affine[:2], (_network_w, _network_h),
+                         flags=cv2.INTER_LINEAR,
+                         borderMode=cv2.BORDER_CONSTANT,
+                         borderValue=border_color)
+
+    if crop_affine is not None:
+        # the warp reads the source beyond the rotated crop
+        # where the chain has the padding instead.
+        # After the rotation, the steps are axis-aligned
+        # so that the crop is a rectangle in the output
+        post_affine = affine.dot(np.linalg.inv(crop_affine))
+        xs, ys      = post_affine[:2].dot([[-0.5, crop_size[0] - 0.5],
+                                           [-0.5, crop_size[1] - 0.5],
+                                           [1.0, 1.0]])
+        x0 = max(0, int(math.ceil(xs.min())))
+        y0 = max(0, int(math.ceil(ys.min())))
+        x1 = max(x0, int(math.floor(xs.max())) + 1)
+        y1 = max(y0, int(math.floor(ys.max())) + 1)
+
+        dst[:y0]        = border_color
+        dst[y1:]        = border_color
+        dst[:, :x0]     = border_color
+        dst[:, x1:]     = border_color
+
+    # adjust meta data
+    joints      = meta.joint_list.astype(np.float64)
+    joint_mask  = _get_valid_mask(meta)
+    if is_flipped:
+        joints      = joints[:, FLIP_JOINT_ORDER]
+        joint_mask  = joint_mask[:, FLIP_JOINT_ORDER]
+    joints      = joints.dot(affine[:2, :2].T) + affine[:2, 2]
+    # the chain drops a joint once it is moved beyond -100
+    joint_mask  &= (joints[:, :, 0] >= -100) & (joints[:, :, 1] >= -100)
+    _set_joints(meta, joints, joint_mask)
+
+    meta.width, meta.height = _network_w, _network_h
+    meta.img = dst
+    return meta
+
+
+def pose_to_img(meta_l, is_heatmap_at_target_resol=False):
     global _network_w, _network_h, _scale
     return meta_l.img.astype(np.float32), \
-           meta_l.get_heatmap(target_size=(_network_w // _scale, _network_h // _scale)).astype(np.float32)
+           meta_l.get_heatmap(target_size=(_network_w // _scale, _network_h // _scale),
+                              is_target_resol=is_heatmap_at_target_resol).astype(np.float32)
+
+
+def pose_to_keypoints(meta_l):
+    global _network_w, _network_h
+    return meta_l.img.astype(np.float32), \
+           meta_l.get_keypoint_label(target_size=(_network_w, _network_h))
+
 
+def preprocess_image(img_meta_data,preproc_config,is_training,is_keypoint_label=False):
 
-def preprocess_image(img_meta_data,preproc_config,is_training):
+    # an image from DecodedImageCache is read-only and shared
+    # with the later epochs, so the augmentation works on a copy
+    if not img_meta_data.img.flags.writeable and \
+            not (is_training and preproc_config.is_fused_affine):
+        img_meta_data.img = img_meta_data.img.copy()
 
     # print('[preprocessing] meta.width = %s' % img_meta_data.width)
     # print('[preprocessing] meta.height = %s' % img_meta_data.height)
 
-    if is_training:
+    if is_training and preproc_config.is_fused_affine:
+        # a single warpAffine() instead of the resampling chain below
+        img_meta_data   = pose_affine_random(img_meta_data, preproc_config)
+
+    elif is_training:
         # print ('img_meta_data.width = %s' % img_meta_data.width)
         # print ('img_meta_data.height = %s' % img_meta_data.height)
         if preproc_config.is_scale:
@@ -351,8 +485,13 @@ def preprocess_image(img_meta_data,preproc_config,is_training):
     # print ('------------------------------------------')
     #
 
+    if is_keypoint_label:
+        # the heatmap is rendered per batch in model_fn
+        return pose_to_keypoints(img_meta_data)
+
     # the heatmap is generated based on the original coordinate (x,y)
     # and resize to target size
-    images, labels  = pose_to_img(img_meta_data)
+    images, labels  = pose_to_img(img_meta_data,
+                                  is_heatmap_at_target_resol=preproc_config.is_heatmap_at_target_resol)
 
     return images, labels
\ No newline at end of file
@@ -0,0 +1,511 @@
+# Copyright 2018 Jaewook Kang (jwkang10@gmail.com) All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+# -*- coding: utf-8 -*-
+
+"""In-graph coco augmentation.
+
+    The TF-op version of dataset_augment.preprocess_image() such that
+    the tf.data map runs with no python (and no GIL) per sample.
+    The scale -> rotate -> flip -> resize-shortest-edge -> crop steps are drawn
+    as in dataset_augment.pose_affine_random() and composed into one affine matrix.
+    The image is warped by
+
+        tf.image.crop_and_resize()    the source box seen by the output,
+                                      axis-aligned and at about the output resolution
+        tf.contrib.image.transform()  the remaining rotation into the output grid
+
+    since tf.contrib.image.transform() keeps the input size.
+    The heatmaps are rendered at the target resolution
+    as CocoMetadata.get_heatmap_at_target_resol().
+
+    The random draws come from tf.random_uniform(),
+    so a sample matches the opencv path only in distribution.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import math
+
+import tensorflow as tf
+
+from dataset_augment import FLIP_JOINT_ORDER
+from dataset_augment import _network_w
+from dataset_augment import _network_h
+from dataset_augment import _scale
+from dataset_prepare import HEATMAP_BODYPARTS_LIST
+from dataset_prepare import HEATMAP_EXP_TH
+from dataset_prepare import COCO_TO_JOINT_ORDER
+from dataset_prepare import get_resized_sigma
+
+
+# joint_list value of the masked out joints as in CocoMetadata
+INVALID_JOINT_VALUE = -1000.0
+
+
+
+def _affine(a00, a01, a02, a10, a11, a12):
+    return tf.stack([tf.stack([a00, a01, a02]),
+                     tf.stack([a10, a11, a12]),
+                     tf.constant([0.0, 0.0, 1.0])])
+
+
+
+def _resize_affine(src_w, src_h, dst_w, dst_h):
+    # pixel index mapping of cv2.resize(), see dataset_augment._get_resize_affine()
+    scale_x = dst_w / src_w
+    scale_y = dst_h / src_h
+    return _affine(scale_x, 0.0, 0.5 * scale_x - 0.5,
+                   0.0, scale_y, 0.5 * scale_y - 0.5)
+
+
+
+def _translate_affine(tx, ty):
+    return _affine(1.0, 0.0, tx,
+                   0.0, 1.0, ty)
+
+
+
+def _largest_rotated_rect(w, h, deg):
+    '''
+        tensorpack RotationAndCropValid.largest_rotated_rect() in TF ops
+    '''
+    angle   = deg / 180.0 * math.pi
+    sin_a   = tf.abs(tf.sin(angle))
+    cos_a   = tf.abs(tf.cos(angle))
+
+    width_is_longer         = w >= h
+    side_long, side_short   = tf.maximum(w, h), tf.minimum(w, h)
+
+    # half constrained case
+    x           = 0.5 * side_short
+    half_wr     = tf.where(width_is_longer, x / sin_a, x / cos_a)
+    half_hr     = tf.where(width_is_longer, x / cos_a, x / sin_a)
+
+    # fully constrained case
+    cos_2a      = cos_a * cos_a - sin_a * sin_a
+    full_wr     = (w * cos_a - h * sin_a) / cos_2a
+    full_hr     = (h * cos_a - w * sin_a) / cos_2a
+
+    is_half     = side_short <= 2. * sin_a * cos_a * side_long
+    wr          = tf.where(is_half, half_wr, full_wr)
+    hr          = tf.where(is_half, half_hr, full_hr)
+    return tf.round(wr), tf.round(hr)
+
+
+
+def get_augment_affine(width, height, preproc_config):
+    '''
+        get_augment_affine()
+        draws the augmentation of pose_affine_random() in TF ops
+
+        :param width, height: float32 scalar tensors of the source image size
+        :return: dict of
+            affine:       3x3 float32 tensor from the source pixel index to the output pixel index
+            is_flipped:   bool scalar tensor
+            border_color: (3,) float32 tensor of the padding color
+            crop_rect:    (x0, y0, x1, y1) int32 tensor of the output pixels inside the rotated crop
+    '''
+    network_w, network_h = float(_network_w), float(_network_h)
+
+    affine          = tf.eye(3)
+    is_flipped      = tf.constant(False)
+    border_color    = tf.zeros([3])
+    crop_affine     = None
+    crop_size       = None
+
+    if preproc_config.is_scale:
+        scalew  = tf.random_uniform([], 0.8, 1.2)
+        scaleh  = tf.random_uniform([], 0.8, 1.2)
+        neww    = tf.floor(width * scalew)
+        newh    = tf.floor(height * scaleh)
+
+        affine          = tf.matmul(_resize_affine(width, height, neww, newh), affine)
+        width, height   = neww, newh
+
+    if preproc_config.is_rotate:
+        deg = tf.random_uniform([], preproc_config.MIN_AUGMENT_ROTATE_ANGLE_DEG,
+                                preproc_config.MAX_AUGMENT_ROTATE_ANGLE_DEG)
+
+        # cv2.getRotationMatrix2D() about the truncated center
+        center_x    = tf.floor(width * 0.5)
+        center_y    = tf.floor(height * 0.5)
+        alpha       = tf.cos(deg / 180.0 * math.pi)
+        beta        = tf.sin(deg / 180.0 * math.pi)
+        rot_m       = _affine(alpha, beta, (1.0 - alpha) * center_x - beta * center_y,
+                              -beta, alpha, beta * center_x + (1.0 - alpha) * center_y)
+
+        neww, newh  = _largest_rotated_rect(width, height, deg)
+        neww        = tf.minimum(neww, width)
+        newh        = tf.minimum(newh, height)
+        newx        = tf.floor(width * 0.5 - neww * 0.5)
+        newy        = tf.floor(height * 0.5 - newh * 0.5)
+
+        affine          = tf.matmul(_translate_affine(-newx, -newy), tf.matmul(rot_m, affine))
+        width, height   = neww, newh
+
+        crop_affine     = affine
+        crop_size       = (width, height)
+
+    if preproc_config.is_flipping:
+        is_flipped  = tf.random_uniform([], 0.0, 1.0) <= 0.5
+        flip_affine = _affine(-1.0, 0.0, width - 1.0,
+                              0.0, 1.0, 0.0)
+        affine      = tf.cond(is_flipped, lambda: tf.matmul(flip_affine, affine), lambda: affine)
+
+    if preproc_config.is_resize_shortest_edge:
+        ratio       = tf.minimum(network_w / width, network_h / height)
+        target_size = tf.floor(tf.minimum(width * ratio + 0.5, height * ratio + 0.5))
+        target_size = tf.floor(target_size * tf.random_uniform([], 0.95, 1.2))
+
+        scale       = target_size / tf.minimum(height, width)
+        newh        = tf.where(height < width, target_size, tf.floor(scale * height + 0.5))
+        neww        = tf.where(height < width, tf.floor(scale * width + 0.5), target_size)
+
+        affine      = tf.matmul(_resize_affine(width, height, neww, newh), affine)
+
+        is_padded   = tf.logical_or(neww < network_w, newh < network_h)
+        pw          = tf.where(is_padded, tf.maximum(0.0, tf.floor((network_w - neww) / 2.0)), 0.0)
+        ph          = tf.where(is_padded, tf.maximum(0.0, tf.floor((network_h - newh) / 2.0)), 0.0)
+        mw          = tf.where(is_padded, tf.floormod(network_w - neww, 2.0), 0.0)
+        mh          = tf.where(is_padded, tf.floormod(network_h - newh, 2.0), 0.0)
+
+        border_color    = tf.where(is_padded,
+                                   tf.cast(tf.random_uniform([3], 0, 256, dtype=tf.int32), tf.float32),
+                                   border_color)
+
+        affine          = tf.matmul(_translate_affine(pw, ph), affine)
+        width, height   = neww + pw * 2 + mw, newh + ph * 2 + mh
+
+    if preproc_config.is_crop:
+        # random.randrange(0, width - network_w) if width > network_w else 0
+        x = tf.cast(tf.random_uniform([], 0, tf.maximum(tf.cast(width - network_w, tf.int32), 1),
+                                      dtype=tf.int32), tf.float32)
+        y = tf.cast(tf.random_uniform([], 0, tf.maximum(tf.cast(height - network_h, tf.int32), 1),
+                                      dtype=tf.int32), tf.float32)
+        affine = tf.matmul(_translate_affine(-x, -y), affine)
+    else:
+        affine = tf.matmul(_resize_affine(width, height, network_w, network_h), affine)
+
+    crop_rect = tf.constant([0, 0, _network_w, _network_h])
+    if crop_affine is not None:
+        # the output pixels inside the rotated crop, out of which the chain has the padding.
+        # After the rotation the steps are axis-aligned
+        post_affine = tf.matmul(affine, tf.matrix_inverse(crop_affine))
+        corners     = tf.matmul(post_affine[:2], tf.stack([[-0.5, crop_size[0] - 0.5],
+                                                            [-0.5, crop_size[1] - 0.5],
+                                                            [1.0, 1.0]]))
+        x0 = tf.maximum(0.0, tf.ceil(tf.reduce_min(corners[0])))
+        y0 = tf.maximum(0.0, tf.ceil(tf.reduce_min(corners[1])))
+        x1 = tf.maximum(x0, tf.floor(tf.reduce_max(corners[0])) + 1.0)
+        y1 = tf.maximum(y0, tf.floor(tf.reduce_max(corners[1])) + 1.0)
+        crop_rect = tf.cast(tf.stack([x0, y0, x1, y1]), tf.int32)
+
+    return {'affine'        : affine,
+            'is_flipped'    : is_flipped,
+            'border_color'  : border_color,
+            'crop_rect'     : crop_rect}
+
+
+
+def _get_canvas_size(preproc_config):
+    # the output square rotated by the largest angle fits in the canvas
+    max_rad = 0.0
+    if preproc_config.is_rotate:
+        max_rad = max(abs(preproc_config.MIN_AUGMENT_ROTATE_ANGLE_DEG),
+                      abs(preproc_config.MAX_AUGMENT_ROTATE_ANGLE_DEG)) / 180.0 * math.pi
+    extent = max(_network_w, _network_h) * (abs(math.cos(max_rad)) + abs(math.sin(max_rad)))
+    return int(math.ceil(extent)) + 2
+
+
+
+def warp_image(img, affine, border_color, crop_rect, canvas_size):
+    '''
+        warp_image()
+        cv2.warpAffine() of pose_affine_random() into the (_network_h, _network_w) output
+        by the affine from the source pixel index to the output pixel index.
+        The output outside the source and the rotated crop is border_color.
+
+        :param img: (h, w, c) float32 tensor
+    '''
+    img_h   = tf.cast(tf.shape(img)[0], tf.float32)
+    img_w   = tf.cast(tf.shape(img)[1], tf.float32)
+
+    # bilinear sampling aliases on a large shrink.
+    # In that case the image is first shrunk by area resizing close to the output scale
+    pre_scale = tf.maximum(tf.norm(affine[0:2, 0]), tf.norm(affine[0:2, 1]))
+
+    def _pre_shrink():
+        neww = tf.maximum(1.0, tf.floor(img_w * pre_scale + 0.5))
+        newh = tf.maximum(1.0, tf.floor(img_h * pre_scale + 0.5))
+        img_shrunk = tf.image.resize_area([img], tf.cast(tf.stack([newh, neww]), tf.int32))[0]
+        return img_shrunk, tf.matmul(affine, tf.matrix_inverse(_resize_affine(img_w, img_h, neww, newh)))
+
+    img, affine = tf.cond(pre_scale < 0.5, _pre_shrink, lambda: (img, affine))
+    img_h       = tf.cast(tf.shape(img)[0], tf.float32)
+    img_w       = tf.cast(tf.shape(img)[1], tf.float32)
+
+    # coverage channel for the border fill
+    img = tf.concat([img, tf.ones_like(img[:, :, 0:1])], axis=2)
+
+    # source box seen by the output pixels
+    inv_affine  = tf.matrix_inverse(affine)
+    corners     = tf.matmul(inv_affine[:2], tf.constant([[-0.5, _network_w - 0.5, -0.5, _network_w - 0.5],
+                                                         [-0.5, -0.5, _network_h - 0.5, _network_h - 0.5],
+                                                         [1.0, 1.0, 1.0, 1.0]]))
+    src_x0, src_x1 = tf.reduce_min(corners[0]), tf.reduce_max(corners[0])
+    src_y0, src_y1 = tf.reduce_min(corners[1]), tf.reduce_max(corners[1])
+
+    # the canvas samples the box corner-aligned as crop_and_resize() does
+    canvas = tf.image.crop_and_resize(image         =[img],
+                                      boxes         =[tf.stack([src_y0 / tf.maximum(img_h - 1.0, 1.0),
+                                                                src_x0 / tf.maximum(img_w - 1.0, 1.0),
+                                                                src_y1 / tf.maximum(img_h - 1.0, 1.0),
+                                                                src_x1 / tf.maximum(img_w - 1.0, 1.0)])],
+                                      box_ind       =[0],
+                                      crop_size     =[canvas_size, canvas_size],
+                                      method        ='bilinear',
+                                      extrapolation_value=0.0)[0]
+
+    # output pixel index -> canvas pixel index
+    canvas_sx       = (canvas_size - 1.0) / tf.maximum(src_x1 - src_x0, 1e-6)
+    canvas_sy       = (canvas_size - 1.0) / tf.maximum(src_y1 - src_y0, 1e-6)
+    canvas_affine   = tf.matmul(_affine(canvas_sx, 0.0, -src_x0 * canvas_sx,
+                                        0.0, canvas_sy, -src_y0 * canvas_sy), inv_affine)
+
+    warped = tf.contrib.image.transform(images        =canvas,
+                                        transforms    =tf.concat([tf.reshape(canvas_affine[:2], [6]),
+                                                                  tf.zeros([2])], axis=0),
+                                        interpolation ='BILINEAR')
+    warped = warped[:_network_h, :_network_w]
+
+    # the rows and columns outside the rotated crop are padding in the chain
+    x0, y0, x1, y1  = tf.unstack(crop_rect)
+    xs              = tf.range(_network_w)
+    ys              = tf.range(_network_h)
+    is_in_crop      = tf.logical_and(tf.logical_and(ys >= y0, ys < y1)[:, tf.newaxis],
+                                     tf.logical_and(xs >= x0, xs < x1)[tf.newaxis, :])
+    coverage        = warped[:, :, -1:] * tf.cast(is_in_crop, tf.float32)[:, :, tf.newaxis]
+    warped          = warped[:, :, :-1] * tf.cast(is_in_crop, tf.float32)[:, :, tf.newaxis]
+
+    return warped + (1.0 - coverage) * border_color
+
+
+
+def get_joint_list(keypoints):
+    '''
+        CocoMetadata.get_joint_list() in TF ops
+        :param keypoints: (persons, 14, 3) float32 tensor in the annotation order
+        :return: (persons, 14, 2) float32 joint_list, (persons, 14) bool joint_mask
+    '''
+    keypoints   = tf.gather(keypoints, COCO_TO_JOINT_ORDER, axis=1)
+    joint_mask  = (keypoints[:, :, 2] >= 1) & (keypoints[:, :, 0] > 0) & (keypoints[:, :, 1] > 0)
+    joint_list  = tf.where(tf.stack([joint_mask, joint_mask], axis=2), keypoints[:, :, 0:2],
+                           tf.fill(tf.shape(keypoints[:, :, 0:2]), INVALID_JOINT_VALUE))
+    return joint_list, joint_mask
+
+
+
+def transform_joints(joint_list, joint_mask, affine, is_flipped):
+    '''
+        the joint transform of pose_affine_random() in TF ops
+        :return: transformed (joint_list, joint_mask)
+    '''
+    joint_list  = tf.cond(is_flipped, lambda: tf.gather(joint_list, FLIP_JOINT_ORDER, axis=1), lambda: joint_list)
+    joint_mask  = tf.cond(is_flipped, lambda: tf.gather(joint_mask, FLIP_JOINT_ORDER, axis=1), lambda: joint_mask)
+
+    joints      = tf.tensordot(joint_list, tf.transpose(affine[:2, :2]), axes=1) + affine[:2, 2]
+
+    # the chain drops a joint once it is moved beyond -100
+    joint_mask  = joint_mask & (joints[:, :, 0] >= -100) & (joints[:, :, 1] >= -100)
+    joint_list  = tf.where(tf.stack([joint_mask, joint_mask], axis=2), joints,
+                           tf.fill(tf.shape(joints), INVALID_JOINT_VALUE))
+    return joint_list, joint_mask
+
+
+
+def _get_resized_sigma(sigma, scale):
+    # get_resized_sigma() for a scalar scale tensor
+    return tf.where(scale >= 1.0,
+                    sigma * scale,
+                    tf.sqrt(sigma ** 2 + (1.0 / scale ** 2 - 1.0) / 12.0) * scale)
+
+
+
+def _get_gaussians(centers_x, centers_y, sigma_x, sigma_y, target_size):
+    '''
+        :param centers_x, centers_y: (n, planes) float32 tensors on the heatmap grid
+        :return: (n, h, w, planes) gaussians cut off at HEATMAP_EXP_TH
+    '''
+    target_w, target_h = target_size
+
+    xs  = tf.range(target_w, dtype=tf.float32)[tf.newaxis, tf.newaxis, :, tf.newaxis]
+    ys  = tf.range(target_h, dtype=tf.float32)[tf.newaxis, :, tf.newaxis, tf.newaxis]
+
+    exp = (xs - centers_x[:, tf.newaxis, tf.newaxis, :]) ** 2 / 2.0 / sigma_x / sigma_x \
+          + (ys - centers_y[:, tf.newaxis, tf.newaxis, :]) ** 2 / 2.0 / sigma_y / sigma_y
+    return tf.where(exp <= HEATMAP_EXP_TH, tf.exp(-exp), tf.zeros_like(exp))
+
+
+
+def render_heatmaps(joint_list, sigma, scale, target_size):
+    '''
+        render_heatmaps()
+        CocoMetadata.get_heatmap_at_target_resol() in TF ops.
+        The windows of put_heatmaps() cover the whole cut-off ellipse,
+        so that here each plane is a full-grid exp with the same cut-off.
+
+        :param joint_list: (persons, 14, 2) float32 tensor
+        :param scale: (scale_x, scale_y) float32 scalar tensors from the joint coordinate to the heatmap grid
+        :param target_size: (w, h) of the heatmap
+        :return: (h, w, len(HEATMAP_BODYPARTS_LIST)) float32 heatmap tensor
+    '''
+    target_w, target_h  = target_size
+    scale_x             = tf.convert_to_tensor(scale[0], dtype=tf.float32)
+    scale_y             = tf.convert_to_tensor(scale[1], dtype=tf.float32)
+    num_planes          = len(HEATMAP_BODYPARTS_LIST)
+
+    # (persons, planes, 2)
+    joints      = tf.gather(joint_list, HEATMAP_BODYPARTS_LIST, axis=1)
+    is_invalid  = tf.logical_or(joints[:, :, 0] < 0, joints[:, :, 1] < 0)
+
+    # uniform labeling for mislabeled data overwrites the whole plane
+    # so that only the people after the last mislabeled one are drawn on it
+    num_people      = tf.shape(joints)[0]
+    person_index    = tf.tile(tf.range(num_people)[:, tf.newaxis], [1, num_planes])
+    last_invalid    = tf.reduce_max(tf.concat([tf.where(is_invalid, person_index, -tf.ones_like(person_index)),
+                                               -tf.ones([1, num_planes], dtype=tf.int32)], axis=0), axis=0)
+    is_drawn        = tf.logical_and(tf.logical_not(is_invalid), person_index > last_invalid)
+
+    # (persons, h, w, planes)
+    gaussian = _get_gaussians(centers_x     =(joints[:, :, 0] + 0.5) * scale_x - 0.5,
+                              centers_y     =(joints[:, :, 1] + 0.5) * scale_y - 0.5,
+                              sigma_x       =_get_resized_sigma(sigma, scale_x),
+                              sigma_y       =_get_resized_sigma(sigma, scale_y),
+                              target_size   =target_size)
+    gaussian = gaussian * tf.cast(is_drawn, tf.float32)[:, tf.newaxis, tf.newaxis, :]
+
+    heatmap = tf.reduce_max(tf.concat([gaussian, tf.zeros([1, target_h, target_w, num_planes])], axis=0),
+                            axis=0)
+    uniform = tf.where(last_invalid >= 0,
+                       tf.fill([num_planes], 1.0 / (target_w * target_h)),
+                       tf.zeros([num_planes]))
+    return tf.maximum(heatmap, uniform)
+
+
+
+def render_keypoint_heatmaps(keypoints, sigma, scale, target_size):
+    '''
+        render_keypoint_heatmaps()
+        renders the heatmaps of a batch of keypoint labels in one op
+        as render_heatmaps() does for a single person.
+        The plane of an invisible keypoint is uniform as for mislabeled data.
+
+        :param keypoints: (batch, planes, 3) float32 tensor of (x, y, visible)
+        :param scale: (scale_x, scale_y) from the keypoint coordinate to the heatmap grid
+        :param target_size: (w, h) of the heatmap
+        :return: (batch, h, w, planes) float32 heatmap tensor
+    '''
+    target_w, target_h  = target_size
+    scale_x, scale_y    = float(scale[0]), float(scale[1])
+
+    with tf.name_scope(name='render_keypoint_heatmaps', values=[keypoints]):
+        gaussian = _get_gaussians(centers_x     =(keypoints[:, :, 0] + 0.5) * scale_x - 0.5,
+                                  centers_y     =(keypoints[:, :, 1] + 0.5) * scale_y - 0.5,
+                                  sigma_x       =get_resized_sigma(sigma, scale_x),
+                                  sigma_y       =get_resized_sigma(sigma, scale_y),
+                                  target_size   =target_size)
+
+        is_visible  = (keypoints[:, :, 2] > 0)[:, tf.newaxis, tf.newaxis, :]
+        heatmap     = tf.where(tf.tile(is_visible, [1, target_h, target_w, 1]),
+                               gaussian,
+                               tf.fill(tf.shape(gaussian), 1.0 / (target_w * target_h)))
+    return heatmap
+
+
+
+def get_keypoint_label(joint_list, scale):
+    '''
+        CocoMetadata.get_keypoint_label() in TF ops
+        :param scale: (scale_x, scale_y) from the joint coordinate to the network input
+        :return: (len(HEATMAP_BODYPARTS_LIST), 3) float32 tensor of (x, y, visible)
+    '''
+    # the first person, or none
+    joint_list  = tf.concat([joint_list,
+                             tf.fill([1, tf.shape(joint_list)[1], 2], INVALID_JOINT_VALUE)], axis=0)
+    joints      = tf.gather(joint_list[0], HEATMAP_BODYPARTS_LIST)
+    is_visible  = tf.logical_and(joints[:, 0] >= 0, joints[:, 1] >= 0)
+
+    joints      = (joints + 0.5) * tf.stack([scale[0], scale[1]]) - 0.5
+    joints      = joints * tf.cast(is_visible, tf.float32)[:, tf.newaxis]
+    return tf.concat([joints, tf.cast(is_visible, tf.float32)[:, tf.newaxis]], axis=1)
+
+
+
+def preprocess_image(img, keypoints, preproc_config, sigma, is_training, is_keypoint_label=False):
+    '''
+        preprocess_image()
+        the TF-op version of dataset_augment.preprocess_image()
+        with is_fused_affine and is_heatmap_at_target_resol
+
+        :param img: (h, w, 3) uint8 tensor in the BGR order of cv2
+        :param keypoints: (persons, 14, 3) float32 tensor of CocoAnnotationIndex.get_keypoints()
+        :param is_keypoint_label: return the keypoint label of get_keypoint_label() instead of the heatmap
+        :return: (_network_h, _network_w, 3) float32 image,
+                 (_network_h // _scale, _network_w // _scale, 4) float32 heatmap
+                 or (4, 3) float32 keypoint label
+    '''
+    target_size = (_network_w // _scale, _network_h // _scale)
+
+    with tf.name_scope(name='preprocess_image_tf', values=[img, keypoints]):
+        img     = tf.cast(img, tf.float32)
+        height  = tf.cast(tf.shape(img)[0], tf.float32)
+        width   = tf.cast(tf.shape(img)[1], tf.float32)
+
+        joint_list, joint_mask = get_joint_list(keypoints)
+
+        if is_training:
+            augment = get_augment_affine(width          =width,
+                                         height         =height,
+                                         preproc_config =preproc_config)
+
+            img = warp_image(img            =img,
+                             affine         =augment['affine'],
+                             border_color   =augment['border_color'],
+                             crop_rect      =augment['crop_rect'],
+                             canvas_size    =_get_canvas_size(preproc_config))
+
+            joint_list, joint_mask = transform_joints(joint_list    =joint_list,
+                                                      joint_mask    =joint_mask,
+                                                      affine        =augment['affine'],
+                                                      is_flipped    =augment['is_flipped'])
+            width, height = float(_network_w), float(_network_h)
+        else:
+            # the joints stay in the source coordinate as in the py_func path
+            img = tf.image.resize_area([img], [_network_h, _network_w])[0]
+
+        img.set_shape([_network_h, _network_w, 3])
+
+        if is_keypoint_label:
+            return img, get_keypoint_label(joint_list   =joint_list,
+                                           scale        =(_network_w / width, _network_h / height))
+
+        heatmap = render_heatmaps(joint_list    =joint_list,
+                                  sigma         =sigma,
+                                  scale         =(target_size[0] / width, target_size[1] / height),
+                                  target_size   =target_size)
+
+    return img, heatmap
@@ -0,0 +1,142 @@
+# Copyright 2018 Jaewook Kang (jwkang10@gmail.com) All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+# -*- coding: utf-8 -*-
+
+"""Decoded image cache for the coco loader.
+
+    Every epoch re-reads and re-decodes the same jpegs.
+    DecodedImageCache keeps the decoded uint8 images in memory
+    up to a byte budget with LRU eviction.
+    With spill_dir given, every decoded image is also stored as a .npy file
+    and later loaded by np.load(mmap_mode='r'),
+    so that a restarted training skips the jpeg decode entirely.
+
+    The cached arrays are read-only. The augmentation has to work on a copy
+    (see dataset_augment.preprocess_image()).
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+
+class DecodedImageCache(object):
+    """LRU cache of decoded images
+        Args:
+            read_fn:   function decoding an image path to an uint8 array
+            max_bytes: memory budget of the cached images in bytes
+            spill_dir: directory of the .npy spill files; None for no spill
+    """
+
+    def __init__(self, read_fn, max_bytes, spill_dir=None):
+
+        self.read_fn    = read_fn
+        self.max_bytes  = max_bytes
+        self.spill_dir  = spill_dir
+
+        self.images     = OrderedDict()
+        self.num_bytes  = 0
+
+        # tf.py_func calls get() from several threads
+        self.lock       = threading.Lock()
+
+        self.num_hits   = 0
+        self.num_spill_hits = 0
+        self.num_misses = 0
+
+        if self.spill_dir and not os.path.exists(self.spill_dir):
+            try:
+                os.makedirs(self.spill_dir)
+            except OSError:
+                # made by another worker in the meantime
+                if not os.path.isdir(self.spill_dir):
+                    raise
+
+
+
+    def _get_spill_path(self, img_path):
+        # the file size and mtime are in the key not to read a stale spill
+        img_stat = os.stat(img_path)
+        key      = '%s:%d:%d' % (os.path.abspath(img_path), img_stat.st_size, int(img_stat.st_mtime))
+        return os.path.join(self.spill_dir,
+                            hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npy')
+
+
+
+    def _spill(self, spill_path, img):
+        # write then rename not to leave a broken file for the other workers
+        tmp_path = '%s.%d.tmp.npy' % (spill_path[:-len('.npy')], os.getpid())
+        np.save(tmp_path, img)
+        os.rename(tmp_path, spill_path)
+
+
+
+    def _put(self, img_path, img):
+        if img.nbytes > self.max_bytes:
+            return
+
+        with self.lock:
+            if img_path in self.images:
+                return
+
+            self.images[img_path]   = img
+            self.num_bytes          += img.nbytes
+
+            while self.num_bytes > self.max_bytes:
+                _, evicted_img  = self.images.popitem(last=False)
+                self.num_bytes  -= evicted_img.nbytes
+
+
+
+    def get(self, img_path):
+        '''
+            get()
+            :return: the read-only decoded image of img_path
+        '''
+        with self.lock:
+            img = self.images.pop(img_path, None)
+            if img is not None:
+                # reinsert as the most recently used
+                self.images[img_path] = img
+                self.num_hits += 1
+                return img
+
+        spill_path = self._get_spill_path(img_path) if self.spill_dir else None
+
+        if spill_path is not None and os.path.exists(spill_path):
+            img = np.load(spill_path, mmap_mode='r')
+            self.num_spill_hits += 1
+        else:
+            img = self.read_fn(img_path)
+            self.num_misses += 1
+
+            if img is None:
+                # not decodable; not cached
+                return img
+
+            img.setflags(write=False)
+            if spill_path is not None:
+                self._spill(spill_path, img)
+
+        self._put(img_path, img)
+        return img
@@ -0,0 +1,201 @@
+# Copyright 2018 Jaewook Kang (jwkang10@gmail.com) All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+# -*- coding: utf-8 -*-
+
+"""Flat numpy index of a coco-form annotation json.
+
+    The pycocotools COCO object costs three dict walks per sample
+    (loadImgs, getAnnIds, loadAnns) and cannot be shared by worker processes
+    without pickling. Here the annotation json is flattened once into
+    contiguous arrays and persisted to a .npz sidecar next to the json:
+
+        image_ids        (N,)          int64
+        widths, heights  (N,)          int32
+        filename_blob    (total bytes) uint8,  utf-8 file names back to back
+        filename_offsets (N+1,)        int64
+        person_offsets   (N+1,)        int64
+        keypoints        (P, 14, 3)    float64, (x, y, v) of the annotated persons
+
+    so that a sample lookup by its row is a few array slices.
+    Persons with num_keypoints == 0 are dropped as in CocoMetadata.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import json
+import tempfile
+
+import numpy as np
+
+
+INDEX_FILE_SUFFIX   = '.index.npz'
+INDEX_VERSION       = 1
+NUM_OF_COCO_PARTS   = 14
+
+
+
+class CocoAnnotationIndex(object):
+
+    def __init__(self, image_ids,
+                 widths,
+                 heights,
+                 filename_blob,
+                 filename_offsets,
+                 person_offsets,
+                 keypoints):
+
+        self.image_ids          = image_ids
+        self.widths             = widths
+        self.heights            = heights
+        self.filename_blob      = filename_blob
+        self.filename_offsets   = filename_offsets
+        self.person_offsets     = person_offsets
+        self.keypoints          = keypoints
+
+
+
+    def __len__(self):
+        return self.image_ids.shape[0]
+
+
+
+    @staticmethod
+    def get_index_path(json_path):
+        return json_path + INDEX_FILE_SUFFIX
+
+
+
+    @classmethod
+    def load_or_build(cls, json_path):
+        '''
+            load_or_build()
+            loads the sidecar index of json_path.
+            The index is (re)built when it is missing
+            or was built from a json of another mtime or size.
+        '''
+        index_path  = cls.get_index_path(json_path)
+        json_stat   = os.stat(json_path)
+
+        if os.path.exists(index_path):
+            with np.load(index_path) as index_npz:
+                if int(index_npz['version']) == INDEX_VERSION and \
+                    int(index_npz['source_size']) == json_stat.st_size and \
+                    float(index_npz['source_mtime']) == json_stat.st_mtime:
+
+                    return cls(**dict((key, index_npz[key]) for key in
+                                      ['image_ids', 'widths', 'heights',
+                                       'filename_blob', 'filename_offsets',
+                                       'person_offsets', 'keypoints']))
+
+        anno_index = cls.build(json_path)
+        try:
+            anno_index.save(index_path, json_stat)
+        except (IOError, OSError) as err:
+            # e.g. a read-only data dir; the index is built again next time
+            print('[CocoAnnotationIndex] index not saved to %s (%s); using it in memory'
+                  % (index_path, err))
+        return anno_index
+
+
+
+    @classmethod
+    def build(cls, json_path):
+        '''
+            build()
+            flattens the annotation json into the index arrays.
+            The images keep their order in the json
+            and the persons keep their annotation order within an image.
+        '''
+        with open(json_path, 'r') as json_file:
+            dataset = json.load(json_file)
+
+        images      = dataset['images']
+        row_of_id   = dict((img['id'], row) for row, img in enumerate(images))
+
+        persons_per_row = [[] for _ in images]
+        for ann in dataset.get('annotations', []):
+            if ann.get('num_keypoints', 0) == 0:
+                continue
+            persons_per_row[row_of_id[ann['image_id']]].append(ann['keypoints'])
+
+        filenames = [img['file_name'].encode('utf-8') for img in images]
+
+        filename_offsets        = np.zeros(len(images) + 1, dtype=np.int64)
+        filename_offsets[1:]    = np.cumsum([len(name) for name in filenames])
+
+        person_offsets          = np.zeros(len(images) + 1, dtype=np.int64)
+        person_offsets[1:]      = np.cumsum([len(persons) for persons in persons_per_row])
+
+        keypoints = np.array([kp for persons in persons_per_row for kp in persons],
+                             dtype=np.float64).reshape(-1, NUM_OF_COCO_PARTS, 3)
+
+        return cls(image_ids        =np.array([img['id'] for img in images], dtype=np.int64),
+                   widths           =np.array([img['width'] for img in images], dtype=np.int32),
+                   heights          =np.array([img['height'] for img in images], dtype=np.int32),
+                   filename_blob    =np.frombuffer(b''.join(filenames), dtype=np.uint8).copy(),
+                   filename_offsets =filename_offsets,
+                   person_offsets   =person_offsets,
+                   keypoints        =keypoints)
+
+
+
+    def save(self, index_path, json_stat):
+        # write then rename not to leave a broken index behind.
+        # The temp file is unique to the process as more may build the same index
+        tmp_fd, tmp_path = tempfile.mkstemp(prefix =os.path.basename(index_path) + '.',
+                                            suffix ='.tmp',
+                                            dir    =os.path.dirname(os.path.abspath(index_path)))
+        try:
+            with os.fdopen(tmp_fd, 'wb') as tmp_file:
+                np.savez(tmp_file,
+                         version            =np.array(INDEX_VERSION),
+                         source_size        =np.array(json_stat.st_size),
+                         source_mtime       =np.array(json_stat.st_mtime),
+                         image_ids          =self.image_ids,
+                         widths             =self.widths,
+                         heights            =self.heights,
+                         filename_blob      =self.filename_blob,
+                         filename_offsets   =self.filename_offsets,
+                         person_offsets     =self.person_offsets,
+                         keypoints          =self.keypoints)
+            os.rename(tmp_path, index_path)
+        except:
+            os.remove(tmp_path)
+            raise
+
+
+
+    def get_filename(self, row):
+        begin, end = self.filename_offsets[row], self.filename_offsets[row + 1]
+        return self.filename_blob[begin:end].tobytes().decode('utf-8')
+
+
+
+    def get_keypoints(self, row):
+        '''
+            :return: (persons, 14, 3) view of the keypoints of the image at row
+        '''
+        return self.keypoints[self.person_offsets[row]:self.person_offsets[row + 1]]
+
+
+
+    def get_row(self, image_id):
+        rows = np.flatnonzero(self.image_ids == image_id)
+        if rows.size == 0:
+            raise KeyError('[CocoAnnotationIndex] no image id = %s' % image_id)
+        return int(rows[0])
@@ -0,0 +1,372 @@
+# Copyright 2018 Jaewook Kang (jwkang10@gmail.com) All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+# -*- coding: utf-8 -*-
+
+"""Pre-baked augmented dataset for fixed-epoch training.
+
+    A hyperparameter sweep retrains the same model on the same data many times
+    and every run pays preprocess_image() and get_heatmap() per sample per epoch.
+    Here K augmented variants of every image are generated once
+    and written into sharded binary files of fixed-length records:
+
+        image    (256, 256, 3)  uint8
+        heatmap  (64, 64, 4)    float16
+
+    which DataSetInput(dataloader_mode='prebaked') streams by
+    tf.data.FixedLengthRecordDataset with no python in the loop.
+
+    Every variant is augmented with its own seed, derived from
+    (base_seed, row, variant) and recorded in the manifest,
+    so that any record is reproducible regardless of the worker scheduling.
+
+    The evaluation set has no augmentation, so it is preprocessed
+    in the same records only once by get_eval_cache() into a directory
+    keyed by the dataset and the preprocessing config.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import json
+import hashlib
+import random
+import multiprocessing
+from os.path import join
+
+import numpy as np
+import cv2
+
+import dataset_augment
+from dataset_prepare import CocoMetadata
+from dataset_index import CocoAnnotationIndex
+
+
+MANIFEST_FILENAME   = 'prebake_manifest.json'
+EVAL_CACHE_DIRNAME  = 'eval-%s'
+SHARD_FILENAME      = 'prebake-%05d-of-%05d.bin'
+SHARD_DIGEST_SUFFIX = '.sha1'
+PREBAKE_VERSION     = 1
+
+IMAGE_DTYPE         = np.uint8
+HEATMAP_DTYPE       = np.float16
+
+
+# per-worker state inherited at fork time
+_worker_anno_index      = None
+_worker_data_dir        = None
+_worker_preproc_config  = None
+_worker_out_dir         = None
+_worker_is_training     = True
+
+
+
+def get_variant_seed(base_seed, row, variant):
+    '''
+        get_variant_seed()
+        :return: the augmentation seed of a (row, variant) record
+    '''
+    return int(np.random.RandomState([base_seed, row, variant]).randint(0, 2 ** 31 - 1))
+
+
+
+def get_record_bytes(image_shape, heatmap_shape):
+    return int(np.prod(image_shape)) * np.dtype(IMAGE_DTYPE).itemsize + \
+           int(np.prod(heatmap_shape)) * np.dtype(HEATMAP_DTYPE).itemsize
+
+
+
+def get_image_path(anno_index, row, data_dir):
+    # file_name in the coco-form json is '<dataset>/<dir>/<image>'
+    filename_item_list = anno_index.get_filename(row).split('/')
+    return join(data_dir, filename_item_list[1] + '/' + filename_item_list[2])
+
+
+
+def load_manifest(prebake_dir):
+    with open(join(prebake_dir, MANIFEST_FILENAME), 'r') as manifest_file:
+        manifest = json.load(manifest_file)
+
+    if manifest['version'] != PREBAKE_VERSION:
+        raise ValueError('[dataset_prebake] unsupported prebake version = %s' % manifest['version'])
+    return manifest
+
+
+
+def make_record(anno_index, row, data_dir, preproc_config, seed, is_training=True):
+    '''
+        make_record()
+        augments the image at row with the given seed
+        or only resizes it if not is_training
+        :return: (uint8 image, float16 heatmap)
+    '''
+    # the augmentation draws from both the random module and np.random
+    random.seed(seed)
+    np.random.seed(seed)
+
+    img_meta_data = CocoMetadata(idx        =anno_index.image_ids[row],
+                                 img_path   =get_image_path(anno_index, row, data_dir),
+                                 img_meta   ={'height': anno_index.heights[row],
+                                              'width' : anno_index.widths[row]},
+                                 annotations=None,
+                                 sigma      =preproc_config.heatmap_std,
+                                 keypoints  =anno_index.get_keypoints(row))
+
+    images, labels = dataset_augment.preprocess_image(img_meta_data =img_meta_data,
+                                                      preproc_config=preproc_config,
+                                                      is_training   =is_training)
+
+    images = np.clip(np.rint(images), 0, 255).astype(IMAGE_DTYPE)
+    labels = labels.astype(HEATMAP_DTYPE)
+    return images, labels
+
+
+
+def _init_worker(anno_index, data_dir, preproc_config, out_dir, is_training):
+    global _worker_anno_index, _worker_data_dir, _worker_preproc_config, _worker_out_dir
+    global _worker_is_training
+
+    _worker_anno_index      = anno_index
+    _worker_data_dir        = data_dir
+    _worker_preproc_config  = preproc_config
+    _worker_out_dir         = out_dir
+    _worker_is_training     = is_training
+
+    # one process per core already
+    cv2.setNumThreads(0)
+
+
+
+def _read_shard_digest(shard_path):
+    if not os.path.exists(shard_path + SHARD_DIGEST_SUFFIX):
+        return None
+    with open(shard_path + SHARD_DIGEST_SUFFIX, 'r') as digest_file:
+        return digest_file.read().strip()
+
+
+
+def _write_shard(shard):
+    '''
+        _write_shard()
+        writes the records of a single shard.
+        A shard already on disk with the expected size and digest is kept,
+        so an interrupted prebake() resumes where it stopped
+        while the shards of other seeds, configs or datasets are rewritten.
+    '''
+    shard_path      = join(_worker_out_dir, shard['filename'])
+    expected_bytes  = shard['num_records'] * shard['record_bytes']
+
+    if os.path.exists(shard_path) and os.path.getsize(shard_path) == expected_bytes and \
+            _read_shard_digest(shard_path) == shard['digest']:
+        return shard['filename']
+
+    # write then rename not to leave a broken shard behind
+    tmp_path = shard_path + '.tmp'
+    with open(tmp_path, 'wb') as shard_file:
+        for row, seed in zip(shard['rows'], shard['seeds']):
+            images, labels = make_record(anno_index    =_worker_anno_index,
+                                         row           =row,
+                                         data_dir      =_worker_data_dir,
+                                         preproc_config=_worker_preproc_config,
+                                         seed          =seed,
+                                         is_training   =_worker_is_training)
+            shard_file.write(images.tobytes())
+            shard_file.write(labels.tobytes())
+
+    os.rename(tmp_path, shard_path)
+
+    # written after the shard; a shard without its digest is rewritten
+    with open(shard_path + SHARD_DIGEST_SUFFIX, 'w') as digest_file:
+        digest_file.write(shard['digest'])
+    return shard['filename']
+
+
+
+def _get_config_items(json_path, data_dir, preproc_config, image_shape, heatmap_shape):
+    # the dataset and the config the records depend on
+    json_stat = os.stat(json_path)
+    return [PREBAKE_VERSION,
+            os.path.abspath(json_path), json_stat.st_size, int(json_stat.st_mtime),
+            os.path.abspath(data_dir),
+            list(image_shape), list(heatmap_shape),
+            sorted((name, repr(value)) for name, value in preproc_config.__dict__.items())]
+
+
+
+def _get_digest(items):
+    return hashlib.sha1(json.dumps(items).encode('utf-8')).hexdigest()
+
+
+
+def prebake(json_path,
+            data_dir,
+            out_dir,
+            preproc_config,
+            image_shape,
+            heatmap_shape,
+            num_variants    =8,
+            num_shards      =64,
+            num_workers     =None,
+            base_seed       =0,
+            is_training     =True):
+    '''
+        prebake()
+        generates num_variants augmented records per image of json_path
+        into num_shards binary shards in out_dir with a manifest.
+
+        :param image_shape:   (height, width, channel) of the preprocessed image
+        :param heatmap_shape: (height, width, keypoints) of the heatmap
+        :param is_training:   False for the records of the evaluation
+                              in the order of the index with no augmentation
+        :return: the manifest dict
+    '''
+    if num_workers is None or num_workers <= 0:
+        num_workers = multiprocessing.cpu_count()
+
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    # the manifest of a previous prebake goes first
+    # not to describe the shards rewritten below
+    if os.path.exists(join(out_dir, MANIFEST_FILENAME)):
+        os.remove(join(out_dir, MANIFEST_FILENAME))
+
+    anno_index      = CocoAnnotationIndex.load_or_build(json_path)
+    record_bytes    = get_record_bytes(image_shape, heatmap_shape)
+    config_items    = _get_config_items(json_path, data_dir, preproc_config, image_shape, heatmap_shape)
+
+    # the records are shuffled over the shards
+    # so that a shard interleave mixes the images
+    records = [(row, variant) for row in range(len(anno_index))
+               for variant in range(num_variants)]
+    if is_training:
+        np.random.RandomState(base_seed).shuffle(records)
+
+    shards = []
+    for shard_idx, shard_records in enumerate(np.array_split(np.array(records, dtype=np.int64).reshape(-1, 2),
+                                                             num_shards)):
+        rows        = [int(row) for row in shard_records[:, 0]]
+        variants    = [int(variant) for variant in shard_records[:, 1]]
+        seeds       = [get_variant_seed(base_seed, row, variant)
+                       for row, variant in zip(rows, variants)]
+        shards.append({'filename'    : SHARD_FILENAME % (shard_idx, num_shards),
+                       'num_records' : len(rows),
+                       'record_bytes': record_bytes,
+                       'rows'        : rows,
+                       'image_ids'   : [int(anno_index.image_ids[row]) for row in rows],
+                       'variants'    : variants,
+                       'seeds'       : seeds,
+                       'digest'      : _get_digest([config_items, is_training, rows, seeds])})
+
+    pool = multiprocessing.Pool(processes  =num_workers,
+                                initializer=_init_worker,
+                                initargs   =(anno_index, data_dir, preproc_config, out_dir, is_training))
+    try:
+        for num_done, filename in enumerate(pool.imap_unordered(_write_shard, shards)):
+            print('[dataset_prebake] %s written (%d/%d)' % (filename, num_done + 1, num_shards))
+    finally:
+        pool.terminate()
+        pool.join()
+
+    manifest = {'version'       : PREBAKE_VERSION,
+                'json_path'     : os.path.abspath(json_path),
+                'num_images'    : len(anno_index),
+                'num_variants'  : num_variants,
+                'base_seed'     : base_seed,
+                'is_training'   : is_training,
+                'image_shape'   : list(image_shape),
+                'heatmap_shape' : list(heatmap_shape),
+                'image_dtype'   : np.dtype(IMAGE_DTYPE).name,
+                'heatmap_dtype' : np.dtype(HEATMAP_DTYPE).name,
+                'record_bytes'  : record_bytes,
+                'shards'        : [dict((key, value) for key, value in shard.items()
+                                        if key != 'record_bytes') for shard in shards]}
+
+    # the manifest is written last; its presence marks a complete prebake
+    tmp_path = join(out_dir, MANIFEST_FILENAME + '.tmp')
+    with open(tmp_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.rename(tmp_path, join(out_dir, MANIFEST_FILENAME))
+
+    return manifest
+
+
+
+def get_eval_cache_key(json_path, data_dir, preproc_config, image_shape, heatmap_shape):
+    '''
+        get_eval_cache_key()
+        :return: a hash of the evaluation set and everything its records depend on
+    '''
+    return _get_digest(_get_config_items(json_path, data_dir, preproc_config, image_shape, heatmap_shape))[:16]
+
+
+
+def get_eval_cache(json_path,
+                   data_dir,
+                   cache_dir,
+                   preproc_config,
+                   image_shape,
+                   heatmap_shape,
+                   num_shards   =8,
+                   num_workers  =None):
+    '''
+        get_eval_cache()
+        preprocesses the evaluation set of json_path once into
+        the records of a directory under cache_dir.
+        Later calls with the same dataset and config reuse it.
+
+        :return: the directory of the records with their manifest
+    '''
+    eval_cache_dir = join(cache_dir, EVAL_CACHE_DIRNAME % get_eval_cache_key(json_path     =json_path,
+                                                                             data_dir      =data_dir,
+                                                                             preproc_config=preproc_config,
+                                                                             image_shape   =image_shape,
+                                                                             heatmap_shape =heatmap_shape))
+
+    if not os.path.exists(join(eval_cache_dir, MANIFEST_FILENAME)):
+        prebake(json_path       =json_path,
+                data_dir        =data_dir,
+                out_dir         =eval_cache_dir,
+                preproc_config  =preproc_config,
+                image_shape     =image_shape,
+                heatmap_shape   =heatmap_shape,
+                num_variants    =1,
+                num_shards      =num_shards,
+                num_workers     =num_workers,
+                is_training     =False)
+
+    return eval_cache_dir
+
+
+
+def read_record(prebake_dir, manifest, shard_idx, record_idx):
+    '''
+        read_record()
+        numpy reader of a single record for inspection and tests
+        :return: (uint8 image, float16 heatmap)
+    '''
+    image_shape     = tuple(manifest['image_shape'])
+    heatmap_shape   = tuple(manifest['heatmap_shape'])
+    record_bytes    = manifest['record_bytes']
+    image_bytes     = int(np.prod(image_shape)) * np.dtype(IMAGE_DTYPE).itemsize
+
+    with open(join(prebake_dir, manifest['shards'][shard_idx]['filename']), 'rb') as shard_file:
+        shard_file.seek(record_idx * record_bytes)
+        record = shard_file.read(record_bytes)
+
+    images = np.frombuffer(record[:image_bytes], dtype=IMAGE_DTYPE).reshape(image_shape)
+    labels = np.frombuffer(record[image_bytes:], dtype=HEATMAP_DTYPE).reshape(heatmap_shape)
+    return images, labels
@@ -12,6 +12,64 @@ import struct
 import math
 from dataset_augment import CocoPart
 
+
+# the gaussian window is cut off where exp(-d/2/sigma^2) < exp(-HEATMAP_EXP_TH)
+HEATMAP_EXP_TH = 1.6052
+
+# taking only top neck Rshoulder Lshoulder for dontbe turtle proj
+HEATMAP_BODYPARTS_LIST = [CocoPart.Top.value,
+                          CocoPart.Neck.value,
+                          CocoPart.LShoulder.value,
+                          CocoPart.RShoulder.value]
+
+# joint order of joint_list in terms of the keypoint order of the annotation json
+COCO_TO_JOINT_ORDER = [0, 1, 3, 5, 7, 2, 4, 6, 9, 11, 13, 8, 10, 12]
+
+# precomputed gaussian kernels keyed by sigma (see get_gaussian_kernel())
+_gaussian_kernel_cache = {}
+
+
+def get_gaussian_kernel(sigma):
+    '''
+        get_gaussian_kernel()
+
+        returns a cached (2r+1)x(2r+1) gaussian kernel sampled at integer offsets,
+        where r = ceil(sqrt(2 * HEATMAP_EXP_TH) * sigma).
+        The kernel values are the same as the ones computed by CocoMetadata.put_heatmap()
+        for a joint located on integer pixel coordinates.
+
+        :param sigma: std of the gaussian
+        :return: float64 kernel whose center is kernel[r, r]
+    '''
+    kernel = _gaussian_kernel_cache.get(sigma)
+
+    if kernel is None:
+        radius  = int(math.ceil(math.sqrt(HEATMAP_EXP_TH * 2) * sigma))
+        offset  = np.arange(-radius, radius + 1, dtype=np.float64)
+
+        d       = offset[np.newaxis, :] ** 2 + offset[:, np.newaxis] ** 2
+        exp     = d / 2.0 / sigma / sigma
+        kernel  = np.where(exp > HEATMAP_EXP_TH, 0.0, np.exp(-exp))
+
+        _gaussian_kernel_cache[sigma] = kernel
+
+    return kernel
+
+
+
+def get_resized_sigma(sigma, scale):
+    '''
+        get_resized_sigma()
+
+        std of a gaussian of std sigma after cv2.INTER_AREA resizing by scale,
+        where area resizing convolves the gaussian with a box of 1/scale pixels.
+    '''
+    if scale >= 1.0:
+        return sigma * scale
+    return math.sqrt(sigma ** 2 + (1.0 / scale ** 2 - 1.0) / 12.0) * scale
+
+
+
 class CocoPose:
     @staticmethod
     def get_bgimg(inp, target_size=None):
@@ -72,30 +130,43 @@ class CocoMetadata:
         assert len(four_nps) % 4 == 0
         return [(CocoMetadata.parse_float(four_nps[x * 4:x * 4 + 4]) + adjust) for x in range(len(four_nps) // 4)]
 
-    def __init__(self, idx, img_path, img_meta, annotations, sigma):
+    @staticmethod
+    def get_joint_list(keypoints):
+        '''
+            get_joint_list()
+            the joint_list and joint_mask from a (persons, 14, 3) keypoint array.
+            The joints are reordered by COCO_TO_JOINT_ORDER.
+            An unlabeled joint or one on a non-positive coordinate
+            is masked out and set to (-1000, -1000).
+
+            :return: (persons, 14, 2) float32 joint_list, (persons, 14) bool joint_mask
+        '''
+        keypoints   = np.asarray(keypoints).reshape(-1, CocoMetadata.__coco_parts, 3)[:, COCO_TO_JOINT_ORDER]
+        joint_mask  = (keypoints[:, :, 2] >= 1) & (keypoints[:, :, 0] > 0) & (keypoints[:, :, 1] > 0)
+        joint_list  = np.where(joint_mask[:, :, np.newaxis], keypoints[:, :, :2], -1000).astype(np.float32)
+
+        return joint_list, joint_mask
+
+    def __init__(self, idx, img_path, img_meta, annotations, sigma, keypoints=None, image_cache=None):
+        '''
+            :param annotations: list of coco annotation dicts of the image
+            :param keypoints: (persons, 14, 3) array of CocoAnnotationIndex;
+                              if given, annotations is ignored
+            :param image_cache: DecodedImageCache to read the image through;
+                                then self.img is read-only
+        '''
         self.idx = idx
-        self.img = self.read_image(img_path)
+        if image_cache is not None:
+            self.img = image_cache.get(img_path)
+        else:
+            self.img = self.read_image(img_path)
         self.sigma = sigma
 
         self.height = int(img_meta['height'])
         self.width  = int(img_meta['width'])
 
-        joint_list = []
-        # print('annotations = %s' % annotations)
-        for ann in annotations:
-            if ann.get('num_keypoints', 0) == 0:
-                continue
-
-            kp = np.array(ann['keypoints'])
-            xs = kp[0::3]
-            ys = kp[1::3]
-            vs = kp[2::3]
-
-            joint_list.append([(x, y) if v >= 1 else (-1000, -1000) for x, y, v in zip(xs, ys, vs)])
-
-            # print('xs= %s'% kp[0::3])
-            # print('ys= %s'% kp[1::3])
-            # print('vs= %s'% kp[2::3])
+        if keypoints is None:
+            keypoints = [ann['keypoints'] for ann in annotations if ann.get('num_keypoints', 0) > 0]
         '''
         [{"supercategory": "human", 
         "skeleton": [[1, 2], [2, 3], [2, 4], [3, 5], 
@@ -106,43 +177,40 @@ class CocoMetadata:
         "right_hip", "left_knee", "right_knee", "left_ankle", "right_ankle"], 
         "name": "human"}]
         '''
-        # for coor_list in joint_list:
-        #     print('joint_list = %s\n' % coor_list)
-        # print('----------------------------------')
-
-        self.joint_list = []
-
-        transform = list(zip(
-            [1, 2, 4, 6, 8, 3, 5, 7, 10, 12, 14, 9, 11, 13],
-            [1, 2, 4, 6, 8, 3, 5, 7, 10, 12, 14, 9, 11, 13]
-        ))
-        for prev_joint in joint_list:
-            new_joint = []
-            for idx1, idx2 in transform:
-                j1 = prev_joint[idx1 - 1]
-                j2 = prev_joint[idx2 - 1]
-
-                if j1[0] <= 0 or j1[1] <= 0 or j2[0] <= 0 or j2[1] <= 0:
-                    new_joint.append((-1000, -1000))
-                else:
-                    new_joint.append(((j1[0] + j2[0]) / 2, (j1[1] + j2[1]) / 2))
-            # background
-            # new_joint.append((-1000, -1000))
-            self.joint_list.append(new_joint)
-
-    def get_heatmap(self, target_size):
+
+        # joint_list: (persons, 14, 2) float32 where the masked out joints are (-1000, -1000)
+        # joint_mask: (persons, 14) bool
+        self.joint_list, self.joint_mask = self.get_joint_list(np.array(keypoints, dtype=np.float64))
+
+    def get_heatmap(self, target_size, is_vectorized=True, is_target_resol=False):
+        '''
+            get_heatmap()
+
+            :param target_size: (w, h) of the output heatmap
+            :param is_vectorized: use put_heatmaps() instead of the per-pixel loop of put_heatmap()
+            :param is_target_resol: render only the parts in HEATMAP_BODYPARTS_LIST
+                                    directly on the target_size grid instead of
+                                    rendering all parts at the image size and resizing
+            :return: (h, w, 4) float16 heatmap
+        '''
+        if is_target_resol and target_size:
+            return self.get_heatmap_at_target_resol(target_size)
+
         heatmap = np.zeros((CocoMetadata.__coco_parts, self.height, self.width), dtype=np.float32)
 
-        # print ('target_size=',target_size)
-        for joints in self.joint_list:
-            for idx, point in enumerate(joints):
+        if is_vectorized:
+            self.put_joint_heatmaps(heatmap, target_size)
+        else:
+            # print ('target_size=',target_size)
+            for joints in self.joint_list:
+                for idx, point in enumerate(joints):
 
-                if point[0] < 0 or point[1] < 0:
-                    # uniform labeling for mislabeled data
-                    heatmap[idx,:,:] = 1.0 / (target_size[0] * target_size[1])
-                    continue
+                    if point[0] < 0 or point[1] < 0:
+                        # uniform labeling for mislabeled data
+                        heatmap[idx,:,:] = 1.0 / (target_size[0] * target_size[1])
+                        continue
 
-                CocoMetadata.put_heatmap(heatmap, idx, point, self.sigma)
+                    CocoMetadata.put_heatmap(heatmap, idx, point, self.sigma)
 
         heatmap = heatmap.transpose((1, 2, 0))
 
@@ -156,12 +224,7 @@ class CocoMetadata:
         # Neck = 1
         # RShoulder = 2
         # LShoulder = 5
-
-        bodyparts_list = [CocoPart.Top.value,\
-                          CocoPart.Neck.value,\
-                          CocoPart.LShoulder.value,\
-                          CocoPart.RShoulder.value]
-        heatmap = heatmap[:,:,bodyparts_list]
+        heatmap = heatmap[:,:,HEATMAP_BODYPARTS_LIST]
         #---------------------------------------------
 
 
@@ -180,13 +243,194 @@ class CocoMetadata:
 
 
 
+    def get_heatmap_at_target_resol(self, target_size):
+        '''
+            get_heatmap_at_target_resol()
+
+            renders the HEATMAP_BODYPARTS_LIST planes straight on the target_size grid.
+            The joint coordinates are mapped by the pixel-center convention of
+            cv2.resize() and sigma is scaled by get_resized_sigma() such that
+            the result approximates get_heatmap(is_target_resol=False).
+
+            :param target_size: (w, h) of the output heatmap
+            :return: (h, w, 4) float16 heatmap
+        '''
+        target_w, target_h = target_size
+        heatmap = np.zeros((len(HEATMAP_BODYPARTS_LIST), target_h, target_w), dtype=np.float32)
+
+        self.put_joint_heatmaps(heatmap         =heatmap,
+                                target_size     =target_size,
+                                bodyparts_list  =HEATMAP_BODYPARTS_LIST,
+                                scale           =(float(target_w) / float(self.width),
+                                                  float(target_h) / float(self.height)))
+
+        return heatmap.transpose((1, 2, 0)).astype(np.float16)
+
+
+
+    def get_keypoint_label(self, target_size):
+        '''
+            get_keypoint_label()
+
+            the HEATMAP_BODYPARTS_LIST joints of the first person as a label
+            from which the heatmaps are rendered per batch on device.
+            The joint coordinates are mapped to the target_size grid by the
+            pixel-center convention of cv2.resize().
+
+            :param target_size: (w, h) of the network input
+            :return: (4, 3) float32 array of (x, y, visible)
+                     where an invisible joint is (0, 0, 0)
+        '''
+        label = np.zeros((len(HEATMAP_BODYPARTS_LIST), 3), dtype=np.float32)
+        if len(self.joint_list) == 0:
+            return label
+
+        joints      = self.joint_list[0, HEATMAP_BODYPARTS_LIST].astype(np.float64)
+        is_visible  = (joints[:, 0] >= 0) & (joints[:, 1] >= 0)
+        scale       = np.array([float(target_size[0]) / float(self.width),
+                                float(target_size[1]) / float(self.height)])
+
+        label[is_visible, 0:2]  = (joints[is_visible] + 0.5) * scale - 0.5
+        label[is_visible, 2]    = 1.0
+        return label
+
+
+
+    def put_joint_heatmaps(self, heatmap, target_size, bodyparts_list=None, scale=None):
+        '''
+            put_joint_heatmaps()
+
+            renders the joints of all the people in self.joint_list at once
+            such that the result is the same as the per-joint loop in get_heatmap().
+
+            :param heatmap: (num_parts, height, width) array updated in place
+            :param target_size: (w, h) of the final heatmap used for uniform labeling
+            :param bodyparts_list: parts to render on the heatmap planes in order (all parts if None)
+            :param scale: (scale_x, scale_y) from the image grid to the heatmap grid (no scaling if None)
+        '''
+        num_people = len(self.joint_list)
+        if num_people == 0:
+            return
+
+        joints = self.joint_list.astype(np.float64)
+        if bodyparts_list is not None:
+            joints = joints[:, bodyparts_list]
+
+        is_invalid  = (joints[:, :, 0] < 0) | (joints[:, :, 1] < 0)
+
+        # uniform labeling for mislabeled data overwrites the whole plane
+        # so that only the people after the last mislabeled one are drawn on it
+        person_index    = np.arange(num_people)[:, np.newaxis]
+        last_invalid    = np.where(is_invalid, person_index, -1).max(axis=0)
+        heatmap[last_invalid >= 0] = 1.0 / (target_size[0] * target_size[1])
+
+        is_drawn                = np.logical_not(is_invalid) & (person_index > last_invalid)
+        person_ids, plane_ids   = np.nonzero(is_drawn)
+
+        centers = joints[person_ids, plane_ids]
+        sigma   = self.sigma
+        if scale is not None:
+            centers = (centers + 0.5) * np.array(scale) - 0.5
+            sigma   = (get_resized_sigma(self.sigma, scale[0]),
+                       get_resized_sigma(self.sigma, scale[1]))
+
+        CocoMetadata.put_heatmaps(heatmap   = heatmap,
+                                  plane_idx = plane_ids,
+                                  centers   = centers,
+                                  sigma     = sigma,
+                                  is_window_inclusive = scale is not None)
+
+
+
+    @staticmethod
+    def put_heatmaps(heatmap, plane_idx, centers, sigma,
+                     is_kernel_cache=True,
+                     is_window_inclusive=False):
+        '''
+            put_heatmaps()
+
+            numpy-batched version of put_heatmap().
+            The gaussian windows of all the joints are computed in one broadcast
+            and max-merged into their planes.
+
+            :param heatmap: (num_planes, height, width) array updated in place
+            :param plane_idx: (num_joints,) plane index of each joint
+            :param centers: (num_joints, 2) joint coordinates in (x, y)
+            :param sigma: std of the gaussian, or (sigma_x, sigma_y) for an anisotropic one
+            :param is_kernel_cache: use the cached kernel of get_gaussian_kernel()
+                                    when every joint is on integer coordinates
+            :param is_window_inclusive: include the last pixel of the window which put_heatmap() drops.
+                                        This matters on coarse grids where sigma is a few pixels.
+        '''
+        plane_idx   = np.asarray(plane_idx, dtype=np.int64).reshape(-1)
+        centers     = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        if plane_idx.shape[0] == 0:
+            return
+
+        if isinstance(sigma, tuple):
+            sigma_x, sigma_y = sigma
+        else:
+            sigma_x = sigma_y = sigma
+
+        _, height, width = heatmap.shape[:3]
+        delta       = math.sqrt(HEATMAP_EXP_TH * 2)
+        center_x    = centers[:, 0]
+        center_y    = centers[:, 1]
+
+        # window bounds in the same way as put_heatmap()
+        x0 = np.maximum(0, center_x - delta * sigma_x).astype(np.int64)
+        y0 = np.maximum(0, center_y - delta * sigma_y).astype(np.int64)
+        x1 = np.minimum(width,  center_x + delta * sigma_x).astype(np.int64)
+        y1 = np.minimum(height, center_y + delta * sigma_y).astype(np.int64)
+        if is_window_inclusive:
+            x1 = np.minimum(width,  np.floor(center_x + delta * sigma_x).astype(np.int64) + 1)
+            y1 = np.minimum(height, np.floor(center_y + delta * sigma_y).astype(np.int64) + 1)
+
+        window_w = int(max((x1 - x0).max(), 0))
+        window_h = int(max((y1 - y0).max(), 0))
+        if window_w == 0 or window_h == 0:
+            return
+
+        # (num_joints, window_size) pixel coordinates of each window
+        xs = x0[:, np.newaxis] + np.arange(window_w)
+        ys = y0[:, np.newaxis] + np.arange(window_h)
+
+        if sigma_x != sigma_y:
+            exp = (xs - center_x[:, np.newaxis])[:, np.newaxis, :] ** 2 / 2.0 / sigma_x / sigma_x \
+                  + (ys - center_y[:, np.newaxis])[:, :, np.newaxis] ** 2 / 2.0 / sigma_y / sigma_y
+            gaussian = np.where(exp > HEATMAP_EXP_TH, 0.0, np.exp(-exp))
+
+        elif is_kernel_cache and np.all(centers == np.floor(centers)):
+            kernel = get_gaussian_kernel(sigma_x)
+            radius = kernel.shape[0] // 2
+
+            kx = np.clip(xs - center_x[:, np.newaxis].astype(np.int64) + radius, 0, 2 * radius)
+            ky = np.clip(ys - center_y[:, np.newaxis].astype(np.int64) + radius, 0, 2 * radius)
+            gaussian = kernel[ky[:, :, np.newaxis], kx[:, np.newaxis, :]]
+        else:
+            d   = (xs - center_x[:, np.newaxis])[:, np.newaxis, :] ** 2 \
+                  + (ys - center_y[:, np.newaxis])[:, :, np.newaxis] ** 2
+            exp = d / 2.0 / sigma_x / sigma_x
+            gaussian = np.where(exp > HEATMAP_EXP_TH, 0.0, np.exp(-exp))
+
+        for n in range(plane_idx.shape[0]):
+            window_h_n = y1[n] - y0[n]
+            window_w_n = x1[n] - x0[n]
+            if window_h_n <= 0 or window_w_n <= 0:
+                continue
+
+            window = heatmap[plane_idx[n], y0[n]:y1[n], x0[n]:x1[n]]
+            np.maximum(window, gaussian[n, :window_h_n, :window_w_n], out=window)
+
+
+
     @staticmethod
     # the below function actually made heatmap
     def put_heatmap(heatmap, plane_idx, center, sigma):
         center_x, center_y = center
         _, height, width = heatmap.shape[:3]
 
-        th = 1.6052
+        th = HEATMAP_EXP_TH
         delta = math.sqrt(th * 2)
 
         if center_x == 0 and center_y == 0 :
@@ -209,7 +453,8 @@ class CocoMetadata:
                 heatmap[plane_idx][y][x] = min(heatmap[plane_idx][y][x], 1.0)
 
 
-    def read_image(self, img_path):
+    @staticmethod
+    def read_image(img_path):
         img_str = open(img_path, "rb").read()
         if not img_str:
             print("image not read, path=%s" % img_path)
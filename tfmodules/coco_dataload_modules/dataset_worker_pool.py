@@ -0,0 +1,218 @@
+# Copyright 2018 Jaewook Kang (jwkang10@gmail.com) All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+# -*- coding: utf-8 -*-
+
+"""Multiprocess sample loader for the coco dataset pipeline.
+
+    tf.py_func holds the GIL while the jpeg decode, augmentation and
+    heatmap rendering run, so the py_func path is bound to about one core.
+    Here the same parse function runs in a multiprocessing.Pool and
+    the workers write the samples into shared memory batch slots.
+    Only the (slot, position) indices go through the pool pipes.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import random
+import ctypes
+import multiprocessing
+from collections import deque
+
+import numpy as np
+import cv2
+
+
+# per-worker state inherited at fork time
+_worker_parse_fn        = None
+_worker_images_buf      = None
+_worker_labels_buf      = None
+_worker_images_shape    = None
+_worker_labels_shape    = None
+
+
+
+def _as_slots(shared_buf, slots_shape, dtype=np.float32):
+    return np.frombuffer(shared_buf, dtype=dtype).reshape(slots_shape)
+
+
+
+def _init_worker(parse_fn, images_buf, labels_buf, images_shape, labels_shape, images_dtype, seed):
+    '''
+        _init_worker()
+        runs once in each worker process.
+        The augmentation in dataset_augment draws from the random module,
+        so each worker is reseeded not to repeat the others.
+    '''
+    global _worker_parse_fn, _worker_images_buf, _worker_labels_buf
+    global _worker_images_shape, _worker_labels_shape
+
+    _worker_parse_fn        = parse_fn
+    _worker_images_buf      = _as_slots(images_buf, images_shape, images_dtype)
+    _worker_labels_buf      = _as_slots(labels_buf, labels_shape)
+    _worker_images_shape    = images_shape
+    _worker_labels_shape    = labels_shape
+
+    worker_seed = (seed + os.getpid()) % (2 ** 32)
+    random.seed(worker_seed)
+    np.random.seed(worker_seed)
+
+    # one process per core already
+    cv2.setNumThreads(0)
+
+
+
+def _fill_sample(task):
+    '''
+        _fill_sample()
+        parses a single image into its batch slot
+        :param task: (slot index, position in the batch, image id)
+    '''
+    slot, pos, img_id = task
+
+    image, label = _worker_parse_fn(img_id)
+    _worker_images_buf[slot, pos] = image
+    _worker_labels_buf[slot, pos] = label
+
+    return slot
+
+
+
+class CocoWorkerPool(object):
+    """Batches parsed samples with a pool of worker processes
+        Args:
+            parse_fn:     function mapping an element of image_ids to (image, heatmap).
+                            It is handed to the workers at fork time,
+                            so it is never pickled.
+            image_ids:    list of the image ids (or index rows) of the dataset
+            batch_size:   number of samples per batch
+            images_shape: shape of a single preprocessed image
+            labels_shape: shape of a single label
+            images_dtype: numpy dtype of the images; the labels are float32
+            num_workers:  number of worker processes
+            num_slots:    number of batches kept in flight
+            is_shuffle:   `bool` for reshuffling the image ids every epoch
+            seed:         base seed for the shuffling and the workers
+    """
+
+    def __init__(self, parse_fn,
+                 image_ids,
+                 batch_size,
+                 images_shape,
+                 labels_shape,
+                 images_dtype   =np.float32,
+                 num_workers    =None,
+                 num_slots      =3,
+                 is_shuffle     =True,
+                 seed           =0):
+
+        if num_workers is None or num_workers <= 0:
+            num_workers = multiprocessing.cpu_count()
+
+        self.image_ids      = list(image_ids)
+        self.batch_size     = batch_size
+        self.num_workers    = num_workers
+        self.num_slots      = num_slots
+        self.is_shuffle     = is_shuffle
+        self.seed           = seed
+
+        # the resolutions of model_config are floats
+        self.images_shape   = (num_slots, batch_size) + tuple(int(dim) for dim in images_shape)
+        self.labels_shape   = (num_slots, batch_size) + tuple(int(dim) for dim in labels_shape)
+        self.images_dtype   = np.dtype(images_dtype)
+
+        # lock-free shared memory; a slot is only written by the workers
+        # while it is in flight and only read by the generator after that
+        images_buf = multiprocessing.RawArray(ctypes.c_uint8,
+                                              int(np.prod(self.images_shape)) * self.images_dtype.itemsize)
+        labels_buf = multiprocessing.RawArray(ctypes.c_float, int(np.prod(self.labels_shape)))
+
+        self.images_slots   = _as_slots(images_buf, self.images_shape, self.images_dtype)
+        self.labels_slots   = _as_slots(labels_buf, self.labels_shape)
+
+        self.pool = multiprocessing.Pool(processes  =num_workers,
+                                         initializer=_init_worker,
+                                         initargs   =(parse_fn,
+                                                      images_buf,
+                                                      labels_buf,
+                                                      self.images_shape,
+                                                      self.labels_shape,
+                                                      self.images_dtype,
+                                                      seed))
+
+        # tasks are split into a few chunks per worker to amortize the pipe
+        self.chunksize = max(1, batch_size // (num_workers * 4))
+
+        # kept over the generator() calls, one per estimator.train(),
+        # not to replay the same shuffle order from the start every time
+        self.id_stream = self._image_id_stream()
+
+
+
+    def _image_id_stream(self):
+        rng = np.random.RandomState(self.seed)
+        while True:
+            epoch_ids = list(self.image_ids)
+            if self.is_shuffle:
+                rng.shuffle(epoch_ids)
+            for img_id in epoch_ids:
+                yield int(img_id)
+
+
+
+    def _submit_batch(self, slot, id_stream):
+        tasks = [(slot, pos, next(id_stream)) for pos in range(self.batch_size)]
+        return self.pool.map_async(_fill_sample, tasks, chunksize=self.chunksize)
+
+
+
+    def generator(self):
+        '''
+            generator()
+            infinitely yields (images, heatmaps) batches in submission order.
+            The image ids go on from where the previous generator stopped.
+            To be used with tf.data.Dataset.from_generator()
+        '''
+        id_stream   = self.id_stream
+        pending     = deque()
+
+        for slot in range(self.num_slots):
+            pending.append((slot, self._submit_batch(slot, id_stream)))
+
+        try:
+            while True:
+                slot, async_result = pending.popleft()
+                async_result.get()
+
+                # copy out since TF may alias the yielded arrays
+                # while the slot is refilled
+                images = self.images_slots[slot].copy()
+                labels = self.labels_slots[slot].copy()
+
+                pending.append((slot, self._submit_batch(slot, id_stream)))
+                yield images, labels
+
+        finally:
+            # do not leave workers writing into slots of the next generator
+            for _, async_result in pending:
+                async_result.wait()
+
+
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
@@ -28,9 +28,7 @@ import sys
 import tensorflow as tf
 from os.path import join
 import functools
-
-# for COCO templete
-from pycocotools.coco import COCO
+import numpy as np
 
 from path_manager import TF_MODULE_DIR
 from path_manager import TF_MODEL_DIR
@@ -54,7 +52,12 @@ from model_config  import NUM_OF_KEYPOINTS
 
 # for coco dataset
 import dataset_augment
+import dataset_augment_tf
 from dataset_prepare import CocoMetadata
+from dataset_index import CocoAnnotationIndex
+from dataset_image_cache import DecodedImageCache
+from dataset_worker_pool import CocoWorkerPool
+import dataset_prebake
 
 
 DEFAULT_HEIGHT = DEFAULT_INPUT_RESOL
@@ -70,15 +73,56 @@ class DataSetInput(object):
             data_dir:   `str` for the directory of the training and validation data;
                             if 'null' (the literal string 'null', not None), then construct a null
                             pipeline, consisting of empty images.
-            use_bfloat16: If True, use bfloat16 precision; else use float32.
+            use_bfloat16: If True, the images are given in bfloat16; else in float32.
+                            No effect with is_uint8_transport
             transpose_input: 'bool' for whether to use the double transpose trick
+            dataloader_mode: one of {'py_func', 'multiproc', 'prebaked', 'in_graph'};
+                            if None, train_config.dataloader_mode.
+                            'prebaked' applies to training only; evaluation falls back to 'py_func'
+                            (see eval_cache_dir for the evaluation)
+            num_workers: number of worker processes for the 'multiproc' mode
+                            and num_parallel_calls for the 'in_graph' mode;
+                            if None, train_config.num_dataloader_workers
+            image_cache_mbytes: memory budget of the decoded image cache over all the workers;
+                            if None, train_config.image_cache_mbytes
+            image_cache_dir: directory of the decoded image spill files;
+                            if None, train_config.image_cache_dir
+            prebake_dir: directory of the shards by gen_prebaked_dataset.py for the 'prebaked' mode;
+                            if None, train_config.prebake_dir
+            label_mode: one of {'heatmap', 'keypoints'}; if None, train_config.label_mode.
+                            'keypoints' gives a (4, 3) label of (x, y, visible) per sample
+                            from which model_fn renders the heatmaps
+            is_uint8_transport: keep the images in uint8 through the pipeline
+                            for model_fn to cast and normalize; if None, train_config.is_uint8_transport
+            prefetch_device: device to stage the batches on by prefetch_to_device(), e.g. '/gpu:0';
+                            '' for no staging. If None, train_config.prefetch_device
+            num_replicas: number of the data parallel replicas; each takes a batch of
+                            train_config.batch_size / num_replicas in training
+            eval_cache_dir: directory to cache the preprocessed evaluation set in
+                            by dataset_prebake.get_eval_cache(); the evaluation streams the cache
+                            in batches of train_config.eval_cache_batch_size.
+                            '' for no caching. If None, train_config.eval_cache_dir
+            eval_batch_size: batch size of the evaluation; if None,
+                            train_config.eval_cache_batch_size with eval_cache_dir
+                            or train_config.batch_size_eval
     """
 
     def __init__(self, is_training,
                  data_dir,
                  use_bfloat16,
                  transpose_input=True,
-                 is_testcode    =False):
+                 is_testcode    =False,
+                 dataloader_mode=None,
+                 num_workers    =None,
+                 image_cache_mbytes =None,
+                 image_cache_dir    =None,
+                 prebake_dir        =None,
+                 label_mode         =None,
+                 is_uint8_transport =None,
+                 prefetch_device    =None,
+                 num_replicas       =1,
+                 eval_cache_dir     =None,
+                 eval_batch_size    =None):
 
         self.image_preprocessing_fn = dataset_augment.preprocess_image
         self.is_training            = is_training
@@ -90,6 +134,109 @@ class DataSetInput(object):
             self.data_dir = None
         self.transpose_input = transpose_input
 
+        if dataloader_mode is None:
+            dataloader_mode = train_config.dataloader_mode
+        if num_workers is None:
+            num_workers = train_config.num_dataloader_workers
+
+        if dataloader_mode not in ['py_func', 'multiproc', 'prebaked', 'in_graph']:
+            raise ValueError('[Dataloader] unknown dataloader_mode = %s' % dataloader_mode)
+
+        if prebake_dir is None:
+            prebake_dir = train_config.prebake_dir
+
+        if dataloader_mode == 'prebaked' and not self.is_training:
+            # the prebaked records are augmented; evaluation parses the raw images
+            dataloader_mode = 'py_func'
+        if dataloader_mode == 'prebaked' and not prebake_dir:
+            raise ValueError('[Dataloader] prebake_dir is required for dataloader_mode = prebaked')
+
+        if label_mode is None:
+            label_mode = train_config.label_mode
+        if label_mode not in ['heatmap', 'keypoints']:
+            raise ValueError('[Dataloader] unknown label_mode = %s' % label_mode)
+        if label_mode == 'keypoints' and dataloader_mode == 'prebaked':
+            # the prebaked records have the rendered heatmaps
+            raise ValueError('[Dataloader] label_mode = keypoints is not supported for dataloader_mode = prebaked')
+
+        if eval_cache_dir is None:
+            eval_cache_dir = train_config.eval_cache_dir
+        if self.is_training:
+            eval_cache_dir = ''
+        if label_mode == 'keypoints' and eval_cache_dir:
+            raise ValueError('[Dataloader] label_mode = keypoints is not supported with eval_cache_dir')
+
+        self.dataloader_mode    = dataloader_mode
+        self.num_workers        = num_workers
+        self.worker_pool        = None
+        self.prebake_dir        = prebake_dir
+        self.label_mode         = label_mode
+        self.eval_cache_dir     = eval_cache_dir
+        if eval_batch_size is None:
+            eval_batch_size = train_config.eval_cache_batch_size if eval_cache_dir \
+                              else train_config.batch_size_eval
+        self.eval_batch_size    = eval_batch_size
+
+        if is_uint8_transport is None:
+            is_uint8_transport = train_config.is_uint8_transport
+        if prefetch_device is None:
+            prefetch_device = train_config.prefetch_device
+
+        self.is_uint8_transport = is_uint8_transport
+        self.images_dtype       = tf.uint8 if is_uint8_transport else tf.float32
+        self.prefetch_device    = prefetch_device
+
+        if train_config.batch_size % num_replicas != 0:
+            raise ValueError('[Dataloader] batch_size = %s is not divisible by num_replicas = %s'
+                             % (train_config.batch_size, num_replicas))
+        self.num_replicas       = num_replicas
+        self.train_batch_size   = train_config.batch_size // num_replicas
+
+        if self.label_mode == 'keypoints':
+            self.label_shape = [NUM_OF_KEYPOINTS, 3]
+        else:
+            self.label_shape = [DEFAULT_HG_INOUT_RESOL,
+                                DEFAULT_HG_INOUT_RESOL,
+                                NUM_OF_KEYPOINTS]
+
+        if image_cache_mbytes is None:
+            image_cache_mbytes = train_config.image_cache_mbytes
+        if image_cache_dir is None:
+            image_cache_dir = train_config.image_cache_dir
+
+        # the budget is split over the workers as each has its own cache
+        # while the spill files are shared
+        cache_max_bytes = image_cache_mbytes * 1024 * 1024
+        if self.dataloader_mode == 'multiproc':
+            cache_max_bytes = cache_max_bytes // max(1, self.num_workers)
+
+        self.image_cache        = None
+        if image_cache_mbytes > 0:
+            self.image_cache = DecodedImageCache(read_fn   =CocoMetadata.read_image,
+                                                 max_bytes =cache_max_bytes,
+                                                 spill_dir =image_cache_dir if image_cache_dir else None)
+
+        # CocoAnnotationIndex loaded by input_fn()
+        self.anno_index         = None
+
+
+
+    def _prefetch(self, dataset):
+        if self.use_bfloat16 and not self.is_uint8_transport:
+            # the batches go to the device in half the bytes of float32
+            dataset = dataset.map(lambda img, label: (tf.cast(img, tf.bfloat16), label))
+
+        # Prefetch overlaps in-feed with training
+        dataset = dataset.prefetch(tf.contrib.data.AUTOTUNE)
+
+        if self.prefetch_device:
+            # the next batches are copied to the device while the current one is consumed.
+            # This has to be the last transformation
+            dataset = dataset.apply(
+                tf.contrib.data.prefetch_to_device(self.prefetch_device, buffer_size=2))
+        return dataset
+
+
 
 
     def _set_shapes(self,batch_size,img, heatmap):
@@ -98,52 +245,55 @@ class DataSetInput(object):
                        DEFAULT_HEIGHT,
                        DEFAULT_INPUT_CHNUM])
 
-        heatmap.set_shape([batch_size,
-                           DEFAULT_HG_INOUT_RESOL,
-                           DEFAULT_HG_INOUT_RESOL,
-                           NUM_OF_KEYPOINTS])
+        heatmap.set_shape([batch_size] + self.label_shape)
         return img, heatmap
 
 
 
 
-    def _parse_function(self,imgId, ann=None):
-        """
-        :param imgId:
-        :return:
-        """
-        global TRAIN_ANNO
-
-        if ann is not None:
-            TRAIN_ANNO = ann
-
-        img_meta = TRAIN_ANNO.loadImgs([imgId])[0]
-        anno_ids = TRAIN_ANNO.getAnnIds(imgIds=imgId)
-        img_anno = TRAIN_ANNO.loadAnns(anno_ids)
-        idx = img_meta['id']
-
-        filename_item_list = img_meta['file_name'].split('/')
+    def _get_image_path(self, row):
+        filename_item_list = self.anno_index.get_filename(row).split('/')
         filename = filename_item_list[1] +'/' + filename_item_list[2]
 
-
         if self.is_testcode:
             # for test_data_loader_coco.py  -----------------------
-            img_path = join(self.data_dir, filename)
+            return join(self.data_dir, filename)
         else:
             # for actual training   -----------------------
-            img_path = join(FLAGS.data_dir,filename)
+            return join(FLAGS.data_dir,filename)
+
 
 
+
+    def _parse_function(self,row):
+        """
+        :param row: row of the image in self.anno_index
+        :return:
+        """
+        anno_index  = self.anno_index
+
+        idx         = anno_index.image_ids[row]
+        img_meta    = {'height': anno_index.heights[row],
+                       'width' : anno_index.widths[row]}
+
+        img_path    = self._get_image_path(row)
+
         img_meta_data   = CocoMetadata(idx=idx,
                                        img_path=img_path,
                                        img_meta=img_meta,
-                                       annotations=img_anno,
-                                       sigma=preproc_config.heatmap_std)
+                                       annotations=None,
+                                       sigma=preproc_config.heatmap_std,
+                                       keypoints=anno_index.get_keypoints(row),
+                                       image_cache=self.image_cache)
 
         # print('joint_list = %s' % img_meta_data.joint_list)
         images, labels  = self.image_preprocessing_fn(img_meta_data=img_meta_data,
                                                       preproc_config=preproc_config,
-                                                      is_training   = self.is_training)
+                                                      is_training   = self.is_training,
+                                                      is_keypoint_label=self.label_mode == 'keypoints')
+
+        if self.is_uint8_transport:
+            images = np.clip(np.rint(images), 0, 255).astype(np.uint8)
         return images, labels
 
 
@@ -163,6 +313,10 @@ class DataSetInput(object):
         """
 
 
+        if self.dataloader_mode == 'prebaked':
+            return self._input_fn_prebaked(prebake_dir=self.prebake_dir,
+                                           batch_size =self.train_batch_size)
+
         if self.is_testcode:
             # for test_data_loader_coco.py  -----------------------
             json_filename_split = self.data_dir.split('/')
@@ -180,11 +334,24 @@ class DataSetInput(object):
                 json_filename       = json_filename_split[-1] + '_valid.json'
                 self.data_dir       = FLAGS.data_dir
 
-
-        global TRAIN_ANNO
-        TRAIN_ANNO      = COCO(join(self.data_dir,json_filename))
-        imgIds          = TRAIN_ANNO.getImgIds()
-        dataset         = tf.data.Dataset.from_tensor_slices(imgIds)
+        if self.eval_cache_dir:
+            # the evaluation set is preprocessed at the first evaluation only
+            eval_cache_dir = dataset_prebake.get_eval_cache(
+                json_path       =join(self.data_dir, json_filename),
+                data_dir        =self.data_dir,
+                cache_dir       =self.eval_cache_dir,
+                preproc_config  =preproc_config,
+                image_shape     =[int(DEFAULT_HEIGHT), int(DEFAULT_WIDTH), DEFAULT_INPUT_CHNUM],
+                heatmap_shape   =[int(DEFAULT_HG_INOUT_RESOL), int(DEFAULT_HG_INOUT_RESOL), NUM_OF_KEYPOINTS],
+                num_workers     =self.num_workers)
+            return self._input_fn_prebaked(prebake_dir=eval_cache_dir,
+                                           batch_size =self.eval_batch_size)
+
+        # the json is flattened once into a .npz sidecar (see dataset_index.py)
+        # and the dataset elements are the rows of the index
+        self.anno_index = CocoAnnotationIndex.load_or_build(join(self.data_dir,json_filename))
+        rows            = np.arange(len(self.anno_index), dtype=np.int64)
+        dataset         = tf.data.Dataset.from_tensor_slices(rows)
 
         tf.logging.info('----------------------------------------------')
         tf.logging.info('[Dataloader] is_training = %s' % self.is_training)
@@ -194,25 +361,31 @@ class DataSetInput(object):
             # dataset elementwise shuffling and repeat
             dataset = dataset.apply(
                 tf.contrib.data.shuffle_and_repeat(buffer_size=1000))
-            batch_size = train_config.batch_size
+            batch_size = self.train_batch_size
         else:
             tf.logging.info('[Dataloader] Building datast pipeline for evaluation')
             dataset = dataset.repeat(count=None)
-            batch_size = train_config.batch_size_eval
+            batch_size = self.eval_batch_size
 
 
 
+        if self.dataloader_mode == 'multiproc':
+            return self._input_fn_multiproc(rows=rows, batch_size=batch_size)
+
+        if self.dataloader_mode == 'in_graph':
+            return self._input_fn_in_graph(dataset=dataset, batch_size=batch_size)
+
         # # Read the data from disk in parallel
         # where cycle_length is the Number of training files to read in parallel.
         # multiprocessing_num === < the number of CPU cores >
         multiprocessing_num = 4
 
         dataset = dataset.map(
-            lambda imgId: tuple(
+            lambda row: tuple(
                 tf.py_func(
                     func=self._parse_function,
-                    inp=[imgId],
-                    Tout=[tf.float32, tf.float32]
+                    inp=[row],
+                    Tout=[self.images_dtype, tf.float32]
                 )
             ), num_parallel_calls=multiprocessing_num)
 
@@ -222,9 +395,174 @@ class DataSetInput(object):
 
 
 
-        # Prefetch overlaps in-feed with training
-        dataset = dataset.prefetch(tf.contrib.data.AUTOTUNE)
+        dataset = self._prefetch(dataset)
+        tf.logging.info('[Dataloader] dataset pipeline building complete')
+
+        return dataset
+
+
+
+
+    def _input_fn_multiproc(self, rows, batch_size):
+        """Builds the pipeline where the decode, augmentation and heatmap rendering
+            run in a pool of worker processes instead of tf.py_func.
+            The shuffling and repeat are done by the worker pool.
+        """
+        if self.worker_pool is None:
+            # the workers are forked here so that they inherit self.anno_index
+            self.worker_pool = CocoWorkerPool(parse_fn      =self._parse_function,
+                                              image_ids     =rows,
+                                              batch_size    =batch_size,
+                                              images_shape  =[DEFAULT_HEIGHT,
+                                                              DEFAULT_WIDTH,
+                                                              DEFAULT_INPUT_CHNUM],
+                                              labels_shape  =self.label_shape,
+                                              images_dtype  =self.images_dtype.as_numpy_dtype,
+                                              num_workers   =self.num_workers,
+                                              is_shuffle    =self.is_training)
+
+        tf.logging.info('[Dataloader] multiproc mode with %s workers' % self.worker_pool.num_workers)
+
+        dataset = tf.data.Dataset.from_generator(
+            generator       =self.worker_pool.generator,
+            output_types    =(self.images_dtype, tf.float32),
+            output_shapes   =(tf.TensorShape([batch_size,
+                                              DEFAULT_HEIGHT,
+                                              DEFAULT_WIDTH,
+                                              DEFAULT_INPUT_CHNUM]),
+                              tf.TensorShape([batch_size] + self.label_shape)))
+
+        dataset = self._prefetch(dataset)
         tf.logging.info('[Dataloader] dataset pipeline building complete')
 
         return dataset
 
+
+
+
+    def _parse_in_graph(self, row, image_paths, person_offsets, keypoints):
+        """
+        :param row: row of the image in self.anno_index as a scalar tensor
+        :return: the decoded and augmented (image, heatmap) by TF ops only
+        """
+        img_str = tf.read_file(tf.gather(image_paths, row))
+
+        # BGR as cv2.imdecode() of the py_func path
+        img     = tf.reverse(tf.image.decode_jpeg(img_str, channels=3), axis=[2])
+
+        person_keypoints = keypoints[person_offsets[row]:person_offsets[row + 1]]
+
+        img, labels = dataset_augment_tf.preprocess_image(img            =img,
+                                                          keypoints      =person_keypoints,
+                                                          preproc_config =preproc_config,
+                                                          sigma          =preproc_config.heatmap_std,
+                                                          is_training    =self.is_training,
+                                                          is_keypoint_label=self.label_mode == 'keypoints')
+        if self.is_uint8_transport:
+            img = tf.saturate_cast(tf.round(img), tf.uint8)
+        return img, labels
+
+
+
+
+    def _input_fn_in_graph(self, dataset, batch_size):
+        """Builds the pipeline where the decode, augmentation and heatmap rendering
+            are TF ops of dataset_augment_tf.py, such that the map runs
+            over num_workers threads without the GIL.
+        """
+        anno_index      = self.anno_index
+        image_paths     = tf.constant([self._get_image_path(row) for row in range(len(anno_index))])
+        person_offsets  = tf.constant(anno_index.person_offsets, dtype=tf.int64)
+        keypoints       = tf.constant(anno_index.keypoints, dtype=tf.float32)
+
+        tf.logging.info('[Dataloader] in_graph mode with num_parallel_calls = %s' % self.num_workers)
+
+        dataset = dataset.map(
+            functools.partial(self._parse_in_graph,
+                              image_paths     =image_paths,
+                              person_offsets  =person_offsets,
+                              keypoints       =keypoints),
+            num_parallel_calls=self.num_workers)
+
+        dataset = dataset.apply(tf.contrib.data.batch_and_drop_remainder(batch_size))
+        dataset = dataset.map(functools.partial(self._set_shapes, batch_size))
+
+        dataset = self._prefetch(dataset)
+        tf.logging.info('[Dataloader] dataset pipeline building complete')
+
+        return dataset
+
+
+
+
+    def _decode_prebaked_record(self, record, image_shape, heatmap_shape):
+        image_bytes     = int(np.prod(image_shape))
+        heatmap_bytes   = int(np.prod(heatmap_shape)) * 2    # float16
+
+        img     = tf.decode_raw(tf.substr(record, 0, image_bytes), tf.uint8)
+        img     = tf.reshape(img, image_shape)
+        if not self.is_uint8_transport:
+            img = tf.cast(img, tf.float32)
+
+        heatmap = tf.decode_raw(tf.substr(record, image_bytes, heatmap_bytes), tf.float16)
+        heatmap = tf.cast(tf.reshape(heatmap, heatmap_shape), tf.float32)
+        return img, heatmap
+
+
+
+
+    def _input_fn_prebaked(self, prebake_dir, batch_size):
+        """Builds the pipeline streaming the fixed-length records
+            of gen_prebaked_dataset.py for training, or of the evaluation set cache.
+            No python runs per sample.
+        """
+        manifest        = dataset_prebake.load_manifest(prebake_dir)
+        image_shape     = manifest['image_shape']
+        heatmap_shape   = manifest['heatmap_shape']
+
+        if image_shape != [DEFAULT_HEIGHT, DEFAULT_WIDTH, DEFAULT_INPUT_CHNUM] or \
+                heatmap_shape != [DEFAULT_HG_INOUT_RESOL, DEFAULT_HG_INOUT_RESOL, NUM_OF_KEYPOINTS]:
+            raise ValueError('[Dataloader] prebaked shapes %s, %s do not match the model'
+                             % (image_shape, heatmap_shape))
+
+        shard_paths = [join(prebake_dir, shard['filename']) for shard in manifest['shards']]
+        num_records = sum([shard['num_records'] for shard in manifest['shards']])
+
+        tf.logging.info('----------------------------------------------')
+        tf.logging.info('[Dataloader] prebaked mode with %s records (%s variants) in %s shards'
+                        % (num_records, manifest['num_variants'], len(shard_paths)))
+
+        if self.is_training:
+            dataset = tf.data.Dataset.from_tensor_slices(shard_paths)
+            dataset = dataset.shuffle(buffer_size=len(shard_paths)).repeat()
+
+            # Read the shards in parallel
+            dataset = dataset.apply(
+                tf.contrib.data.parallel_interleave(
+                    lambda filename: tf.data.FixedLengthRecordDataset(filename,
+                                                                      record_bytes=manifest['record_bytes'],
+                                                                      buffer_size=8 * 1024 * 1024),
+                    cycle_length=min(len(shard_paths), 8),
+                    sloppy=True))
+
+            dataset = dataset.shuffle(buffer_size=1000)
+        else:
+            # the evaluation set in the order of the index
+            dataset = tf.data.FixedLengthRecordDataset(shard_paths,
+                                                       record_bytes=manifest['record_bytes'],
+                                                       buffer_size=8 * 1024 * 1024)
+            dataset = dataset.repeat(count=None)
+
+        multiprocessing_num = 4
+        dataset = dataset.map(
+            functools.partial(self._decode_prebaked_record,
+                              image_shape   =[int(dim) for dim in image_shape],
+                              heatmap_shape =[int(dim) for dim in heatmap_shape]),
+            num_parallel_calls=multiprocessing_num)
+
+        dataset = dataset.apply(tf.contrib.data.batch_and_drop_remainder(batch_size))
+
+        dataset = self._prefetch(dataset)
+        tf.logging.info('[Dataloader] dataset pipeline building complete')
+
+        return dataset
@@ -0,0 +1,135 @@
+# Copyright 2018 Jaewook Kang (jwkang10@gmail.com) All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+# -*- coding: utf-8 -*-
+
+"""Evaluation of the checkpoints in a single live session.
+
+    Estimator.evaluate() builds the graph, the metric ops and the session
+    and reads the evaluation set again for every checkpoint.
+    Here they are built once; a checkpoint only restores the variables
+    and resets the metric variables before the evaluation steps.
+    The results go to the eval summaries under the tags of Estimator.evaluate().
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import tensorflow as tf
+
+
+EVAL_DIRNAME = 'eval'
+
+
+
+class LiveEvaluator(object):
+    """Evaluates checkpoints with the graph and the session kept alive
+        Args:
+            model_fn:       model_fn of the Estimator; called once in EVAL mode
+            input_fn:       input_fn of the evaluation giving a tf.data.Dataset
+                                of (features, labels)
+            model_dir:      directory of the checkpoints; the summaries are
+                                written into its 'eval' subdirectory as of Estimator.evaluate()
+            session_config: tf.ConfigProto of the eval session
+    """
+
+    def __init__(self, model_fn,
+                 input_fn,
+                 model_dir,
+                 session_config =None):
+
+        self.eval_dir   = os.path.join(model_dir, EVAL_DIRNAME)
+        self.graph      = tf.Graph()
+
+        with self.graph.as_default():
+            self.global_step = tf.train.get_or_create_global_step()
+
+            # reinitialized for every checkpoint to evaluate the same samples
+            self.iterator       = input_fn().make_initializable_iterator()
+            features, labels    = self.iterator.get_next()
+
+            estimator_spec  = model_fn(features, labels, tf.estimator.ModeKeys.EVAL, None)
+
+            metric_ops          = dict(estimator_spec.eval_metric_ops)
+            metric_ops['loss']  = tf.metrics.mean(estimator_spec.loss)
+
+            self.value_ops  = dict((name, value_op) for name, (value_op, _) in metric_ops.items())
+            self.update_op  = tf.group(*[update_op for _, update_op in metric_ops.values()])
+
+            # the extra summaries of model_fn, if any, are of the last batch
+            self.summary_op = tf.summary.merge_all()
+
+            self.saver          = tf.train.Saver()
+            self.local_init_op  = tf.group(tf.local_variables_initializer(),
+                                           tf.tables_initializer())
+            self.graph.finalize()
+
+        self.session        = tf.Session(graph=self.graph, config=session_config)
+        self.summary_writer = tf.summary.FileWriter(self.eval_dir)
+
+
+
+    def evaluate(self, checkpoint_path, steps):
+        '''
+            evaluate()
+            restores the checkpoint and runs the metrics over steps batches,
+            or up to the end of the evaluation set as Estimator.evaluate()
+            :param steps: number of the batches; None for the whole evaluation set
+            :return: dict of the metric values with the global_step
+        '''
+        self.saver.restore(self.session, checkpoint_path)
+        self.session.run([self.local_init_op, self.iterator.initializer])
+
+        summary_str     = None
+        summary_step    = steps - 1 if steps is not None and self.summary_op is not None else None
+        step            = 0
+        while steps is None or step < steps:
+            try:
+                if step == summary_step:
+                    _, summary_str = self.session.run([self.update_op, self.summary_op])
+                else:
+                    self.session.run(self.update_op)
+            except tf.errors.OutOfRangeError:
+                # the metrics of the batches so far
+                if steps is not None:
+                    tf.logging.info('[LiveEvaluator] evaluation set ended at %d of %d steps' % (step, steps))
+                break
+            step += 1
+
+        eval_results, global_step   = self.session.run([self.value_ops, self.global_step])
+        self._write_summary(eval_results, global_step, summary_str)
+
+        eval_results['global_step'] = global_step
+        return eval_results
+
+
+
+    def _write_summary(self, eval_results, global_step, summary_str=None):
+        summary = tf.Summary()
+        for name in sorted(eval_results.keys()):
+            summary.value.add(tag=name, simple_value=float(eval_results[name]))
+
+        self.summary_writer.add_summary(summary, global_step)
+        if summary_str is not None:
+            self.summary_writer.add_summary(summary_str, global_step)
+        self.summary_writer.flush()
+
+
+
+    def close(self):
+        self.summary_writer.close()
+        self.session.close()
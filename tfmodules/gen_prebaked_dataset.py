@@ -0,0 +1,87 @@
+# Copyright 2018 Jaewook Kang (jwkang10@gmail.com) All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+# -*- coding: utf-8 -*-
+
+
+"""Generation of the pre-baked augmented training set
+    for train with --dataloader_mode=prebaked --prebake_dir=<out-dir>
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import argparse
+import time
+from os.path import join
+
+# directory path addition
+from path_manager import TF_MODULE_DIR
+from path_manager import TF_MODEL_DIR
+from path_manager import COCO_DATALOAD_DIR
+from path_manager import COCO_REALSET_DIR
+
+# PATH INSERSION
+sys.path.insert(0,TF_MODULE_DIR)
+sys.path.insert(0,TF_MODEL_DIR)
+sys.path.insert(0,COCO_DATALOAD_DIR)
+
+from train_config  import PreprocessingConfig
+
+from model_config  import DEFAULT_INPUT_RESOL
+from model_config  import DEFAULT_HG_INOUT_RESOL
+from model_config  import DEFAULT_INPUT_CHNUM
+from model_config  import NUM_OF_KEYPOINTS
+
+import dataset_prebake
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-dir', default=COCO_REALSET_DIR, required=False,
+                        help='dataset directory having <dataset>_train.json')
+    parser.add_argument('--out-dir', required=True,
+                        help='directory of the prebaked shards and the manifest (relative to the project home)')
+    parser.add_argument('--num-variants', default=8, type=int, required=False,
+                        help='number of augmented variants per image')
+    parser.add_argument('--num-shards', default=64, type=int, required=False)
+    parser.add_argument('--num-workers', default=None, type=int, required=False)
+    parser.add_argument('--seed', default=0, type=int, required=False,
+                        help='base seed of the per-variant augmentation seeds')
+    args = parser.parse_args()
+
+    data_dir        = args.data_dir.rstrip('/')
+    json_filename   = data_dir.split('/')[-1] + '_train.json'
+
+    input_resol     = int(DEFAULT_INPUT_RESOL)
+    heatmap_resol   = int(DEFAULT_HG_INOUT_RESOL)
+
+    start_time = time.time()
+    manifest = dataset_prebake.prebake(json_path      =join(data_dir, json_filename),
+                                       data_dir       =data_dir,
+                                       out_dir        =args.out_dir,
+                                       preproc_config =PreprocessingConfig(),
+                                       image_shape    =[input_resol, input_resol, DEFAULT_INPUT_CHNUM],
+                                       heatmap_shape  =[heatmap_resol, heatmap_resol, NUM_OF_KEYPOINTS],
+                                       num_variants   =args.num_variants,
+                                       num_shards     =args.num_shards,
+                                       num_workers    =args.num_workers,
+                                       base_seed      =args.seed)
+
+    print('[gen_prebaked_dataset] %d images x %d variants in %.1f sec to %s'
+          % (manifest['num_images'], manifest['num_variants'],
+             time.time() - start_time, args.out_dir))
@@ -50,6 +50,9 @@ sys.path.insert(0,EXPORT_MODEL_DIR)
 
 ### models
 from model_builder import get_model
+from train_aux_fn  import decode_keypoints
+from train_aux_fn  import normalize_image
+from train_aux_fn  import load_input_norm
 from model_config_released  import ModelConfigReleased
 
 model_config = ModelConfigReleased()
@@ -59,7 +62,8 @@ class ConvertorToMobileFormat(object):
     def __init__(self,
                  import_model_dir,
                  ckptfilename='model.ckpt',
-                 is_summary=False):
+                 is_summary=False,
+                 keypoint_refine=None):
 
         self._ckptfile_name      = ckptfilename
         self._frozen_pb_name     = 'frozen_' + ckptfilename.split('.')[0] + '.pb'
@@ -73,6 +77,7 @@ class ConvertorToMobileFormat(object):
         self._graph_def             =   None
         self._frozen_graph_def      =   None
         self._model_out             =   None
+        self._keypoints_out         =   None
         self._end_points            =   None
 
         self._saver                 = None # tf.train.Saver()
@@ -83,6 +88,14 @@ class ConvertorToMobileFormat(object):
         self._input_node_name  = 'model_in'
         self._output_node_name = 'build_network/model/model_out'
 
+        # keypoints decoded from the model_out heatmaps in the frozen pb
+        self._keypoints_node_name   = 'build_network/keypoints_out'
+        self._keypoint_refine       = keypoint_refine
+
+        # (mean_rgb, stddev_rgb) of a checkpoint trained with --is_input_normalized;
+        # None for the raw 0-255 BGR input
+        self._input_norm            = load_input_norm(import_model_dir)
+
         self._input_shape = None
         self._output_shape = None
 
@@ -121,10 +134,22 @@ class ConvertorToMobileFormat(object):
 
             with tf.name_scope(name=build_network_scope):
 
+                # the model takes the 0-255 BGR images
+                # with the input normalization of model_fn, if any
+                model_in = self._model_in
+                if self._input_norm is not None:
+                    model_in = normalize_image(images       =model_in,
+                                               mean_rgb     =self._input_norm[0],
+                                               stddev_rgb   =self._input_norm[1],
+                                               scope        ='feature_norm')
+
                 self._model_out, _, self._end_points \
-                    = get_model(ch_in = self._model_in,
+                    = get_model(ch_in = model_in,
                                 model_config = model_config,
                                 scope        = model_scope)
+                self._keypoints_out = tf.identity(decode_keypoints(self._model_out,
+                                                                   refine=self._keypoint_refine),
+                                                  name=self._keypoints_node_name.split('/')[-1])
                 self._init_op   = tf.global_variables_initializer()
                 self._saver     = tf.train.Saver(tf.global_variables())
 
@@ -182,7 +207,7 @@ class ConvertorToMobileFormat(object):
             self._frozen_graph_def = tf.graph_util.convert_variables_to_constants(
                 sess=sess,
                 input_graph_def=sess.graph_def,
-                output_node_names=self._output_node_name.replace(" ","").split(","))
+                output_node_names=[self._output_node_name, self._keypoints_node_name])
 
 
 
@@ -209,6 +234,11 @@ class ConvertorToMobileFormat(object):
             'output_shape': self._output_shape,
             'input_node_name': self._input_node_name,
             'output_node_name': self._output_node_name,
+            'keypoints_node_name': self._keypoints_node_name,
+            'keypoint_refine':  self._keypoint_refine,
+            'is_input_normalized':  self._input_norm is not None,
+            'mean_rgb':         self._input_norm[0] if self._input_norm is not None else None,
+            'stddev_rgb':       self._input_norm[1] if self._input_norm is not None else None,
             'keypoints':   ['Head','Nose','Rshoulder','Lshoulder'],
             'dtype':        str(model_config.dtype)
 
@@ -240,6 +270,13 @@ if __name__ == '__main__':
         required=False
     )
 
+    parser.add_argument(
+        '--keypoint-refine',
+        default='none',
+        help='sub-pixel refinement of the keypoints_out node: quadratic, soft_argmax or none',
+        required=False
+    )
+
     args = parser.parse_args()
     filelist = listdir(args.import_ckpt_dir[0])
     filelist_split = filelist[-1].split('.')
@@ -247,7 +284,9 @@ if __name__ == '__main__':
     ckptfilename = '.'.join(filelist_split[:2])
     toco = ConvertorToMobileFormat(import_model_dir=args.import_ckpt_dir[0],
                                    ckptfilename=ckptfilename,
-                                   is_summary = args.is_summary[0])
+                                   is_summary = args.is_summary[0],
+                                   keypoint_refine = None if args.keypoint_refine == 'none'
+                                                     else args.keypoint_refine)
     toco.build_model()
     toco.convert_and_export()
     toco.export_shape_in_json()
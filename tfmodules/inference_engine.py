@@ -0,0 +1,405 @@
+# Copyright 2018 Jaewook Kang (jwkang10@gmail.com) All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+# -*- coding: utf-8 -*-
+
+"""Inference of the exported dont be turtle models.
+
+    The frozen pb or the tflite of gen_tflite_coreml.py is loaded once
+    with its shape_info.json and kept warm in a session or an interpreter.
+    Batches of BGR frames of any size are resized to the model input,
+    and the keypoints are given in the frame pixels.
+
+    - usage of the latency benchmark on CPU:
+        python ./tfmodules/inference_engine.py \
+            --model-path=<export dir>/mobile_format/frozen_model.pb \
+            --batch-sizes 1 4 16
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import json
+import time
+import argparse
+
+import cv2
+import numpy as np
+import tensorflow as tf
+
+
+KEYPOINT_NAMES          = ['head', 'neck', 'lshoulder', 'rshoulder']
+KEYPOINT_REFINE_MODES   = [None, 'quadratic', 'soft_argmax']
+
+# as of train_aux_fn.decode_keypoints() checked by test_inference_engine.py.
+# Not imported to keep this module free of the training code
+SOFT_ARGMAX_RADIUS      = 2
+SOFT_ARGMAX_BETA        = 10.0
+
+SHAPE_INFO_FILENAME     = 'shape_info.json'
+
+
+
+def decode_keypoints_np(heatmaps, refine=None):
+    '''
+        decode_keypoints_np()
+        numpy version of train_aux_fn.decode_keypoints() for the heatmaps out of the graph
+
+        :param heatmaps: BxHxWxK heatmaps
+        :param refine: one of {None, 'quadratic', 'soft_argmax'}
+        :return: BxKx2 float32 (x, y) of the keypoints in heatmap pixels
+    '''
+    if refine not in KEYPOINT_REFINE_MODES:
+        raise ValueError('[decode_keypoints_np] Unknown refine = %s' % str(refine))
+
+    heatmaps                = np.asarray(heatmaps, dtype=np.float32)
+    batch, height, width, num_of_keypoints = heatmaps.shape
+
+    # (B*K)xHxW
+    planes      = heatmaps.transpose(0, 3, 1, 2).reshape(-1, height, width)
+    argmax      = planes.reshape(-1, height * width).argmax(axis=1)
+    argmax_x    = argmax % width
+    argmax_y    = argmax // width
+
+    keypoints_x = argmax_x.astype(np.float32)
+    keypoints_y = argmax_y.astype(np.float32)
+    planes_idx  = np.arange(planes.shape[0])
+
+    if refine == 'quadratic':
+        def get_offset(prev_value, center, next_value, is_inner):
+            curvature   = prev_value - 2.0 * center + next_value
+            is_peak     = is_inner & (curvature < 0.0)
+            offset      = 0.5 * (prev_value - next_value) / np.minimum(curvature, -1e-6)
+            return np.clip(offset * is_peak, -0.5, 0.5)
+
+        # no refinement at the borders
+        center      = planes[planes_idx, argmax_y, argmax_x]
+        inner_x     = (argmax_x > 0) & (argmax_x < width - 1)
+        inner_y     = (argmax_y > 0) & (argmax_y < height - 1)
+        step_x      = inner_x.astype(np.int64)
+        step_y      = inner_y.astype(np.int64)
+
+        keypoints_x += get_offset(planes[planes_idx, argmax_y, argmax_x - step_x], center,
+                                  planes[planes_idx, argmax_y, argmax_x + step_x], inner_x)
+        keypoints_y += get_offset(planes[planes_idx, argmax_y - step_y, argmax_x], center,
+                                  planes[planes_idx, argmax_y + step_y, argmax_x], inner_y)
+
+    elif refine == 'soft_argmax':
+        grid_x  = np.arange(width, dtype=np.float32)
+        grid_y  = np.arange(height, dtype=np.float32)
+
+        # window of SOFT_ARGMAX_RADIUS around the argmax
+        mask    = (np.abs(grid_y[np.newaxis, :, np.newaxis] - keypoints_y[:, np.newaxis, np.newaxis])
+                   <= SOFT_ARGMAX_RADIUS) & \
+                  (np.abs(grid_x[np.newaxis, np.newaxis, :] - keypoints_x[:, np.newaxis, np.newaxis])
+                   <= SOFT_ARGMAX_RADIUS)
+
+        weights = np.exp(SOFT_ARGMAX_BETA * (planes - planes.max(axis=(1, 2), keepdims=True))) * mask
+        weights /= weights.sum(axis=(1, 2), keepdims=True)
+
+        keypoints_x = (weights.sum(axis=1) * grid_x).sum(axis=1)
+        keypoints_y = (weights.sum(axis=2) * grid_y).sum(axis=1)
+
+    keypoints = np.stack([keypoints_x, keypoints_y], axis=1)
+    return keypoints.reshape(batch, num_of_keypoints, 2).astype(np.float32)
+
+
+
+
+class InferenceEngine(object):
+    """Keypoint inference of an exported model kept warm over the calls
+        Args:
+            model_path:     path of the frozen .pb or the .tflite of gen_tflite_coreml.py
+            shape_info_path: shape_info.json of the model; if None, the one next to model_path
+            keypoint_refine: sub-pixel refinement of the keypoints, one of {None, 'quadratic', 'soft_argmax'};
+                                if None, the keypoint_refine of the shape info or the integer argmax.
+                                Give 'none' for the integer argmax
+            mean_rgb:       per-channel mean of the input normalization in [0, 1] as of MEAN_RGB
+                                of PreprocessingConfig for a model without it in the graph;
+                                None for the 0-255 BGR input of the exports of gen_tflite_coreml.py,
+                                which normalize it in the graph if the training did (is_input_normalized)
+            stddev_rgb:     per-channel stddev of the input normalization as of STDDEV_RGB
+            num_threads:    number of the intra op threads of the pb session; 0 for the TF default
+            use_gpu:        whether the pb session may take the GPUs
+    """
+
+    def __init__(self, model_path,
+                 shape_info_path    =None,
+                 keypoint_refine    =None,
+                 mean_rgb           =None,
+                 stddev_rgb         =None,
+                 num_threads        =0,
+                 use_gpu            =False):
+
+        if shape_info_path is None:
+            shape_info_path = os.path.join(os.path.dirname(model_path), SHAPE_INFO_FILENAME)
+        with open(shape_info_path, 'r') as f:
+            self.shape_info = json.load(f)
+
+        if keypoint_refine is None:
+            keypoint_refine = self.shape_info.get('keypoint_refine', None)
+        if keypoint_refine == 'none':
+            keypoint_refine = None
+        if keypoint_refine not in KEYPOINT_REFINE_MODES:
+            raise ValueError('[InferenceEngine] Unknown keypoint_refine = %s' % str(keypoint_refine))
+
+        _, self.input_height, self.input_width, self.input_channel_num = self.shape_info['input_shape']
+        _, self.heatmap_height, self.heatmap_width, _                   = self.shape_info['output_shape']
+
+        self.keypoint_refine    = keypoint_refine
+        self.model_path         = model_path
+
+        # the normalization of model_fn in the BGR order for a model without it in the graph
+        self.input_mean = None
+        self.input_std  = None
+        if mean_rgb is not None:
+            self.input_mean = np.array(mean_rgb[::-1], dtype=np.float32) * 255.0
+            self.input_std  = np.array(stddev_rgb[::-1], dtype=np.float32) * 255.0
+
+        if model_path.endswith('.tflite'):
+            self.backend = 'tflite'
+            self._load_tflite()
+        elif model_path.endswith('.pb'):
+            self.backend = 'pb'
+            self._load_pb(num_threads=num_threads, use_gpu=use_gpu)
+        else:
+            raise ValueError('[InferenceEngine] Non-supporting model format = %s' % model_path)
+
+        tf.logging.info('[InferenceEngine] %s loaded by %s with keypoint_refine = %s'
+                        % (model_path, self.backend, str(self.keypoint_refine)))
+
+
+
+    def _load_pb(self, num_threads, use_gpu):
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(self.model_path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+
+        input_node_name = self.shape_info['input_node_name']
+        input_dtype     = [tf.as_dtype(node.attr['dtype'].type)
+                           for node in graph_def.node if node.name == input_node_name][0]
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            # the batch 1 input of the export is replaced by a dynamic batch
+            self._input = tf.placeholder(dtype=input_dtype,
+                                         shape=[None, self.input_height, self.input_width,
+                                                self.input_channel_num],
+                                         name='engine_in')
+            tf.import_graph_def(graph_def,
+                                input_map={input_node_name + ':0': self._input},
+                                name='')
+
+            heatmaps = tf.cast(self.graph.get_tensor_by_name(self.shape_info['output_node_name'] + ':0'),
+                               tf.float32)
+            self._fetches = {'heatmaps': heatmaps,
+                             'scores':   tf.reduce_max(heatmaps, axis=[1, 2])}
+
+            # the decoding of the keypoints_out node runs in the graph
+            # if it is of the same refinement
+            keypoints_node_name = self.shape_info.get('keypoints_node_name')
+            if keypoints_node_name is not None and \
+                    self.shape_info.get('keypoint_refine') == self.keypoint_refine:
+                del self._fetches['heatmaps']
+                self._fetches['keypoints'] = self.graph.get_tensor_by_name(keypoints_node_name + ':0')
+            self.graph.finalize()
+
+        config = tf.ConfigProto(intra_op_parallelism_threads=num_threads)
+        if not use_gpu:
+            config.device_count['GPU'] = 0
+        self.session = tf.Session(graph=self.graph, config=config)
+
+
+
+    def _load_tflite(self):
+        self.interpreter = tf.contrib.lite.Interpreter(model_path=self.model_path)
+        self.interpreter.allocate_tensors()
+
+        input_details       = self.interpreter.get_input_details()[0]
+        self._input_index   = input_details['index']
+        self._input_dtype   = input_details['dtype']
+        self._output_index  = self.interpreter.get_output_details()[0]['index']
+        self._batch_size    = int(input_details['shape'][0])
+
+
+
+    def preprocess(self, frames):
+        '''
+            preprocess()
+            resizes the BGR frames to the model input as the evaluation preprocessing
+            :param frames: list or NxHxWx3 uint8 array of the BGR frames
+            :return: NxHxWx3 model input
+        '''
+        images = np.empty([len(frames), self.input_height, self.input_width, self.input_channel_num],
+                          dtype=np.float32)
+        for n, frame in enumerate(frames):
+            images[n] = cv2.resize(frame, (self.input_width, self.input_height),
+                                   interpolation=cv2.INTER_AREA)
+
+        if self.input_mean is not None:
+            images -= self.input_mean
+            images /= self.input_std
+        return images
+
+
+
+    def _run_tflite(self, images):
+        batch_size = images.shape[0]
+        if batch_size != self._batch_size:
+            # the interpreter is reallocated at a change of the batch size only
+            self.interpreter.resize_tensor_input(self._input_index,
+                                                 np.array([batch_size] + list(images.shape[1:]), dtype=np.int32))
+            self.interpreter.allocate_tensors()
+            self._batch_size = batch_size
+
+        self.interpreter.set_tensor(self._input_index, images.astype(self._input_dtype))
+        self.interpreter.invoke()
+
+        heatmaps = self.interpreter.get_tensor(self._output_index).astype(np.float32)
+        return {'heatmaps': heatmaps,
+                'scores':   heatmaps.max(axis=(1, 2))}
+
+
+
+    def predict(self, frames):
+        '''
+            predict()
+            :param frames: list or NxHxWx3 uint8 array of the BGR frames;
+                the frames of a list can be of different sizes
+            :return: Nx4x3 float32 (x, y, score) of head, neck, lshoulder and rshoulder
+                where (x, y) is in the frame pixels and score is the heatmap peak
+        '''
+        if len(frames) == 0:
+            return np.zeros([0, len(KEYPOINT_NAMES), 3], dtype=np.float32)
+
+        images = self.preprocess(frames)
+        if self.backend == 'pb':
+            outputs = self.session.run(self._fetches, feed_dict={self._input: images})
+        else:
+            outputs = self._run_tflite(images)
+
+        keypoints = outputs.get('keypoints')
+        if keypoints is None:
+            keypoints = decode_keypoints_np(outputs['heatmaps'], refine=self.keypoint_refine)
+
+        # from the heatmap pixels to the frame pixels of each frame,
+        # matching the pixel centers as (k + 0.5) * frame_size / heatmap_size - 0.5
+        frame_sizes     = np.array([[frame.shape[1], frame.shape[0]] for frame in frames], dtype=np.float32)
+        heatmap_size    = np.array([self.heatmap_width, self.heatmap_height], dtype=np.float32)
+        keypoints       = (keypoints + 0.5) * (frame_sizes / heatmap_size)[:, np.newaxis, :] - 0.5
+
+        return np.concatenate([keypoints, outputs['scores'][:, :, np.newaxis]], axis=2).astype(np.float32)
+
+
+
+    def benchmark(self, batch_sizes=(1, 4, 16),
+                  num_iters     =50,
+                  num_warmup    =5,
+                  frame_shape   =(480, 640, 3)):
+        '''
+            benchmark()
+            latency of predict() from the BGR frames to the keypoints
+            :return: dict of the batch size to the percentiles in msec and the frames per sec
+        '''
+        rng     = np.random.RandomState(0)
+        results = {}
+        for batch_size in batch_sizes:
+            frames = rng.randint(0, 256, size=[batch_size] + list(frame_shape)).astype(np.uint8)
+
+            for _ in range(0, num_warmup):
+                self.predict(frames)
+
+            latency_ms = []
+            for _ in range(0, num_iters):
+                start_time = time.time()
+                self.predict(frames)
+                latency_ms.append((time.time() - start_time) * 1000.0)
+
+            latency_ms = np.array(latency_ms)
+            results[batch_size] = {'p50':   float(np.percentile(latency_ms, 50)),
+                                   'p95':   float(np.percentile(latency_ms, 95)),
+                                   'p99':   float(np.percentile(latency_ms, 99)),
+                                   'mean':  float(latency_ms.mean()),
+                                   'fps':   float(batch_size * 1000.0 / latency_ms.mean())}
+
+            tf.logging.info('[InferenceEngine] batch %d: p50 %.2f ms, p95 %.2f ms, p99 %.2f ms, %.1f fps'
+                            % (batch_size, results[batch_size]['p50'], results[batch_size]['p95'],
+                               results[batch_size]['p99'], results[batch_size]['fps']))
+        return results
+
+
+
+    def close(self):
+        if self.backend == 'pb':
+            self.session.close()
+
+
+
+
+if __name__ == '__main__':
+    tf.logging.set_verbosity(tf.logging.INFO)
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--model-path',
+        required=True,
+        help='frozen .pb or .tflite of gen_tflite_coreml.py'
+    )
+
+    parser.add_argument(
+        '--batch-sizes',
+        default=[1, 4, 16],
+        type=int,
+        nargs='+',
+        required=False
+    )
+
+    parser.add_argument(
+        '--num-iters',
+        default=50,
+        type=int,
+        required=False
+    )
+
+    parser.add_argument(
+        '--num-threads',
+        default=0,
+        type=int,
+        required=False
+    )
+
+    parser.add_argument(
+        '--benchmark-json',
+        default=None,
+        required=False,
+        help='path to write the benchmark results in json'
+    )
+
+    args = parser.parse_args()
+
+    engine  = InferenceEngine(model_path=args.model_path,
+                              num_threads=args.num_threads)
+    results = engine.benchmark(batch_sizes=args.batch_sizes,
+                               num_iters=args.num_iters)
+    engine.close()
+
+    if args.benchmark_json is not None:
+        with open(args.benchmark_json, 'w') as f:
+            json.dump({'model_path':    args.model_path,
+                       'backend':       engine.backend,
+                       'latency_ms':    dict((str(batch_size), result)
+                                             for batch_size, result in results.items())}, f, indent=2)
@@ -53,6 +53,7 @@ train_config   = TrainConfig()
 preproc_config = PreprocessingConfig()
 
 TRAIN_FILE_BYTE             = 265 * 1024 * 1024  # 6MB for lsp train dataset file
+SHARD_READ_BUFFER_BYTE      = 8 * 1024 * 1024
 
 def image_serving_input_fn():
     """Serving input fn for raw images.
@@ -336,15 +337,17 @@ class DataSetInput(object):
         # loading dataset from tfrecords files
         def fetch_dataset(filename):
             # buffer_size: number of bytes in the read buffer
-            buffer_size = TRAIN_FILE_BYTE
+            # one buffer per interleaved file, not the whole dataset file
+            buffer_size = SHARD_READ_BUFFER_BYTE
             dataset = tf.data.TFRecordDataset(filename,buffer_size=buffer_size)
             return dataset
 
         # # Read the data from disk in parallel
         # where cycle_length is the Number of training files to read in parallel.
+        # (tfrecord_converter.py --num-shards writes train-NNNNN-of-NNNNN shards)
         dataset = dataset.apply(
             tf.contrib.data.parallel_interleave(
-                fetch_dataset, cycle_length=1, sloppy=True))
+                fetch_dataset, cycle_length=8, sloppy=True))
 
 
         tf.logging.info('[Input_fn] file_pattern = %s' % file_pattern)
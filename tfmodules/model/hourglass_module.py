@@ -156,6 +156,11 @@ def get_hourglass_deconv_module(ch_in,
                                                                    unpool_rate=unpool_rate,
                                                                    scope=model_config.deconv_type)
 
+        # tf.image.resize_bilinear() and resize_bicubic() give float32 for any input.
+        # so the output is cast back to the input dtype in the reduced precision training
+        if net.dtype != ch_in.dtype:
+            net = tf.cast(net, ch_in.dtype)
+
     return net,end_points
 
 
@@ -25,6 +25,32 @@ from supervision_layer  import get_supervision_layer
 from output_layer       import get_output_layer
 
 
+# fused batch norm takes its params and moving statistics in float32
+# for float16 and bfloat16 inputs
+FP32_ONLY_VARIABLE_NAMES = ['beta', 'gamma', 'moving_mean', 'moving_variance']
+
+
+
+def fp32_master_getter(getter, name, *args, **kwargs):
+    '''
+        fp32_master_getter()
+        custom getter for the reduced precision training.
+        The variables are created in float32 as the master weights
+        updated by the optimizer, and the layers asking for
+        float16 or bfloat16 get a cast of them.
+    '''
+    dtype = kwargs.get('dtype', None)
+    if dtype is None or tf.as_dtype(dtype).base_dtype == tf.float32:
+        return getter(name, *args, **kwargs)
+
+    kwargs['dtype'] = tf.float32
+    variable = getter(name, *args, **kwargs)
+
+    if name.split('/')[-1] in FP32_ONLY_VARIABLE_NAMES:
+        return variable
+    return tf.cast(variable, dtype)
+
+
 
 def get_model(ch_in,model_config,scope=None):
 
@@ -35,12 +61,23 @@ def get_model(ch_in,model_config,scope=None):
         hourglass layer (64x64x256) -->
         output layer    (64x64x3) -->
         loss
+
+        The layers run in model_config.dtype. For float16 or bfloat16
+        the weights are kept in float32 by fp32_master_getter()
+        and the heatmaps are cast back to float32.
     '''
 
     net = ch_in
     end_points = {}
     orig_scope = scope
-    with tf.variable_scope(name_or_scope=scope,default_name='model',values=[ch_in]) as sc:
+    is_reduced_precision = model_config.dtype != tf.float32
+    custom_getter = fp32_master_getter if is_reduced_precision else None
+
+    with tf.variable_scope(name_or_scope=scope,default_name='model',values=[ch_in],
+                           custom_getter=custom_getter) as sc:
+
+        if net.dtype != model_config.dtype:
+            net = tf.cast(net, model_config.dtype)
 
         scope = 'reception'
         tf.logging.info('-----------------------------------------------------------')
@@ -80,6 +117,8 @@ def get_model(ch_in,model_config,scope=None):
                                                                              net.get_shape().as_list()))
 
                     # intermediate heatmap save
+                    if is_reduced_precision:
+                        heatmaps = tf.cast(heatmaps, tf.float32)
                     intermediate_heatmaps.append(heatmaps)
 
                 # shortcut sum
@@ -96,6 +135,9 @@ def get_model(ch_in,model_config,scope=None):
             tf.logging.info('[model_builder] model out shape=%s' % net.get_shape().as_list())
             tf.logging.info('-----------------------------------------------------------')
 
+        if is_reduced_precision:
+            net = tf.cast(net, tf.float32)
+
         out = tf.identity(input=net, name= sc.name + '_out')
         end_points[sc.name + '_out'] = out
         end_points[sc.name + '_in'] = ch_in
@@ -348,6 +348,8 @@ class ModelConfig(object):
         # output layer final activation
         self.activation_fn_out      = None
 
+        # dtype of the layers; tf.float16 or tf.bfloat16 for the reduced precision training
+        # where the variables are still kept in float32
         self.dtype              = tf.float32
 
         self.hg_config          = HourGlassConfig   (depth_multiplier           =self.depth_multiplier,
@@ -388,6 +390,7 @@ class ModelConfig(object):
         tf.logging.info('[model_config] is_hglayer_shortcut_conv = %s' % self.is_hglayer_shortcut_conv)
         tf.logging.info('[model_config] is_hglayer_conv_after_resize = %s' % self.is_hglayer_conv_after_resize)
         tf.logging.info('[model_config] hglayer_invbottle_expansion_rate = %s' % self.hglayer_invbottle_expansion_rate)
+        tf.logging.info('[model_config] dtype = %s' % self.dtype.name)
 
         self.rc_config.show_info()
         self.hg_config.show_info()
@@ -0,0 +1,712 @@
+# Copyright 2018 Jaewook Kang (jwkang10@gmail.com) All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+# -*- coding: utf-8 -*-
+
+"""Streaming posture monitoring over video files, streams and cameras.
+
+    Every stream is decoded in its own thread into a bounded queue.
+    The inference loop batches the frames across the streams for InferenceEngine,
+    smooths the keypoints of each stream over time and scores the neck posture.
+    A realtime stream drops its stalest frame when the queue is full
+    so that the inference keeps up with the latest frames under load.
+    In the tracking mode, the network runs only every few frames of a stream
+    and the keypoints are propagated by the optical flow in between.
+
+    - usage of the throughput benchmark over local video files:
+        python ./tfmodules/stream_pipeline.py \
+            --model-path=<export dir>/mobile_format/frozen_model.pb \
+            --sources video1.mp4 video2.mp4 \
+            --stream-counts 1 2 4
+
+    - usage of the accuracy-versus-compute report of the tracking mode
+      against the per-frame inference over recorded videos:
+        python ./tfmodules/stream_pipeline.py \
+            --model-path=<export dir>/mobile_format/frozen_model.pb \
+            --sources video1.mp4 video2.mp4 \
+            --detection-intervals 3 5 10
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import math
+import time
+import argparse
+import threading
+from collections import deque
+
+import cv2
+import numpy as np
+import tensorflow as tf
+
+from inference_engine import InferenceEngine
+
+HEAD, NECK, LSHOULDER, RSHOULDER = 0, 1, 2, 3
+
+# frame rate of a realtime video file without its fps
+DEFAULT_VIDEO_FPS = 30.0
+
+
+
+def get_posture_features(keypoints):
+    '''
+        get_posture_features()
+
+        :param keypoints: 4x3 (x, y, score) of head, neck, lshoulder and rshoulder
+        :return: dict of
+            - 'head_height_ratio': height of the head above the shoulder center
+                                   over the shoulder width. It gets smaller
+                                   as the head goes forward and down
+            - 'neck_angle_deg':    lean of the neck-to-head line from the vertical
+    '''
+    keypoints           = np.asarray(keypoints, dtype=np.float32)
+    shoulder_center     = (keypoints[LSHOULDER, 0:2] + keypoints[RSHOULDER, 0:2]) / 2.0
+    shoulder_width      = np.linalg.norm(keypoints[LSHOULDER, 0:2] - keypoints[RSHOULDER, 0:2])
+
+    neck_to_head        = keypoints[HEAD, 0:2] - keypoints[NECK, 0:2]
+    return {'head_height_ratio':    float((shoulder_center[1] - keypoints[HEAD, 1]) / max(shoulder_width, 1e-6)),
+            'neck_angle_deg':       float(math.degrees(math.atan2(abs(neck_to_head[0]), -neck_to_head[1])))}
+
+
+
+
+class KeypointSmoother(object):
+    """Exponential moving average of the keypoints of a stream
+        Args:
+            alpha:      weight of the new keypoints
+            min_score:  keypoints of a lower score keep the previous position
+    """
+
+    def __init__(self, alpha=0.5, min_score=0.1):
+        self.alpha      = alpha
+        self.min_score  = min_score
+        self.keypoints  = None
+
+
+
+    def update(self, keypoints):
+        '''
+            update()
+            :param keypoints: 4x3 (x, y, score)
+            :return: 4x3 smoothed keypoints
+        '''
+        keypoints = np.array(keypoints, dtype=np.float32)
+        if self.keypoints is None:
+            self.keypoints = keypoints
+            return self.keypoints.copy()
+
+        is_confident = (keypoints[:, 2] >= self.min_score)[:, np.newaxis]
+        smoothed     = self.alpha * keypoints + (1.0 - self.alpha) * self.keypoints
+        self.keypoints = np.where(is_confident, smoothed, self.keypoints)
+        return self.keypoints.copy()
+
+
+
+
+class PostureScorer(object):
+    """Neck-forward posture score of a stream against its upright calibration
+        Args:
+            calibration_frames: number of the first frames of the upright posture
+                                    giving the reference head height ratio
+            turtle_threshold:   score from which the posture is reported as a turtle neck
+    """
+
+    def __init__(self, calibration_frames=30, turtle_threshold=0.25):
+        self.calibration_frames = calibration_frames
+        self.turtle_threshold   = turtle_threshold
+        self._calibration       = []
+        self.reference_ratio    = None
+
+
+
+    def update(self, keypoints):
+        '''
+            update()
+            :param keypoints: 4x3 (x, y, score) smoothed keypoints
+            :return: dict of get_posture_features() with
+                - 'turtle_score': relative drop of the head height ratio from the reference
+                                  in [0, 1]; None during the calibration
+                - 'is_turtle':    whether turtle_score is over turtle_threshold
+        '''
+        posture = get_posture_features(keypoints)
+
+        if self.reference_ratio is None:
+            self._calibration.append(posture['head_height_ratio'])
+            if len(self._calibration) >= self.calibration_frames:
+                self.reference_ratio = float(np.median(self._calibration))
+
+        if self.reference_ratio is None or self.reference_ratio <= 0.0:
+            posture['turtle_score'] = None
+            posture['is_turtle']    = False
+        else:
+            posture['turtle_score'] = float(np.clip(1.0 - posture['head_height_ratio'] / self.reference_ratio,
+                                                    0.0, 1.0))
+            posture['is_turtle']    = posture['turtle_score'] > self.turtle_threshold
+        return posture
+
+
+
+
+class KeypointTracker(object):
+    """Propagates the keypoints of a stream by the pyramidal Lucas-Kanade optical flow
+        Args:
+            detection_interval: the keypoints of a detection are tracked
+                                    over the next detection_interval - 1 frames
+            max_track_error_px: forward-backward error in the frame pixels over which
+                                    a keypoint is lost. The tracking of a frame fails
+                                    unless all the keypoints are kept
+            win_size:           window size of cv2.calcOpticalFlowPyrLK()
+            max_level:          pyramid level of cv2.calcOpticalFlowPyrLK()
+    """
+
+    def __init__(self, detection_interval=5,
+                 max_track_error_px =2.0,
+                 win_size           =21,
+                 max_level          =3):
+
+        self.detection_interval = detection_interval
+        self.max_track_error_px = max_track_error_px
+        self.lk_params          = {'winSize':  (win_size, win_size),
+                                   'maxLevel': max_level}
+
+        self.keypoints      = None
+        self._prev_gray     = None
+        self._num_tracked   = 0
+
+
+
+    def needs_detection(self):
+        return self._prev_gray is None or self._num_tracked >= self.detection_interval - 1
+
+
+
+    def reset(self, frame, keypoints):
+        '''
+            reset()
+            restarts the tracking from the detected keypoints of the frame
+        '''
+        self._prev_gray     = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        self.keypoints      = np.array(keypoints, dtype=np.float32)
+        self._num_tracked   = 0
+
+
+
+    def track(self, frame):
+        '''
+            track()
+            :param frame: BGR frame next to the last one reset or tracked
+            :return: 4x3 (x, y, score) keypoints keeping the scores of the detection.
+                None if the tracking fails
+        '''
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if gray.shape != self._prev_gray.shape:
+            return None
+
+        points = np.ascontiguousarray(self.keypoints[:, np.newaxis, 0:2])
+        next_points, status, _      = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, points, None,
+                                                               **self.lk_params)
+        back_points, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self._prev_gray, next_points, None,
+                                                               **self.lk_params)
+
+        track_error = np.linalg.norm(points - back_points, axis=2)[:, 0]
+        is_tracked  = (status[:, 0] == 1) & (back_status[:, 0] == 1) & \
+                      (track_error <= self.max_track_error_px)
+        if not is_tracked.all():
+            return None
+
+        self.keypoints[:, 0:2]  = next_points[:, 0, :]
+        self._prev_gray         = gray
+        self._num_tracked       += 1
+        return self.keypoints.copy()
+
+
+
+
+class FrameStream(object):
+    """Decodes a video in a thread into a bounded queue of frames
+        Args:
+            source:         path of a video file, url of a stream or index of a camera
+            max_queue_size: number of the frames in the queue
+            is_realtime:    whether to drop the stalest frame for a new one in the full queue
+                                instead of waiting for the consumer; if None, True for the
+                                cameras and the urls. A realtime video file is read
+                                at its frame rate as a camera
+            frame_event:    threading.Event set at every new frame
+    """
+
+    def __init__(self, source,
+                 max_queue_size =4,
+                 is_realtime    =None,
+                 frame_event    =None):
+
+        if is_realtime is None:
+            is_realtime = isinstance(source, int) or '://' in str(source)
+
+        self.source         = source
+        self.is_realtime    = is_realtime
+        self.frame_event    = frame_event
+
+        self.num_decoded    = 0
+        self.num_dropped    = 0
+        self.error          = None
+
+        self._queue         = deque()
+        self._max_queue_size= max_queue_size
+        self._cond          = threading.Condition()
+        self._is_stopped    = False
+        self._is_eos        = False
+        self._thread        = threading.Thread(target=self._decode)
+        self._thread.daemon = True
+
+
+
+    def start(self):
+        self._thread.start()
+        return self
+
+
+
+    def _decode(self):
+        capture = cv2.VideoCapture(self.source)
+        try:
+            if not capture.isOpened():
+                raise IOError('[FrameStream] Cannot open %s' % str(self.source))
+
+            # a video file in realtime is paced as a camera
+            is_paced    = self.is_realtime and not isinstance(self.source, int) \
+                          and '://' not in str(self.source)
+            fps         = capture.get(cv2.CAP_PROP_FPS) or DEFAULT_VIDEO_FPS
+            start_time  = time.time()
+
+            frame_index = 0
+            while not self._is_stopped:
+                is_read, frame = capture.read()
+                if not is_read:
+                    break
+
+                if is_paced:
+                    time.sleep(max(0.0, start_time + frame_index / fps - time.time()))
+
+                with self._cond:
+                    if self.is_realtime:
+                        if len(self._queue) >= self._max_queue_size:
+                            self._queue.popleft()
+                            self.num_dropped += 1
+                    else:
+                        while len(self._queue) >= self._max_queue_size and not self._is_stopped:
+                            self._cond.wait()
+                    self._queue.append((frame_index, frame))
+                    self.num_decoded += 1
+
+                if self.frame_event is not None:
+                    self.frame_event.set()
+                frame_index += 1
+
+        except Exception as e:  # pylint: disable=broad-except
+            self.error = e
+        finally:
+            capture.release()
+            with self._cond:
+                self._is_eos = True
+            if self.frame_event is not None:
+                self.frame_event.set()
+
+
+
+    def get(self):
+        '''
+            get()
+            :return: (frame_index, frame) of the oldest frame in the queue; None if empty
+        '''
+        with self._cond:
+            if not self._queue:
+                return None
+            item = self._queue.popleft()
+            self._cond.notify_all()
+        return item
+
+
+
+    @property
+    def is_finished(self):
+        with self._cond:
+            return self._is_eos and not self._queue
+
+
+
+    def stop(self):
+        with self._cond:
+            self._is_stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+
+
+
+
+class StreamPipeline(object):
+    """Batched posture monitoring over the video streams
+        Args:
+            engine:         InferenceEngine or any with predict() of the BGR frames
+                                to Nx4x3 (x, y, score) keypoints
+            sources:        list of the video files, urls or camera indexes
+            max_batch_size: number of the frames in a batch across the streams
+            max_queue_size: number of the decoded frames waiting in each stream
+            is_realtime:    see FrameStream
+            smoothing_alpha: see KeypointSmoother
+            calibration_frames: see PostureScorer
+            turtle_threshold:   see PostureScorer
+            detection_interval: the network runs on every detection_interval-th frame of a stream
+                                    and on the frames where the tracking fails. The keypoints
+                                    are tracked by KeypointTracker in between.
+                                    1 for the network on every frame
+            max_track_error_px: see KeypointTracker
+            result_fn:      called as result_fn(stream_id, frame_index, keypoints, posture)
+                                for every frame inferred
+    """
+
+    def __init__(self, engine,
+                 sources,
+                 max_batch_size     =8,
+                 max_queue_size     =4,
+                 is_realtime        =None,
+                 smoothing_alpha    =0.5,
+                 calibration_frames =30,
+                 turtle_threshold   =0.25,
+                 detection_interval =1,
+                 max_track_error_px =2.0,
+                 result_fn          =None):
+
+        self.engine         = engine
+        self.sources        = list(sources)
+        self.max_batch_size = max_batch_size
+        self.max_queue_size = max_queue_size
+        self.is_realtime    = is_realtime
+        self.result_fn      = result_fn
+
+        self.smoothers  = [KeypointSmoother(alpha=smoothing_alpha) for _ in self.sources]
+        self.scorers    = [PostureScorer(calibration_frames =calibration_frames,
+                                         turtle_threshold   =turtle_threshold) for _ in self.sources]
+
+        self.detection_interval = detection_interval
+        self.trackers   = [KeypointTracker(detection_interval =detection_interval,
+                                           max_track_error_px =max_track_error_px)
+                           if detection_interval > 1 else None for _ in self.sources]
+
+
+
+    def _get_batch(self, streams, first_stream, max_frames_per_stream=None):
+        '''
+            one frame of each stream in turn from first_stream
+            until the batch is full, the queues are empty
+            or max_frames_per_stream frames of each stream are taken
+        '''
+        batch           = []
+        num_of_turns    = 0
+        while len(batch) < self.max_batch_size and num_of_turns != max_frames_per_stream:
+            num_of_turns    += 1
+            num_of_frames   = len(batch)
+            for n in range(0, len(streams)):
+                stream_id   = (first_stream + n) % len(streams)
+                item        = streams[stream_id].get()
+                if item is not None:
+                    batch.append((stream_id,) + item)
+                    if len(batch) == self.max_batch_size:
+                        break
+            if len(batch) == num_of_frames:
+                break
+        return batch
+
+
+
+    def run(self, max_duration_sec=None):
+        '''
+            run()
+            runs until all the streams end or for max_duration_sec
+            :return: dict of the throughput in frames per sec in total and per stream
+        '''
+        frame_event = threading.Event()
+        streams     = [FrameStream(source           =source,
+                                   max_queue_size   =self.max_queue_size,
+                                   is_realtime      =self.is_realtime,
+                                   frame_event      =frame_event) for source in self.sources]
+        for stream in streams:
+            stream.start()
+
+        num_inferred    = [0] * len(streams)
+        num_detected    = [0] * len(streams)
+        latency_ms      = []
+        first_stream    = 0
+        start_time      = time.time()
+
+        # a frame is tracked from the previous frame of its stream
+        # so that a batch takes at most one frame of each stream
+        max_frames_per_stream = 1 if self.detection_interval > 1 else None
+        try:
+            while max_duration_sec is None or time.time() - start_time < max_duration_sec:
+                frame_event.clear()
+                batch = self._get_batch(streams, first_stream, max_frames_per_stream)
+                first_stream = (first_stream + 1) % len(streams)
+
+                if not batch:
+                    if all(stream.is_finished for stream in streams):
+                        break
+                    frame_event.wait(timeout=0.1)
+                    continue
+
+                keypoints = [None] * len(batch)
+                for n, (stream_id, _, frame) in enumerate(batch):
+                    tracker = self.trackers[stream_id]
+                    if tracker is not None and not tracker.needs_detection():
+                        keypoints[n] = tracker.track(frame)
+
+                # the network runs on the frames due for a detection or lost in the tracking
+                detect_list = [n for n in range(0, len(batch)) if keypoints[n] is None]
+                if detect_list:
+                    infer_time  = time.time()
+                    detected    = self.engine.predict([batch[n][2] for n in detect_list])
+                    latency_ms.append((time.time() - infer_time) * 1000.0)
+
+                    for n, frame_keypoints in zip(detect_list, detected):
+                        stream_id, _, frame = batch[n]
+                        keypoints[n] = frame_keypoints
+                        num_detected[stream_id] += 1
+                        if self.trackers[stream_id] is not None:
+                            self.trackers[stream_id].reset(frame, frame_keypoints)
+
+                for (stream_id, frame_index, _), frame_keypoints in zip(batch, keypoints):
+                    smoothed    = self.smoothers[stream_id].update(frame_keypoints)
+                    posture     = self.scorers[stream_id].update(smoothed)
+                    num_inferred[stream_id] += 1
+
+                    if self.result_fn is not None:
+                        self.result_fn(stream_id, frame_index, smoothed, posture)
+        finally:
+            elapsed_sec = time.time() - start_time
+            for stream in streams:
+                stream.stop()
+
+        for stream in streams:
+            if stream.error is not None:
+                raise stream.error
+
+        return {'num_of_streams':   len(streams),
+                'elapsed_sec':      elapsed_sec,
+                'num_inferred':     sum(num_inferred),
+                'num_detected':     sum(num_detected),
+                'num_dropped':      sum(stream.num_dropped for stream in streams),
+                'fps':              sum(num_inferred) / elapsed_sec,
+                'batch_latency_ms': float(np.mean(latency_ms)) if latency_ms else None,
+                'streams':          [{'source':         str(stream.source),
+                                      'num_decoded':    stream.num_decoded,
+                                      'num_inferred':   num_inferred[n],
+                                      'num_detected':   num_detected[n],
+                                      'num_dropped':    stream.num_dropped,
+                                      'fps':            num_inferred[n] / elapsed_sec}
+                                     for n, stream in enumerate(streams)]}
+
+
+
+
+def benchmark_streams(engine, sources, stream_counts=(1, 2, 4), max_duration_sec=None, **kwargs):
+    '''
+        benchmark_streams()
+        throughput of StreamPipeline over the stream counts
+        where the sources are repeated up to the stream count
+        :param kwargs: the other args of StreamPipeline
+        :return: dict of the stream count to the result of StreamPipeline.run()
+    '''
+    results = {}
+    for num_of_streams in stream_counts:
+        pipeline = StreamPipeline(engine    =engine,
+                                  sources   =[sources[n % len(sources)] for n in range(0, num_of_streams)],
+                                  **kwargs)
+        results[num_of_streams] = pipeline.run(max_duration_sec=max_duration_sec)
+
+        tf.logging.info('[benchmark_streams] %d streams: %.1f fps in total, %d frames dropped'
+                        % (num_of_streams, results[num_of_streams]['fps'],
+                           results[num_of_streams]['num_dropped']))
+    return results
+
+
+
+
+def compare_tracking(engine, sources, detection_intervals=(5, 10), **kwargs):
+    '''
+        compare_tracking()
+        accuracy against the compute of the tracking mode over the recorded videos
+        where the per-frame inference of detection_interval=1 is the reference.
+        Every frame of the videos is processed without a drop.
+
+        :param kwargs: the other args of StreamPipeline
+        :return: dict of the detection interval to the result of StreamPipeline.run() with
+            - 'keypoint_err_px':     mean distance from the reference keypoints in the frame pixels
+            - 'keypoint_err_ratio':  keypoint_err_px over the reference shoulder width
+            - 'turtle_score_diff':   mean absolute difference from the reference turtle score
+            - 'detection_ratio':     ratio of the frames run by the network
+            - 'speedup':             fps over the fps of the reference
+    '''
+    kwargs['is_realtime'] = False
+
+    def run_pipeline(detection_interval):
+        outputs = {}
+
+        def result_fn(stream_id, frame_index, keypoints, posture):
+            outputs[(stream_id, frame_index)] = (keypoints, posture['turtle_score'])
+
+        pipeline = StreamPipeline(engine            =engine,
+                                  sources           =sources,
+                                  detection_interval=detection_interval,
+                                  result_fn         =result_fn,
+                                  **kwargs)
+        return pipeline.run(), outputs
+
+    ref_result, ref_outputs = run_pipeline(detection_interval=1)
+
+    results = {1: ref_result}
+    for detection_interval in detection_intervals:
+        result, outputs = run_pipeline(detection_interval=detection_interval)
+
+        err_px, err_ratio, score_diff = [], [], []
+        for key, (keypoints, turtle_score) in outputs.items():
+            ref_keypoints, ref_turtle_score = ref_outputs[key]
+            shoulder_width  = np.linalg.norm(ref_keypoints[LSHOULDER, 0:2] - ref_keypoints[RSHOULDER, 0:2])
+            frame_err_px    = float(np.mean(np.linalg.norm(keypoints[:, 0:2] - ref_keypoints[:, 0:2], axis=1)))
+
+            err_px.append(frame_err_px)
+            err_ratio.append(frame_err_px / max(shoulder_width, 1e-6))
+            if turtle_score is not None and ref_turtle_score is not None:
+                score_diff.append(abs(turtle_score - ref_turtle_score))
+
+        result['keypoint_err_px']       = float(np.mean(err_px)) if err_px else None
+        result['keypoint_err_ratio']    = float(np.mean(err_ratio)) if err_ratio else None
+        result['turtle_score_diff']     = float(np.mean(score_diff)) if score_diff else None
+        result['detection_ratio']       = result['num_detected'] / max(result['num_inferred'], 1)
+        result['speedup']               = result['fps'] / ref_result['fps']
+        results[detection_interval]     = result
+
+        tf.logging.info('[compare_tracking] interval %d: %.2f px (%.3f of shoulder width) off, '
+                        '%.1f%% of frames detected, %.2fx fps'
+                        % (detection_interval, result['keypoint_err_px'] or 0.0,
+                           result['keypoint_err_ratio'] or 0.0,
+                           result['detection_ratio'] * 100.0, result['speedup']))
+    return results
+
+
+
+
+if __name__ == '__main__':
+    tf.logging.set_verbosity(tf.logging.INFO)
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--model-path',
+        required=True,
+        help='frozen .pb or .tflite of gen_tflite_coreml.py'
+    )
+
+    parser.add_argument(
+        '--sources',
+        required=True,
+        nargs='+',
+        help='video files or stream urls'
+    )
+
+    parser.add_argument(
+        '--stream-counts',
+        default=[1, 2, 4],
+        type=int,
+        nargs='+',
+        required=False
+    )
+
+    parser.add_argument(
+        '--max-batch-size',
+        default=8,
+        type=int,
+        required=False
+    )
+
+    parser.add_argument(
+        '--max-queue-size',
+        default=4,
+        type=int,
+        required=False
+    )
+
+    parser.add_argument(
+        '--is-realtime',
+        default=False,
+        type=lambda value: value == 'True',
+        required=False,
+        help='read the video files at their frame rate and drop the stale frames'
+    )
+
+    parser.add_argument(
+        '--max-duration',
+        default=None,
+        type=float,
+        required=False
+    )
+
+    parser.add_argument(
+        '--detection-intervals',
+        default=None,
+        type=int,
+        nargs='+',
+        required=False,
+        help='compare the tracking mode of these intervals with the per-frame inference '
+             'instead of the throughput benchmark'
+    )
+
+    parser.add_argument(
+        '--max-track-error',
+        default=2.0,
+        type=float,
+        required=False
+    )
+
+    parser.add_argument(
+        '--benchmark-json',
+        default=None,
+        required=False
+    )
+
+    args = parser.parse_args()
+
+    engine  = InferenceEngine(model_path=args.model_path)
+    if args.detection_intervals is not None:
+        results = compare_tracking(engine               =engine,
+                                   sources              =args.sources,
+                                   detection_intervals  =args.detection_intervals,
+                                   max_batch_size       =args.max_batch_size,
+                                   max_queue_size       =args.max_queue_size,
+                                   max_track_error_px   =args.max_track_error)
+    else:
+        results = benchmark_streams(engine          =engine,
+                                    sources         =args.sources,
+                                    stream_counts   =args.stream_counts,
+                                    max_duration_sec=args.max_duration,
+                                    max_batch_size  =args.max_batch_size,
+                                    max_queue_size  =args.max_queue_size,
+                                    is_realtime     =args.is_realtime)
+    engine.close()
+
+    if args.benchmark_json is not None:
+        with open(args.benchmark_json, 'w') as f:
+            json.dump(dict((str(key), result) for key, result in results.items()),
+                      f, indent=2)
@@ -0,0 +1,115 @@
+# Copyright 2018 Jaewook Kang (jwkang10@gmail.com)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===================================================================================
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import time
+from os import getcwd
+from os import chdir
+
+chdir('..')
+sys.path.insert(0,getcwd())
+print ('getcwd() = %s' % getcwd())
+
+
+import tensorflow as tf
+import numpy as np
+
+# custom packages
+from path_manager import TF_MODULE_DIR
+from path_manager import TF_MODEL_DIR
+from path_manager import COCO_DATALOAD_DIR
+from path_manager import COCO_REALSET_DIR
+
+sys.path.insert(0,TF_MODULE_DIR)
+sys.path.insert(0,TF_MODEL_DIR)
+sys.path.insert(0,COCO_DATALOAD_DIR)
+sys.path.insert(0,COCO_REALSET_DIR)
+
+
+import data_loader_coco
+from train_config import TrainConfig
+
+
+train_config   = TrainConfig()
+NUM_OF_WARMUP  = 3
+NUM_OF_BENCH   = 20
+
+
+class DataLoaderMultiprocTest(tf.test.TestCase):
+
+    def _get_images_per_sec(self, dataloader_mode, is_uint8_transport=False):
+
+        dataset_train = \
+            data_loader_coco.DataSetInput(
+                is_training     =True,
+                data_dir        =COCO_REALSET_DIR,
+                transpose_input =False,
+                is_testcode     =True,
+                use_bfloat16    =False,
+                dataloader_mode =dataloader_mode,
+                is_uint8_transport=is_uint8_transport)
+
+        dataset                 = dataset_train.input_fn()
+        iterator_train          = dataset.make_initializable_iterator()
+        feature_op, labels_op   = iterator_train.get_next()
+
+        with self.test_session() as sess:
+            sess.run(iterator_train.initializer)
+
+            for _ in range(0, NUM_OF_WARMUP):
+                sess.run([feature_op, labels_op])
+
+            start_time = time.time()
+            for _ in range(0, NUM_OF_BENCH):
+                feature_numpy, labels_numpy = sess.run([feature_op, labels_op])
+            elapsed_time = time.time() - start_time
+
+        self.assertEqual(feature_numpy.shape[0], train_config.batch_size)
+        self.assertEqual(feature_numpy.dtype, np.uint8 if is_uint8_transport else np.float32)
+        self.assertEqual(labels_numpy.shape[0], train_config.batch_size)
+        self.assertTrue(np.isfinite(labels_numpy).all())
+
+        if dataset_train.worker_pool is not None:
+            dataset_train.worker_pool.close()
+
+        return NUM_OF_BENCH * train_config.batch_size / elapsed_time
+
+
+
+    def test_data_loader_throughput(self):
+        '''
+            This test checks below:
+            - images/sec of the py_func path vs the multiproc worker pool
+              vs the in-graph augmentation
+            - with the images in float32 and in uint8
+        '''
+        print('\n---------------------------------------------------------')
+        print('[test_data_loader_throughput] data_dir = %s' % COCO_REALSET_DIR)
+        print('[test_data_loader_throughput] num_dataloader_workers = %s'
+              % train_config.num_dataloader_workers)
+
+        for dataloader_mode in ['py_func', 'multiproc', 'in_graph']:
+            for is_uint8_transport in [False, True]:
+                images_per_sec = self._get_images_per_sec(dataloader_mode, is_uint8_transport)
+                print('[test_data_loader_throughput] %s (is_uint8_transport = %s): %.1f images/sec'
+                      % (dataloader_mode, is_uint8_transport, images_per_sec))
+
+
+
+if __name__ == '__main__':
+    tf.test.main()
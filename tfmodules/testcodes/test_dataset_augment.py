@@ -0,0 +1,143 @@
+# Copyright 2018 Jaewook Kang (jwkang10@gmail.com)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===================================================================================
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import copy
+import time
+import random
+from os import getcwd
+from os import chdir
+
+chdir('..')
+sys.path.insert(0,getcwd())
+print ('getcwd() = %s' % getcwd())
+
+import tensorflow as tf
+import numpy as np
+
+# image processing tools
+import cv2
+
+# custom packages
+from path_manager import TF_MODULE_DIR
+from path_manager import TF_MODEL_DIR
+from path_manager import COCO_DATALOAD_DIR
+
+sys.path.insert(0,TF_MODULE_DIR)
+sys.path.insert(0,TF_MODEL_DIR)
+sys.path.insert(0,COCO_DATALOAD_DIR)
+
+import dataset_augment
+from train_config import PreprocessingConfig
+
+NUM_OF_BENCH    = 50
+
+
+class _MetaData(object):
+    '''
+        a stand-in of CocoMetadata with a smooth image and random joints
+    '''
+    def __init__(self, width, height, rng):
+        yy, xx = np.mgrid[0:height, 0:width]
+        img = np.stack([xx * 255 // width,
+                        yy * 255 // height,
+                        (xx + yy) * 255 // (width + height)], axis=-1).astype(np.uint8)
+
+        self.img        = cv2.GaussianBlur(img, (0, 0), 3)
+        self.width      = width
+        self.height     = height
+        self.joint_mask = rng.rand(1, 14) < 0.8
+        self.joint_list = np.stack([rng.randint(20, width - 20, size=(1, 14)),
+                                    rng.randint(20, height - 20, size=(1, 14))], axis=-1).astype(np.float32)
+        self.joint_list[~self.joint_mask] = -1000
+
+
+
+class DatasetAugmentTest(tf.test.TestCase):
+
+    def _pose_chain(self, meta, preproc_config):
+        meta = dataset_augment.pose_random_scale(meta)
+        meta = dataset_augment.pose_rotation(meta, preproc_config)
+        meta = dataset_augment.pose_flip(meta)
+        meta = dataset_augment.pose_resize_shortestedge_random(meta)
+        return meta
+
+
+
+    def test_fused_affine(self):
+        '''
+            This test checks below:
+            - whether pose_affine_random() gives the image and joints of the chain
+              in preprocess_image() for the same random draws
+              (without the random crop whose draws differ)
+        '''
+        preproc_config          = PreprocessingConfig()
+        preproc_config.is_crop  = False
+        network_w, network_h    = dataset_augment._network_w, dataset_augment._network_h
+
+        rng = np.random.RandomState(0)
+        for seed in range(0, 40):
+            width, height = [(640, 480), (480, 640), (300, 200), (1280, 720)][seed % 4]
+            meta_chain  = _MetaData(width, height, rng)
+            meta_fused  = copy.deepcopy(meta_chain)
+
+            random.seed(seed)
+            meta_chain  = self._pose_chain(meta_chain, preproc_config)
+            img_chain   = cv2.resize(meta_chain.img, (network_w, network_h), interpolation=cv2.INTER_AREA)
+            joints_chain = np.array(meta_chain.joint_list, dtype=np.float64) \
+                           * [float(network_w) / meta_chain.width, float(network_h) / meta_chain.height]
+
+            random.seed(seed)
+            meta_fused  = dataset_augment.pose_affine_random(meta_fused, preproc_config)
+            joints_fused = np.array(meta_fused.joint_list, dtype=np.float64)
+
+            self.assertEqual(meta_fused.img.shape, img_chain.shape)
+            # at most 0.31 grey levels over the seeds
+            self.assertLess(np.abs(meta_fused.img.astype(np.float32) - img_chain).mean(), 0.35)
+
+            is_valid = meta_chain.joint_mask
+            self.assertAllEqual(is_valid, meta_fused.joint_mask)
+            # the chain rounds the joints at every step; at most 2.23 px over the seeds
+            self.assertAllClose(joints_chain[is_valid], joints_fused[is_valid], atol=2.5, rtol=0.0)
+
+
+
+    def test_fused_affine_speed(self):
+        '''
+            microbenchmark of the resampling chain vs pose_affine_random()
+        '''
+        preproc_config  = PreprocessingConfig()
+        meta            = _MetaData(640, 480, np.random.RandomState(0))
+
+        for is_fused_affine in [False, True]:
+            start_time = time.time()
+            for _ in range(0, NUM_OF_BENCH):
+                meta_copy = copy.deepcopy(meta)
+                if is_fused_affine:
+                    dataset_augment.pose_affine_random(meta_copy, preproc_config)
+                else:
+                    dataset_augment.pose_crop_random(self._pose_chain(meta_copy, preproc_config))
+            elapsed_time = (time.time() - start_time) / NUM_OF_BENCH
+
+            print('[test_fused_affine_speed] is_fused_affine = %s: %.3f ms per sample'
+                  % (is_fused_affine, elapsed_time * 1000.0))
+
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,294 @@
+# Copyright 2018 Jaewook Kang (jwkang10@gmail.com)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===================================================================================
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import copy
+import random
+from os import getcwd
+from os import chdir
+
+chdir('..')
+sys.path.insert(0,getcwd())
+print ('getcwd() = %s' % getcwd())
+
+import tensorflow as tf
+import numpy as np
+
+# image processing tools
+import cv2
+
+# custom packages
+from path_manager import TF_MODULE_DIR
+from path_manager import TF_MODEL_DIR
+from path_manager import COCO_DATALOAD_DIR
+
+sys.path.insert(0,TF_MODULE_DIR)
+sys.path.insert(0,TF_MODEL_DIR)
+sys.path.insert(0,COCO_DATALOAD_DIR)
+
+import dataset_augment
+import dataset_augment_tf
+from dataset_prepare import CocoMetadata
+from train_config import PreprocessingConfig
+
+NUM_OF_SAMPLES  = 300
+IMAGE_WIDTH     = 640
+IMAGE_HEIGHT    = 480
+
+
+class _MetaData(object):
+    '''
+        a stand-in of CocoMetadata with a smooth image and the joints of keypoints
+    '''
+    def __init__(self, img, keypoints, sigma):
+        self.img        = img
+        self.width      = img.shape[1]
+        self.height     = img.shape[0]
+        self.sigma      = sigma
+        self.joint_list, self.joint_mask = CocoMetadata.get_joint_list(keypoints)
+
+    get_heatmap_at_target_resol = CocoMetadata.__dict__['get_heatmap_at_target_resol']
+    put_joint_heatmaps          = CocoMetadata.__dict__['put_joint_heatmaps']
+    get_keypoint_label          = CocoMetadata.__dict__['get_keypoint_label']
+
+
+
+def _make_image(width, height):
+    yy, xx = np.mgrid[0:height, 0:width]
+    img = np.stack([xx * 255 // width,
+                    yy * 255 // height,
+                    (xx + yy) * 255 // (width + height)], axis=-1).astype(np.uint8)
+    return cv2.GaussianBlur(img, (0, 0), 3)
+
+
+
+def _make_keypoints(rng, num_people, width, height):
+    keypoints = np.zeros([num_people, 14, 3], dtype=np.float32)
+    keypoints[:, :, 0] = rng.randint(60, width - 60, size=(num_people, 14))
+    keypoints[:, :, 1] = rng.randint(60, height - 60, size=(num_people, 14))
+    keypoints[:, :, 2] = rng.choice([0, 1, 2], p=[0.1, 0.2, 0.7], size=(num_people, 14))
+    return keypoints
+
+
+
+class DatasetAugmentTfTest(tf.test.TestCase):
+
+    def test_warp_image(self):
+        '''
+            This test checks below:
+            - whether warp_image() gives cv2.warpAffine() of the same affine
+              including the border and the large shrink
+        '''
+        network_w, network_h    = dataset_augment._network_w, dataset_augment._network_h
+        preproc_config          = PreprocessingConfig()
+        img                     = _make_image(IMAGE_WIDTH, IMAGE_HEIGHT)
+        rng                     = np.random.RandomState(0)
+
+        img_ph      = tf.placeholder(tf.float32, [None, None, 3])
+        affine_ph   = tf.placeholder(tf.float32, [3, 3])
+        border_ph   = tf.placeholder(tf.float32, [3])
+        warped      = dataset_augment_tf.warp_image(img            =img_ph,
+                                                    affine         =affine_ph,
+                                                    border_color   =border_ph,
+                                                    crop_rect      =tf.constant([0, 0, network_w, network_h]),
+                                                    canvas_size    =dataset_augment_tf._get_canvas_size(preproc_config))
+
+        with self.test_session() as sess:
+            for scale in [0.3, 0.6, 1.0, 1.4]:
+                deg     = rng.uniform(preproc_config.MIN_AUGMENT_ROTATE_ANGLE_DEG,
+                                      preproc_config.MAX_AUGMENT_ROTATE_ANGLE_DEG)
+                rot_m   = cv2.getRotationMatrix2D((IMAGE_WIDTH // 2, IMAGE_HEIGHT // 2), deg, scale)
+                affine  = dataset_augment._get_translate_affine(network_w // 2 - IMAGE_WIDTH // 2,
+                                                                network_h // 2 - IMAGE_HEIGHT // 2)\
+                    .dot(np.vstack([rot_m, [0.0, 0.0, 1.0]]))
+                border_color = rng.randint(0, 256, size=3)
+
+                # the large shrink goes through INTER_AREA first as in pose_affine_random()
+                src_img, src_affine = img, affine
+                if scale < 0.5:
+                    neww, newh  = int(IMAGE_WIDTH * scale + 0.5), int(IMAGE_HEIGHT * scale + 0.5)
+                    src_img     = cv2.resize(img, (neww, newh), interpolation=cv2.INTER_AREA)
+                    src_affine  = affine.dot(np.linalg.inv(
+                        dataset_augment._get_resize_affine(IMAGE_WIDTH, IMAGE_HEIGHT, neww, newh)))
+
+                img_cv2 = cv2.warpAffine(src_img, src_affine[:2], (network_w, network_h),
+                                         flags=cv2.INTER_LINEAR,
+                                         borderMode=cv2.BORDER_CONSTANT,
+                                         borderValue=tuple(int(color) for color in border_color))
+
+                img_tf = sess.run(warped, feed_dict={img_ph   : img,
+                                                     affine_ph: affine,
+                                                     border_ph: border_color})
+
+                self.assertEqual(img_tf.shape, img_cv2.shape)
+                self.assertLess(np.abs(img_tf - img_cv2).mean(), 2.0)
+
+
+
+    def test_eval_parity(self):
+        '''
+            This test checks below:
+            - whether the evaluation output is the cv2.INTER_AREA image
+              and the heatmap of get_heatmap_at_target_resol()
+        '''
+        preproc_config  = PreprocessingConfig()
+        img             = _make_image(IMAGE_WIDTH, IMAGE_HEIGHT)
+        keypoints       = _make_keypoints(np.random.RandomState(0), 3, IMAGE_WIDTH, IMAGE_HEIGHT)
+
+        network_w, network_h = dataset_augment._network_w, dataset_augment._network_h
+        meta            = _MetaData(img, keypoints, preproc_config.heatmap_std)
+        img_cv2         = cv2.resize(img, (network_w, network_h), interpolation=cv2.INTER_AREA)
+        heatmap_cv2     = meta.get_heatmap_at_target_resol((network_w // dataset_augment._scale,
+                                                            network_h // dataset_augment._scale))
+
+        img_op, heatmap_op = dataset_augment_tf.preprocess_image(img           =tf.constant(img),
+                                                                 keypoints     =tf.constant(keypoints),
+                                                                 preproc_config=preproc_config,
+                                                                 sigma         =preproc_config.heatmap_std,
+                                                                 is_training   =False)
+        with self.test_session() as sess:
+            img_tf, heatmap_tf = sess.run([img_op, heatmap_op])
+
+        self.assertLess(np.abs(img_tf - img_cv2).mean(), 1.0)
+        self.assertAllClose(heatmap_tf, heatmap_cv2.astype(np.float32), atol=2e-3, rtol=0.0)
+
+
+
+    def test_keypoint_label(self):
+        '''
+            This test checks below:
+            - whether the keypoint label of the TF ops is the one of CocoMetadata
+            - whether render_keypoint_heatmaps() of a batch of the labels gives
+              get_heatmap_at_target_resol() of the augmented samples
+        '''
+        preproc_config  = PreprocessingConfig()
+        img             = _make_image(IMAGE_WIDTH, IMAGE_HEIGHT)
+        rng             = np.random.RandomState(0)
+
+        network_w, network_h    = dataset_augment._network_w, dataset_augment._network_h
+        heatmap_size            = (network_w // dataset_augment._scale, network_h // dataset_augment._scale)
+
+        keypoints_ph    = tf.placeholder(tf.float32, [None, 14, 3])
+        _, label_op     = dataset_augment_tf.preprocess_image(img              =tf.constant(img),
+                                                              keypoints        =keypoints_ph,
+                                                              preproc_config   =preproc_config,
+                                                              sigma            =preproc_config.heatmap_std,
+                                                              is_training      =False,
+                                                              is_keypoint_label=True)
+        labels_ph       = tf.placeholder(tf.float32, [None, 4, 3])
+        heatmaps_op     = dataset_augment_tf.render_keypoint_heatmaps(keypoints  =labels_ph,
+                                                                      sigma      =preproc_config.heatmap_std,
+                                                                      scale      =(heatmap_size[0] / float(network_w),
+                                                                                   heatmap_size[1] / float(network_h)),
+                                                                      target_size=heatmap_size)
+
+        labels, heatmaps_ref = [], []
+        with self.test_session() as sess:
+            for num_people in [0, 1, 1, 2]:
+                keypoints   = _make_keypoints(rng, num_people, IMAGE_WIDTH, IMAGE_HEIGHT)
+                meta        = _MetaData(img, keypoints, preproc_config.heatmap_std)
+
+                label_tf = sess.run(label_op, feed_dict={keypoints_ph: keypoints})
+                self.assertAllClose(label_tf, meta.get_keypoint_label((network_w, network_h)), atol=1e-3)
+
+                # on the augmented samples of the py_func path for one person
+                meta            = _MetaData(img, keypoints[0:1], preproc_config.heatmap_std)
+                random.seed(num_people)
+                meta            = dataset_augment.pose_affine_random(meta, preproc_config)
+                labels.append(meta.get_keypoint_label((network_w, network_h)))
+                heatmaps_ref.append(meta.get_heatmap_at_target_resol(heatmap_size))
+
+            heatmaps_tf = sess.run(heatmaps_op, feed_dict={labels_ph: np.array(labels)})
+
+        self.assertAllClose(heatmaps_tf, np.array(heatmaps_ref, dtype=np.float32), atol=2e-3, rtol=0.0)
+
+
+
+    def test_augment_parity(self):
+        '''
+            This test checks below:
+            - whether the in-graph augmentation draws the joints in the same distribution
+              as pose_affine_random() of the opencv path
+            - whether the joints stay on the image content they are drawn on
+        '''
+        preproc_config  = PreprocessingConfig()
+        rng             = np.random.RandomState(0)
+        keypoints       = _make_keypoints(rng, 2, IMAGE_WIDTH, IMAGE_HEIGHT)
+        tf.set_random_seed(0)
+        keypoints[:, :, 2] = 2
+
+        # a black image with a bright dot under every joint
+        img = np.zeros([IMAGE_HEIGHT, IMAGE_WIDTH, 3], dtype=np.uint8)
+        for x, y in keypoints[:, :, 0:2].reshape(-1, 2).astype(np.int64):
+            cv2.circle(img, (int(x), int(y)), 6, (255, 255, 255), -1)
+
+        img_op, heatmap_op = dataset_augment_tf.preprocess_image(img           =tf.constant(img),
+                                                                 keypoints     =tf.constant(keypoints),
+                                                                 preproc_config=preproc_config,
+                                                                 sigma         =preproc_config.heatmap_std,
+                                                                 is_training   =True)
+        joint_list, joint_mask = dataset_augment_tf.get_joint_list(tf.constant(keypoints))
+        augment = dataset_augment_tf.get_augment_affine(width          =float(IMAGE_WIDTH),
+                                                        height         =float(IMAGE_HEIGHT),
+                                                        preproc_config =preproc_config)
+        joints_op, mask_op = dataset_augment_tf.transform_joints(joint_list    =joint_list,
+                                                                 joint_mask    =joint_mask,
+                                                                 affine        =augment['affine'],
+                                                                 is_flipped    =augment['is_flipped'])
+
+        joints_tf, joints_cv2 = [], []
+        with self.test_session() as sess:
+            for _ in range(0, NUM_OF_SAMPLES):
+                joints, mask = sess.run([joints_op, mask_op])
+                joints_tf.append(np.where(mask[:, :, np.newaxis], joints, np.nan))
+
+            for _ in range(0, 20):
+                img_tf, heatmap_tf = sess.run([img_op, heatmap_op])
+                self.assertEqual(heatmap_tf.shape[2], 4)
+
+                # the heatmap peaks are on the dots
+                for plane in range(0, 4):
+                    if heatmap_tf[:, :, plane].max() < 0.5:
+                        continue
+                    y, x = np.unravel_index(np.argmax(heatmap_tf[:, :, plane]), heatmap_tf.shape[0:2])
+                    patch = img_tf[max(0, y * 4 - 4):y * 4 + 8, max(0, x * 4 - 4):x * 4 + 8]
+                    self.assertGreater(patch.max(), 128.0)
+
+        random.seed(0)
+        for _ in range(0, NUM_OF_SAMPLES):
+            meta = _MetaData(img, keypoints, preproc_config.heatmap_std)
+            meta = dataset_augment.pose_affine_random(copy.deepcopy(meta), preproc_config)
+            joints_cv2.append(np.where(meta.joint_mask[:, :, np.newaxis], meta.joint_list, np.nan))
+
+        joints_tf   = np.array(joints_tf, dtype=np.float64)
+        joints_cv2  = np.array(joints_cv2, dtype=np.float64)
+
+        # valid rate, mean and spread of the joints over the draws.
+        # The means are compared within five standard errors
+        self.assertAllClose(np.isfinite(joints_tf[:, :, :, 0]).mean(),
+                            np.isfinite(joints_cv2[:, :, :, 0]).mean(), atol=0.05, rtol=0.0)
+
+        std_err = np.sqrt((np.nanvar(joints_tf, axis=0) + np.nanvar(joints_cv2, axis=0)) / NUM_OF_SAMPLES)
+        self.assertTrue(np.all(np.abs(np.nanmean(joints_tf, axis=0) - np.nanmean(joints_cv2, axis=0))
+                               < 5.0 * std_err + 1.0))
+        self.assertAllClose(np.nanstd(joints_tf, axis=0), np.nanstd(joints_cv2, axis=0), atol=2.0, rtol=0.2)
+
+
+
+if __name__ == '__main__':
+    tf.test.main()
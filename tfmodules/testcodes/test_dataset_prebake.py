@@ -0,0 +1,267 @@
+# Copyright 2018 Jaewook Kang (jwkang10@gmail.com)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===================================================================================
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import os
+import json
+import shutil
+import tempfile
+from os import getcwd
+from os import chdir
+
+chdir('..')
+sys.path.insert(0,getcwd())
+print ('getcwd() = %s' % getcwd())
+
+import tensorflow as tf
+import numpy as np
+
+# image processing tools
+import cv2
+
+# custom packages
+from path_manager import TF_MODULE_DIR
+from path_manager import TF_MODEL_DIR
+from path_manager import COCO_DATALOAD_DIR
+
+sys.path.insert(0,TF_MODULE_DIR)
+sys.path.insert(0,TF_MODEL_DIR)
+sys.path.insert(0,COCO_DATALOAD_DIR)
+
+import dataset_prebake
+from dataset_index import CocoAnnotationIndex
+from train_config import PreprocessingConfig
+
+from model_config  import DEFAULT_INPUT_RESOL
+from model_config  import DEFAULT_HG_INOUT_RESOL
+from model_config  import DEFAULT_INPUT_CHNUM
+from model_config  import NUM_OF_KEYPOINTS
+
+preproc_config  = PreprocessingConfig()
+
+IMAGE_HEIGHT    = 480
+IMAGE_WIDTH     = 640
+NUM_OF_IMAGES   = 6
+NUM_OF_VARIANTS = 3
+NUM_OF_SHARDS   = 4
+
+IMAGE_SHAPE     = [int(DEFAULT_INPUT_RESOL), int(DEFAULT_INPUT_RESOL), DEFAULT_INPUT_CHNUM]
+HEATMAP_SHAPE   = [int(DEFAULT_HG_INOUT_RESOL), int(DEFAULT_HG_INOUT_RESOL), NUM_OF_KEYPOINTS]
+
+
+class DatasetPrebakeTest(tf.test.TestCase):
+
+    def _make_dataset(self, data_dir):
+        '''
+            a coco-form json with random images and one person per image
+        '''
+        rng = np.random.RandomState(0)
+        os.makedirs(os.path.join(data_dir, 'images'))
+
+        images      = []
+        annotations = []
+        for n in range(0, NUM_OF_IMAGES):
+            cv2.imwrite(os.path.join(data_dir, 'images', '%d.jpg' % n),
+                        (rng.rand(IMAGE_HEIGHT, IMAGE_WIDTH, 3) * 255.0).astype(np.uint8))
+            images.append({'id': 100 + n, 'file_name': 'testset/images/%d.jpg' % n,
+                           'height': IMAGE_HEIGHT, 'width': IMAGE_WIDTH})
+
+            keypoints = []
+            for _ in range(0, 14):
+                keypoints += [int(rng.randint(100, IMAGE_WIDTH - 100)),
+                              int(rng.randint(100, IMAGE_HEIGHT - 100)), 2]
+            annotations.append({'image_id': 100 + n, 'keypoints': keypoints, 'num_keypoints': 14})
+
+        json_path = os.path.join(data_dir, 'testset_train.json')
+        with open(json_path, 'w') as json_file:
+            json.dump({'images': images, 'annotations': annotations}, json_file)
+        return json_path
+
+
+
+    def test_prebake(self):
+        '''
+            This test checks below:
+            - whether every (image, variant) is prebaked once into the shards
+            - whether a record is reproduced by make_record() with its recorded seed
+        '''
+        data_dir    = tempfile.mkdtemp()
+        out_dir     = os.path.join(data_dir, 'prebaked')
+        json_path   = self._make_dataset(data_dir)
+
+        try:
+            dataset_prebake.prebake(json_path       =json_path,
+                                    data_dir        =data_dir,
+                                    out_dir         =out_dir,
+                                    preproc_config  =preproc_config,
+                                    image_shape     =IMAGE_SHAPE,
+                                    heatmap_shape   =HEATMAP_SHAPE,
+                                    num_variants    =NUM_OF_VARIANTS,
+                                    num_shards      =NUM_OF_SHARDS,
+                                    num_workers     =2)
+            manifest    = dataset_prebake.load_manifest(out_dir)
+            anno_index  = CocoAnnotationIndex.load_or_build(json_path)
+
+            records = []
+            for shard_idx, shard in enumerate(manifest['shards']):
+                shard_path = os.path.join(out_dir, shard['filename'])
+                self.assertEqual(os.path.getsize(shard_path),
+                                 shard['num_records'] * manifest['record_bytes'])
+                records += zip(shard['image_ids'], shard['variants'])
+
+            self.assertEqual(sorted(records),
+                             [(100 + n, variant) for n in range(0, NUM_OF_IMAGES)
+                              for variant in range(0, NUM_OF_VARIANTS)])
+
+            shard = manifest['shards'][0]
+            for record_idx in range(0, shard['num_records']):
+                images, labels = dataset_prebake.read_record(out_dir, manifest, 0, record_idx)
+                images_ref, labels_ref = dataset_prebake.make_record(anno_index     =anno_index,
+                                                                     row            =shard['rows'][record_idx],
+                                                                     data_dir       =data_dir,
+                                                                     preproc_config =preproc_config,
+                                                                     seed           =shard['seeds'][record_idx])
+                self.assertEqual(list(images.shape), IMAGE_SHAPE)
+                self.assertEqual(list(labels.shape), HEATMAP_SHAPE)
+                self.assertAllEqual(images, images_ref)
+                self.assertAllEqual(labels, labels_ref)
+        finally:
+            shutil.rmtree(data_dir)
+
+
+
+    def test_prebake_resume(self):
+        '''
+            This test checks below:
+            - whether the shards of the same prebake are kept on a rerun
+            - whether the shards of another base_seed are rewritten
+              to the records of the new manifest instead of kept by their size
+        '''
+        data_dir    = tempfile.mkdtemp()
+        out_dir     = os.path.join(data_dir, 'prebaked')
+        json_path   = self._make_dataset(data_dir)
+
+        def run_prebake(base_seed):
+            return dataset_prebake.prebake(json_path       =json_path,
+                                           data_dir        =data_dir,
+                                           out_dir         =out_dir,
+                                           preproc_config  =preproc_config,
+                                           image_shape     =IMAGE_SHAPE,
+                                           heatmap_shape   =HEATMAP_SHAPE,
+                                           num_variants    =NUM_OF_VARIANTS,
+                                           num_shards      =NUM_OF_SHARDS,
+                                           num_workers     =2,
+                                           base_seed       =base_seed)
+
+        try:
+            manifest    = run_prebake(base_seed=0)
+            shard_path  = os.path.join(out_dir, manifest['shards'][0]['filename'])
+            images, _   = dataset_prebake.read_record(out_dir, manifest, 0, 0)
+
+            # the shards are kept for the same prebake
+            os.utime(shard_path, (0, 0))
+            run_prebake(base_seed=0)
+            self.assertEqual(os.path.getmtime(shard_path), 0)
+
+            # and rewritten for another seed of the same size
+            manifest    = run_prebake(base_seed=1)
+            self.assertNotEqual(os.path.getmtime(shard_path), 0)
+            self.assertEqual(dataset_prebake.load_manifest(out_dir), manifest)
+
+            anno_index  = CocoAnnotationIndex.load_or_build(json_path)
+            shard       = manifest['shards'][0]
+            images_new, labels_new = dataset_prebake.read_record(out_dir, manifest, 0, 0)
+            images_ref, labels_ref = dataset_prebake.make_record(anno_index     =anno_index,
+                                                                 row            =shard['rows'][0],
+                                                                 data_dir       =data_dir,
+                                                                 preproc_config =preproc_config,
+                                                                 seed           =shard['seeds'][0])
+            self.assertAllEqual(images_new, images_ref)
+            self.assertAllEqual(labels_new, labels_ref)
+            self.assertGreater(np.abs(images_new.astype(np.int32) - images.astype(np.int32)).max(), 0)
+        finally:
+            shutil.rmtree(data_dir)
+
+
+
+
+    def test_eval_cache(self):
+        '''
+            This test checks below:
+            - whether the eval cache has every image once in the order of the index
+              with the records of the evaluation preprocessing
+            - whether the cache is reused for the same config and rebuilt for another one
+        '''
+        data_dir    = tempfile.mkdtemp()
+        cache_dir   = os.path.join(data_dir, 'eval_cache')
+        json_path   = self._make_dataset(data_dir)
+
+        try:
+            eval_cache_dir = dataset_prebake.get_eval_cache(json_path       =json_path,
+                                                            data_dir        =data_dir,
+                                                            cache_dir       =cache_dir,
+                                                            preproc_config  =preproc_config,
+                                                            image_shape     =IMAGE_SHAPE,
+                                                            heatmap_shape   =HEATMAP_SHAPE,
+                                                            num_shards      =NUM_OF_SHARDS,
+                                                            num_workers     =2)
+            manifest    = dataset_prebake.load_manifest(eval_cache_dir)
+            anno_index  = CocoAnnotationIndex.load_or_build(json_path)
+
+            self.assertFalse(manifest['is_training'])
+            self.assertEqual([row for shard in manifest['shards'] for row in shard['rows']],
+                             list(range(0, NUM_OF_IMAGES)))
+
+            for shard_idx, shard in enumerate(manifest['shards']):
+                for record_idx in range(0, shard['num_records']):
+                    images, labels = dataset_prebake.read_record(eval_cache_dir, manifest, shard_idx, record_idx)
+                    images_ref, labels_ref = dataset_prebake.make_record(anno_index     =anno_index,
+                                                                         row            =shard['rows'][record_idx],
+                                                                         data_dir       =data_dir,
+                                                                         preproc_config =preproc_config,
+                                                                         seed           =0,
+                                                                         is_training    =False)
+                    self.assertAllEqual(images, images_ref)
+                    self.assertAllEqual(labels, labels_ref)
+
+            shard_path  = os.path.join(eval_cache_dir, manifest['shards'][0]['filename'])
+            mtime_kept  = os.path.getmtime(shard_path)
+            self.assertEqual(dataset_prebake.get_eval_cache(json_path       =json_path,
+                                                            data_dir        =data_dir,
+                                                            cache_dir       =cache_dir,
+                                                            preproc_config  =preproc_config,
+                                                            image_shape     =IMAGE_SHAPE,
+                                                            heatmap_shape   =HEATMAP_SHAPE,
+                                                            num_shards      =NUM_OF_SHARDS,
+                                                            num_workers     =2), eval_cache_dir)
+            self.assertEqual(os.path.getmtime(shard_path), mtime_kept)
+
+            other_config = PreprocessingConfig()
+            other_config.heatmap_std = preproc_config.heatmap_std * 2.0
+            self.assertNotEqual(dataset_prebake.get_eval_cache_key(json_path     =json_path,
+                                                                   data_dir      =data_dir,
+                                                                   preproc_config=other_config,
+                                                                   image_shape   =IMAGE_SHAPE,
+                                                                   heatmap_shape =HEATMAP_SHAPE),
+                                os.path.basename(eval_cache_dir)[len('eval-'):])
+        finally:
+            shutil.rmtree(data_dir)
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,281 @@
+# Copyright 2018 Jaewook Kang (jwkang10@gmail.com)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===================================================================================
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import os
+import time
+import json
+import errno
+import shutil
+import tempfile
+from os import getcwd
+from os import chdir
+
+chdir('..')
+sys.path.insert(0,getcwd())
+print ('getcwd() = %s' % getcwd())
+
+import tensorflow as tf
+import numpy as np
+
+# image processing tools
+import cv2
+
+# custom packages
+from path_manager import TF_MODULE_DIR
+from path_manager import TF_MODEL_DIR
+from path_manager import COCO_DATALOAD_DIR
+
+sys.path.insert(0,TF_MODULE_DIR)
+sys.path.insert(0,TF_MODEL_DIR)
+sys.path.insert(0,COCO_DATALOAD_DIR)
+
+from dataset_prepare import CocoMetadata
+from dataset_index import CocoAnnotationIndex
+import dataset_index
+from dataset_image_cache import DecodedImageCache
+from train_config import PreprocessingConfig
+
+preproc_config  = PreprocessingConfig()
+
+IMAGE_HEIGHT    = 480
+IMAGE_WIDTH     = 640
+TARGET_SIZE     = (64, 64)
+NUM_OF_BENCH    = 20
+
+
+class DatasetPrepareTest(tf.test.TestCase):
+
+    def _get_annotations(self, num_people, seed):
+        '''
+            random coco annotations including
+            mislabeled, fractional and out-of-image joints
+        '''
+        rng = np.random.RandomState(seed)
+
+        annotations = []
+        for _ in range(num_people):
+            keypoints = []
+            for _ in range(14):
+                x = float(rng.uniform(-20, IMAGE_WIDTH + 20))
+                y = float(rng.uniform(-20, IMAGE_HEIGHT + 20))
+                if rng.rand() < 0.5:
+                    x, y = int(x), int(y)
+                keypoints += [x, y, int(rng.choice([0, 1, 2]))]
+            annotations.append({'keypoints': keypoints, 'num_keypoints': 14})
+
+        return annotations
+
+
+
+    def _get_img_meta_data(self, num_people, seed):
+        '''
+            a CocoMetadata with random joints of _get_annotations()
+        '''
+        img_path = os.path.join(tempfile.gettempdir(), 'test_dataset_prepare.jpg')
+        if not os.path.exists(img_path):
+            rng = np.random.RandomState(seed)
+            cv2.imwrite(img_path, (rng.rand(IMAGE_HEIGHT, IMAGE_WIDTH, 3) * 255.0).astype(np.uint8))
+
+        return CocoMetadata(idx         =seed,
+                            img_path    =img_path,
+                            img_meta    ={'height': IMAGE_HEIGHT, 'width': IMAGE_WIDTH},
+                            annotations =self._get_annotations(num_people, seed),
+                            sigma       =preproc_config.heatmap_std)
+
+
+
+    def test_vectorized_heatmap(self):
+        '''
+            This test checks below:
+            - whether the batched renderer gives the same heatmap as the per-pixel loop
+        '''
+        for seed in range(0, 50):
+            img_meta_data = self._get_img_meta_data(num_people=1 + seed % 3, seed=seed)
+
+            heatmap_loop = img_meta_data.get_heatmap(target_size=TARGET_SIZE, is_vectorized=False)
+            heatmap_vect = img_meta_data.get_heatmap(target_size=TARGET_SIZE, is_vectorized=True)
+
+            self.assertAllEqual(heatmap_loop, heatmap_vect)
+
+
+
+    def test_target_resol_heatmap(self):
+        '''
+            This test checks below:
+            - whether the heatmap rendered at the target resolution
+              agrees with the one rendered at the image size and resized
+        '''
+        for seed in range(0, 50):
+            img_meta_data = self._get_img_meta_data(num_people=1, seed=seed)
+
+            heatmap_full   = img_meta_data.get_heatmap(target_size=TARGET_SIZE,
+                                                       is_target_resol=False).astype(np.float32)
+            heatmap_target = img_meta_data.get_heatmap(target_size=TARGET_SIZE,
+                                                       is_target_resol=True).astype(np.float32)
+
+            self.assertEqual(heatmap_full.shape, heatmap_target.shape)
+            # the two differ only around the cut-off edge of the gaussian window
+            self.assertAllClose(heatmap_full, heatmap_target, atol=0.2, rtol=0.0)
+
+            for part_index in range(0, heatmap_full.shape[2]):
+                if heatmap_full[:, :, part_index].max() < 0.5:
+                    continue
+                self.assertEqual(np.argmax(heatmap_full[:, :, part_index]),
+                                 np.argmax(heatmap_target[:, :, part_index]))
+
+
+
+    def test_annotation_index(self):
+        '''
+            This test checks below:
+            - whether the CocoAnnotationIndex sidecar gives the same joint_list
+              as the annotation dicts
+        '''
+        images      = []
+        annotations = []
+        for seed in range(0, 20):
+            images.append({'id': 100 + seed, 'file_name': 'images/train/%d.jpg' % seed,
+                           'height': IMAGE_HEIGHT, 'width': IMAGE_WIDTH})
+            for ann in self._get_annotations(num_people=seed % 3, seed=seed):
+                ann['image_id'] = 100 + seed
+                annotations.append(ann)
+
+        json_path = os.path.join(tempfile.gettempdir(), 'test_dataset_prepare.json')
+        with open(json_path, 'w') as json_file:
+            json.dump({'images': images, 'annotations': annotations}, json_file)
+        if os.path.exists(CocoAnnotationIndex.get_index_path(json_path)):
+            os.remove(CocoAnnotationIndex.get_index_path(json_path))
+
+        for anno_index in [CocoAnnotationIndex.load_or_build(json_path),     # build
+                           CocoAnnotationIndex.load_or_build(json_path)]:    # load
+            self.assertEqual(len(anno_index), len(images))
+
+            for row, img_meta in enumerate(images):
+                joint_list_index, joint_mask_index  = CocoMetadata.get_joint_list(anno_index.get_keypoints(row))
+                img_meta_data                       = self._get_img_meta_data(num_people=row % 3, seed=row)
+
+                self.assertEqual(anno_index.get_filename(row), img_meta['file_name'])
+                self.assertEqual(anno_index.get_row(img_meta['id']), row)
+                self.assertAllEqual(joint_list_index, img_meta_data.joint_list)
+                self.assertAllEqual(joint_mask_index, img_meta_data.joint_mask)
+
+
+
+    def test_annotation_index_not_saved(self):
+        '''
+            This test checks below:
+            - whether the index is built in memory when it cannot be saved
+              next to the json as of a read-only data dir
+            - whether no temp file of the index is left behind
+        '''
+        data_dir    = tempfile.mkdtemp()
+        json_path   = os.path.join(data_dir, 'test_dataset_prepare.json')
+        with open(json_path, 'w') as json_file:
+            json.dump({'images': [{'id': 100, 'file_name': 'images/train/0.jpg',
+                                   'height': IMAGE_HEIGHT, 'width': IMAGE_WIDTH}],
+                       'annotations': []}, json_file)
+
+        try:
+            # the rename of a read-only data dir fails
+            with tf.test.mock.patch.object(dataset_index.os, 'rename',
+                                           side_effect=OSError(errno.EROFS, 'Read-only file system')):
+                anno_index = CocoAnnotationIndex.load_or_build(json_path)
+
+            self.assertEqual(len(anno_index), 1)
+            self.assertEqual(anno_index.get_filename(0), 'images/train/0.jpg')
+            self.assertEqual(os.listdir(data_dir), ['test_dataset_prepare.json'])
+        finally:
+            shutil.rmtree(data_dir)
+
+
+
+    def test_image_cache(self):
+        '''
+            This test checks below:
+            - whether DecodedImageCache keeps the LRU images within the memory budget
+            - whether the spilled images are reloaded without decoding
+        '''
+        img_paths = []
+        for n in range(0, 4):
+            img_path = os.path.join(tempfile.gettempdir(), 'test_image_cache_%d.jpg' % n)
+            cv2.imwrite(img_path, np.full((IMAGE_HEIGHT, IMAGE_WIDTH, 3), n * 50, dtype=np.uint8))
+            img_paths.append(img_path)
+
+        spill_dir   = tempfile.mkdtemp()
+        img_nbytes  = IMAGE_HEIGHT * IMAGE_WIDTH * 3
+
+        image_cache = DecodedImageCache(read_fn     =CocoMetadata.read_image,
+                                        max_bytes   =img_nbytes * 2,
+                                        spill_dir   =spill_dir)
+
+        for img_path in img_paths + img_paths[-1:]:
+            img = image_cache.get(img_path)
+            self.assertFalse(img.flags.writeable)
+            self.assertAllEqual(img, CocoMetadata.read_image(img_path))
+
+        self.assertEqual(image_cache.num_misses, 4)
+        self.assertEqual(image_cache.num_hits, 1)
+        self.assertEqual(list(image_cache.images.keys()), img_paths[2:])
+        self.assertLessEqual(image_cache.num_bytes, img_nbytes * 2)
+
+        # a restarted cache reads the spill files
+        image_cache = DecodedImageCache(read_fn     =CocoMetadata.read_image,
+                                        max_bytes   =img_nbytes * 2,
+                                        spill_dir   =spill_dir)
+        for img_path in img_paths:
+            img_meta_data = CocoMetadata(idx         =0,
+                                         img_path    =img_path,
+                                         img_meta    ={'height': IMAGE_HEIGHT, 'width': IMAGE_WIDTH},
+                                         annotations =[],
+                                         sigma       =preproc_config.heatmap_std,
+                                         image_cache =image_cache)
+            self.assertAllEqual(img_meta_data.img, CocoMetadata.read_image(img_path))
+
+        self.assertEqual(image_cache.num_misses, 0)
+        self.assertEqual(image_cache.num_spill_hits, 4)
+
+        shutil.rmtree(spill_dir)
+
+
+
+    def test_heatmap_render_speed(self):
+        '''
+            microbenchmark of put_heatmap() loop vs put_heatmaps() broadcast
+        '''
+        img_meta_data = self._get_img_meta_data(num_people=1, seed=0)
+        img_meta_data.joint_list = np.stack([np.random.randint(0, IMAGE_WIDTH, size=(1, 14)),
+                                             np.random.randint(0, IMAGE_HEIGHT, size=(1, 14))],
+                                            axis=-1).astype(np.float32)
+        img_meta_data.joint_mask = np.ones((1, 14), dtype=np.bool_)
+
+        for is_vectorized, is_target_resol in [(False, False), (True, False), (True, True)]:
+            start_time = time.time()
+            for _ in range(0, NUM_OF_BENCH):
+                img_meta_data.get_heatmap(target_size    =TARGET_SIZE,
+                                          is_vectorized  =is_vectorized,
+                                          is_target_resol=is_target_resol)
+            elapsed_time = (time.time() - start_time) / NUM_OF_BENCH
+
+            print('[test_heatmap_render_speed] is_vectorized = %s, is_target_resol = %s: %.3f ms per sample'
+                  % (is_vectorized, is_target_resol, elapsed_time * 1000.0))
+
+
+
+if __name__ == '__main__':
+    tf.test.main()
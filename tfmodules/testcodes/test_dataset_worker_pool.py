@@ -0,0 +1,185 @@
+# Copyright 2018 Jaewook Kang (jwkang10@gmail.com)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===================================================================================
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import os
+import json
+import shutil
+import tempfile
+from os import getcwd
+from os import chdir
+
+chdir('..')
+sys.path.insert(0,getcwd())
+print ('getcwd() = %s' % getcwd())
+
+import tensorflow as tf
+import numpy as np
+
+# image processing tools
+import cv2
+
+# custom packages
+from path_manager import TF_MODULE_DIR
+from path_manager import TF_MODEL_DIR
+from path_manager import COCO_DATALOAD_DIR
+
+sys.path.insert(0,TF_MODULE_DIR)
+sys.path.insert(0,TF_MODEL_DIR)
+sys.path.insert(0,COCO_DATALOAD_DIR)
+
+import dataset_prebake
+from dataset_index import CocoAnnotationIndex
+from dataset_worker_pool import CocoWorkerPool
+from train_config import PreprocessingConfig
+
+from model_config  import DEFAULT_INPUT_RESOL
+from model_config  import DEFAULT_HG_INOUT_RESOL
+from model_config  import DEFAULT_INPUT_CHNUM
+from model_config  import NUM_OF_KEYPOINTS
+
+preproc_config  = PreprocessingConfig()
+
+IMAGE_HEIGHT    = 480
+IMAGE_WIDTH     = 640
+NUM_OF_IMAGES   = 6
+BATCH_SIZE      = 4
+NUM_OF_BATCHES  = 3
+
+# float dims as given by data_loader_coco._input_fn_multiproc()
+IMAGE_SHAPE     = [DEFAULT_INPUT_RESOL, DEFAULT_INPUT_RESOL, DEFAULT_INPUT_CHNUM]
+HEATMAP_SHAPE   = [DEFAULT_HG_INOUT_RESOL, DEFAULT_HG_INOUT_RESOL, NUM_OF_KEYPOINTS]
+
+
+class DatasetWorkerPoolTest(tf.test.TestCase):
+
+    def _make_dataset(self, data_dir):
+        '''
+            a coco-form json with random images and one person per image
+        '''
+        rng = np.random.RandomState(0)
+        os.makedirs(os.path.join(data_dir, 'images'))
+
+        images      = []
+        annotations = []
+        for n in range(0, NUM_OF_IMAGES):
+            cv2.imwrite(os.path.join(data_dir, 'images', '%d.jpg' % n),
+                        (rng.rand(IMAGE_HEIGHT, IMAGE_WIDTH, 3) * 255.0).astype(np.uint8))
+            images.append({'id': 100 + n, 'file_name': 'testset/images/%d.jpg' % n,
+                           'height': IMAGE_HEIGHT, 'width': IMAGE_WIDTH})
+
+            keypoints = []
+            for _ in range(0, 14):
+                keypoints += [int(rng.randint(100, IMAGE_WIDTH - 100)),
+                              int(rng.randint(100, IMAGE_HEIGHT - 100)), 2]
+            annotations.append({'image_id': 100 + n, 'keypoints': keypoints, 'num_keypoints': 14})
+
+        json_path = os.path.join(data_dir, 'testset_train.json')
+        with open(json_path, 'w') as json_file:
+            json.dump({'images': images, 'annotations': annotations}, json_file)
+        return json_path
+
+
+
+    def test_generator(self):
+        '''
+            This test checks below:
+            - whether the pool runs with the float dims of model_config
+            - whether the batches are of the samples of the parse function
+              with every image once per epoch
+        '''
+        data_dir    = tempfile.mkdtemp()
+        json_path   = self._make_dataset(data_dir)
+        anno_index  = CocoAnnotationIndex.load_or_build(json_path)
+
+        # the seed of a sample is its row to compare it with the reference
+        def parse_fn(row):
+            return dataset_prebake.make_record(anno_index     =anno_index,
+                                               row            =row,
+                                               data_dir       =data_dir,
+                                               preproc_config =preproc_config,
+                                               seed           =row)
+
+        records = [parse_fn(row) for row in range(0, NUM_OF_IMAGES)]
+
+        worker_pool = CocoWorkerPool(parse_fn       =parse_fn,
+                                     image_ids      =range(0, NUM_OF_IMAGES),
+                                     batch_size     =BATCH_SIZE,
+                                     images_shape   =IMAGE_SHAPE,
+                                     labels_shape   =HEATMAP_SHAPE,
+                                     images_dtype   =np.uint8,
+                                     num_workers    =2)
+        try:
+            generator   = worker_pool.generator()
+            rows        = []
+            for _ in range(0, NUM_OF_BATCHES):
+                images, labels = next(generator)
+                self.assertEqual(images.shape, tuple([BATCH_SIZE] + [int(dim) for dim in IMAGE_SHAPE]))
+                self.assertEqual(labels.shape, tuple([BATCH_SIZE] + [int(dim) for dim in HEATMAP_SHAPE]))
+                self.assertEqual(images.dtype, np.uint8)
+
+                for pos in range(0, BATCH_SIZE):
+                    matched = [row for row, (image, _) in enumerate(records)
+                               if np.array_equal(images[pos], image)]
+                    self.assertEqual(len(matched), 1)
+                    self.assertAllClose(labels[pos], records[matched[0]][1])
+                    rows.append(matched[0])
+            generator.close()
+
+            # two epochs in the batches
+            self.assertEqual(sorted(rows), sorted(list(range(0, NUM_OF_IMAGES)) * 2))
+            self.assertEqual(sorted(rows[:NUM_OF_IMAGES]), list(range(0, NUM_OF_IMAGES)))
+        finally:
+            worker_pool.close()
+            shutil.rmtree(data_dir)
+
+
+
+    def test_generator_continues(self):
+        '''
+            This test checks below:
+            - whether a generator() after another goes on with the shuffled image ids
+              instead of replaying them from the start as of every estimator.train()
+        '''
+        # the image of a sample is filled with its image id
+        def parse_fn(img_id):
+            return (np.full([2, 2, 1], img_id, dtype=np.float32),
+                    np.zeros([1], dtype=np.float32))
+
+        worker_pool = CocoWorkerPool(parse_fn       =parse_fn,
+                                     image_ids      =range(0, 64),
+                                     batch_size     =BATCH_SIZE,
+                                     images_shape   =[2, 2, 1],
+                                     labels_shape   =[1],
+                                     num_workers    =2)
+        try:
+            batch_ids = []
+            for _ in range(0, 2):
+                generator = worker_pool.generator()
+                images, _ = next(generator)
+                generator.close()
+                batch_ids.append(images[:, 0, 0, 0].tolist())
+
+            self.assertNotEqual(batch_ids[0], batch_ids[1])
+        finally:
+            worker_pool.close()
+
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,159 @@
+# Copyright 2018 Jaewook Kang (jwkang10@gmail.com)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===================================================================================
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import shutil
+import tempfile
+from os import getcwd
+from os import chdir
+
+chdir('..')
+sys.path.insert(0,getcwd())
+print ('getcwd() = %s' % getcwd())
+
+import tensorflow as tf
+import numpy as np
+
+# custom packages
+from path_manager import TF_MODULE_DIR
+from path_manager import TF_MODEL_DIR
+
+sys.path.insert(0,TF_MODULE_DIR)
+sys.path.insert(0,TF_MODEL_DIR)
+
+from train_aux_fn import get_train_devices
+from train_aux_fn import get_distribution_strategy
+from train_aux_fn import get_loss_heatmap
+from train_aux_fn import get_regularization_loss
+from train_config import TrainConfig
+from model_config import NUM_OF_KEYPOINTS
+
+NUM_OF_VIRTUAL_CPUS = 4
+NUM_OF_TRAIN_STEPS  = 3
+HEATMAP_SIZE        = 4
+REGULARIZER_SCALE   = 0.5
+
+train_config = TrainConfig()
+
+
+def _get_cpu_config(num_cpus):
+    return tf.ConfigProto(device_count={'CPU': num_cpus})
+
+
+
+def _has_gpu():
+    return len([device for device in get_train_devices() if 'GPU' in device]) > 0
+
+
+
+def _model_fn(features, labels, mode, params):
+    '''
+        a per-keypoint scale of the features scored by the heatmap loss of the trainer
+        with the l2 regularization of the weights
+    '''
+    weights = tf.get_variable('weights', shape=[NUM_OF_KEYPOINTS],
+                              initializer=tf.ones_initializer(),
+                              regularizer=tf.contrib.layers.l2_regularizer(scale=REGULARIZER_SCALE))
+    loss    = get_loss_heatmap(pred_heatmaps=features * weights,
+                               label_heatmaps=labels)
+    loss   += get_regularization_loss(num_replicas=params['num_replicas'])
+
+    optimizer   = tf.train.GradientDescentOptimizer(learning_rate=0.1)
+    train_op    = optimizer.minimize(loss, tf.train.get_global_step())
+    return tf.estimator.EstimatorSpec(mode=mode, loss=loss, train_op=train_op)
+
+
+
+def _get_input_fn(batch_size):
+    '''
+        the same global batch every step, given in batches of batch_size
+    '''
+    rng         = np.random.RandomState(0)
+    features    = rng.rand(train_config.batch_size, HEATMAP_SIZE, HEATMAP_SIZE,
+                           NUM_OF_KEYPOINTS).astype(np.float32)
+    labels      = rng.rand(train_config.batch_size, HEATMAP_SIZE, HEATMAP_SIZE,
+                           NUM_OF_KEYPOINTS).astype(np.float32)
+
+    def input_fn():
+        dataset = tf.data.Dataset.from_tensor_slices((features, labels))
+        return dataset.batch(batch_size).repeat()
+    return input_fn
+
+
+
+class DistributeTest(tf.test.TestCase):
+
+    def test_train_devices(self):
+        '''
+            This test checks below:
+            - whether the virtual CPU devices are found without GPU
+            - whether num_replicas limits the devices
+        '''
+        if _has_gpu():
+            self.skipTest('the virtual CPU devices are for the hosts without GPU')
+
+        config  = _get_cpu_config(NUM_OF_VIRTUAL_CPUS)
+        devices = get_train_devices(session_config=config)
+        self.assertEqual(devices, ['/device:CPU:%d' % n for n in range(NUM_OF_VIRTUAL_CPUS)])
+
+        self.assertEqual(len(get_train_devices(num_replicas=2, session_config=config)), 2)
+        self.assertEqual(get_train_devices(), ['/device:CPU:0'])
+        self.assertIsNone(get_distribution_strategy(get_train_devices()))
+
+        with self.assertRaises(ValueError):
+            get_train_devices(num_replicas=NUM_OF_VIRTUAL_CPUS + 1, session_config=config)
+
+
+
+    def test_mirrored_training(self):
+        '''
+            This test checks below:
+            - whether the training over the replicas with the split batch
+              gives the weights of the single device training with the whole batch
+              where the regularization loss is not multiplied by the replicas
+        '''
+        if _has_gpu():
+            self.skipTest('the virtual CPU devices are for the hosts without GPU')
+
+        trained_weights = []
+        for num_replicas in [1, 2, NUM_OF_VIRTUAL_CPUS]:
+            config  = _get_cpu_config(NUM_OF_VIRTUAL_CPUS)
+            devices = get_train_devices(num_replicas=num_replicas, session_config=config)
+
+            model_dir = tempfile.mkdtemp()
+            try:
+                run_config = tf.estimator.RunConfig(model_dir        =model_dir,
+                                                    session_config   =config,
+                                                    train_distribute =get_distribution_strategy(devices))
+                model = tf.estimator.Estimator(model_fn =_model_fn,
+                                               config   =run_config,
+                                               params   ={'num_replicas': num_replicas})
+                model.train(input_fn=_get_input_fn(train_config.batch_size // num_replicas),
+                            max_steps=NUM_OF_TRAIN_STEPS)
+                trained_weights.append(model.get_variable_value('weights'))
+            finally:
+                shutil.rmtree(model_dir)
+
+        self.assertGreater(np.abs(trained_weights[0] - 1.0).max(), 1e-3)
+        for weights in trained_weights[1:]:
+            self.assertAllClose(weights, trained_weights[0], rtol=1e-4)
+
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,156 @@
+# Copyright 2018 Jaewook Kang (jwkang10@gmail.com)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===================================================================================
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import os
+import glob
+import shutil
+import tempfile
+from os import getcwd
+from os import chdir
+
+chdir('..')
+sys.path.insert(0,getcwd())
+print ('getcwd() = %s' % getcwd())
+
+import tensorflow as tf
+import numpy as np
+
+# custom packages
+from path_manager import TF_MODULE_DIR
+
+sys.path.insert(0,TF_MODULE_DIR)
+
+from eval_runner import LiveEvaluator
+
+NUM_OF_SAMPLES  = 12
+BATCH_SIZE      = 4
+
+
+def _get_samples():
+    rng = np.random.RandomState(0)
+    return rng.rand(NUM_OF_SAMPLES, 3).astype(np.float32), \
+           rng.rand(NUM_OF_SAMPLES, 3).astype(np.float32)
+
+
+
+def _input_fn():
+    features, labels = _get_samples()
+    return tf.data.Dataset.from_tensor_slices((features, labels)).batch(BATCH_SIZE).repeat()
+
+
+
+def _finite_input_fn():
+    features, labels = _get_samples()
+    return tf.data.Dataset.from_tensor_slices((features, labels)).batch(BATCH_SIZE)
+
+
+
+def _model_fn(features, labels, mode, params):
+    '''
+        a single scale on the features
+    '''
+    del params # unused
+    weights = tf.get_variable('weights', shape=[], initializer=tf.zeros_initializer())
+    preds   = features * weights
+    loss    = tf.reduce_mean(tf.square(preds - labels))
+
+    tf.summary.scalar(name='batch_loss', tensor=loss)
+    return tf.estimator.EstimatorSpec(mode              =mode,
+                                      loss              =loss,
+                                      eval_metric_ops   ={'mean_pred': tf.metrics.mean(preds)})
+
+
+
+def _save_checkpoint(model_dir, weights_value, global_step_value):
+    with tf.Graph().as_default():
+        global_step = tf.train.get_or_create_global_step()
+        weights     = tf.get_variable('weights', shape=[], initializer=tf.zeros_initializer())
+        with tf.Session() as sess:
+            sess.run([tf.assign(weights, weights_value), tf.assign(global_step, global_step_value)])
+            return tf.train.Saver().save(sess, os.path.join(model_dir, 'model.ckpt'),
+                                         global_step=global_step_value)
+
+
+
+class EvalRunnerTest(tf.test.TestCase):
+
+    def test_live_evaluator(self):
+        '''
+            This test checks below:
+            - whether the metrics of every checkpoint are of its own variables
+              over the same samples
+            - whether the results are in the eval summaries at the global step
+        '''
+        model_dir = tempfile.mkdtemp()
+        try:
+            features, labels = _get_samples()
+            evaluator = LiveEvaluator(model_fn  =_model_fn,
+                                      input_fn  =_input_fn,
+                                      model_dir =model_dir)
+
+            for weights_value, global_step_value in [(1.0, 10), (2.0, 20), (1.0, 30)]:
+                ckpt            = _save_checkpoint(model_dir, weights_value, global_step_value)
+                eval_results    = evaluator.evaluate(checkpoint_path=ckpt, steps=2)
+
+                preds = features[:2 * BATCH_SIZE] * weights_value
+                self.assertEqual(eval_results['global_step'], global_step_value)
+                self.assertAllClose(eval_results['mean_pred'], preds.mean())
+                self.assertAllClose(eval_results['loss'],
+                                    np.mean([np.mean(np.square(preds[n:n + BATCH_SIZE] - labels[n:n + BATCH_SIZE]))
+                                             for n in [0, BATCH_SIZE]]))
+            evaluator.close()
+
+            summaries = {}
+            for event_path in glob.glob(os.path.join(model_dir, 'eval', 'events.out.tfevents.*')):
+                for event in tf.train.summary_iterator(event_path):
+                    for value in event.summary.value:
+                        summaries.setdefault(value.tag, []).append(event.step)
+
+            self.assertEqual(summaries['mean_pred'], [10, 20, 30])
+            self.assertEqual(summaries['loss'], [10, 20, 30])
+            self.assertEqual(summaries['batch_loss'], [10, 20, 30])
+        finally:
+            shutil.rmtree(model_dir)
+
+    def test_finite_input(self):
+        '''
+            This test checks below:
+            - whether the evaluation over more steps than the batches of a finite input
+              ends with the metrics of all the batches as Estimator.evaluate()
+        '''
+        model_dir = tempfile.mkdtemp()
+        try:
+            features, _ = _get_samples()
+            evaluator = LiveEvaluator(model_fn  =_model_fn,
+                                      input_fn  =_finite_input_fn,
+                                      model_dir =model_dir)
+
+            ckpt = _save_checkpoint(model_dir, weights_value=2.0, global_step_value=10)
+            for steps in [NUM_OF_SAMPLES // BATCH_SIZE + 2, None]:
+                eval_results = evaluator.evaluate(checkpoint_path=ckpt, steps=steps)
+                self.assertEqual(eval_results['global_step'], 10)
+                self.assertAllClose(eval_results['mean_pred'], (features * 2.0).mean())
+            evaluator.close()
+        finally:
+            shutil.rmtree(model_dir)
+
+
+
+if __name__ == '__main__':
+    tf.test.main()
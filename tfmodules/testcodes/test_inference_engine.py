@@ -0,0 +1,149 @@
+# Copyright 2018 Jaewook Kang (jwkang10@gmail.com)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===================================================================================
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import os
+import json
+import shutil
+import tempfile
+from os import getcwd
+from os import chdir
+
+chdir('..')
+sys.path.insert(0,getcwd())
+print ('getcwd() = %s' % getcwd())
+
+import tensorflow as tf
+import numpy as np
+
+# custom packages
+from path_manager import TF_MODULE_DIR
+from path_manager import TF_MODEL_DIR
+
+sys.path.insert(0,TF_MODULE_DIR)
+sys.path.insert(0,TF_MODEL_DIR)
+
+from inference_engine import InferenceEngine
+from inference_engine import decode_keypoints_np
+from train_aux_fn import decode_keypoints
+import inference_engine
+import train_aux_fn
+
+INPUT_SIZE      = 64
+HEATMAP_SIZE    = 16
+FRAME_HEIGHT    = 120
+FRAME_WIDTH     = 160
+
+
+def _export_model(export_dir):
+    '''
+        a frozen pb in the layout of gen_tflite_coreml.py
+        whose heatmaps are the blue channel average-pooled by 4 for all the keypoints,
+        so that a heatmap pixel is centered on its 4x4 input pixels
+    '''
+    with tf.Graph().as_default() as graph:
+        model_in = tf.placeholder(dtype=tf.float32, shape=[1, INPUT_SIZE, INPUT_SIZE, 3], name='model_in')
+        with tf.name_scope('build_network'):
+            with tf.name_scope('model'):
+                heatmaps = tf.nn.avg_pool(model_in[:, :, :, 0:1] / 255.0,
+                                          ksize=[1, 4, 4, 1], strides=[1, 4, 4, 1], padding='VALID')
+                heatmaps = tf.identity(tf.tile(heatmaps, [1, 1, 1, 4]), name='model_out')
+            tf.identity(decode_keypoints(heatmaps, refine='quadratic'), name='keypoints_out')
+
+        tf.train.write_graph(graph.as_graph_def(), export_dir, 'frozen_model.pb', as_text=False)
+
+    with open(os.path.join(export_dir, 'shape_info.json'), 'w') as f:
+        json.dump({'input_shape':           [1, INPUT_SIZE, INPUT_SIZE, 3],
+                   'output_shape':          [1, HEATMAP_SIZE, HEATMAP_SIZE, 4],
+                   'input_node_name':       'model_in',
+                   'output_node_name':      'build_network/model/model_out',
+                   'keypoints_node_name':   'build_network/keypoints_out',
+                   'keypoint_refine':       'quadratic'}, f)
+    return os.path.join(export_dir, 'frozen_model.pb')
+
+
+
+class InferenceEngineTest(tf.test.TestCase):
+
+    def test_decode_keypoints_np(self):
+        '''
+            This test checks below:
+            - whether decode_keypoints_np() gives the keypoints of decode_keypoints()
+              for all the refinements
+            - whether the soft-argmax constants of the two stay the same
+        '''
+        self.assertEqual(inference_engine.SOFT_ARGMAX_RADIUS,    train_aux_fn.SOFT_ARGMAX_RADIUS)
+        self.assertEqual(inference_engine.SOFT_ARGMAX_BETA,      train_aux_fn.SOFT_ARGMAX_BETA)
+        self.assertEqual(inference_engine.KEYPOINT_REFINE_MODES, train_aux_fn.KEYPOINT_REFINE_MODES)
+
+        rng         = np.random.RandomState(0)
+        heatmaps    = rng.rand(3, HEATMAP_SIZE, HEATMAP_SIZE, 4).astype(np.float32)
+        heatmaps[0, 0, 5, 1] = 2.0
+        heatmaps[1, 7, HEATMAP_SIZE - 1, 2] = 2.0
+
+        for refine in [None, 'quadratic', 'soft_argmax']:
+            with self.test_session() as sess:
+                keypoints = sess.run(decode_keypoints(tf.constant(heatmaps), refine=refine))
+            self.assertAllClose(decode_keypoints_np(heatmaps, refine=refine), keypoints, atol=1e-5)
+
+
+
+    def test_pb_engine(self):
+        '''
+            This test checks below:
+            - whether the batch 1 export runs batches of any size
+            - whether the keypoints are in the frame pixels by the in-graph
+              and the numpy decoding
+            - whether the benchmark gives the percentiles of every batch size
+        '''
+        export_dir = tempfile.mkdtemp()
+        try:
+            model_path  = _export_model(export_dir)
+            # a blob of the blue channel at (60 + 20n, 45 + 10n) of the n-th frame
+            grid_y, grid_x  = np.mgrid[0:FRAME_HEIGHT, 0:FRAME_WIDTH]
+            frames          = np.zeros([3, FRAME_HEIGHT, FRAME_WIDTH, 3], dtype=np.uint8)
+            for n in range(0, 3):
+                frames[n, :, :, 0] = np.round(255.0 * np.exp(-((grid_x - 60 - 20 * n) ** 2 +
+                                                               (grid_y - 45 - 10 * n) ** 2) / (2.0 * 15.0 ** 2)))
+
+            for keypoint_refine in ['quadratic', 'soft_argmax']:
+                engine      = InferenceEngine(model_path=model_path, keypoint_refine=keypoint_refine)
+                self.assertEqual('keypoints' in engine._fetches, keypoint_refine == 'quadratic')
+
+                keypoints   = engine.predict(frames)
+                self.assertEqual(keypoints.shape, (3, 4, 3))
+                for n in range(0, 3):
+                    self.assertAllClose(keypoints[n, :, 0], [60.0 + 20 * n] * 4, atol=3.0)
+                    self.assertAllClose(keypoints[n, :, 1], [45.0 + 10 * n] * 4, atol=3.0)
+                    self.assertAllGreater(keypoints[n, :, 2], 0.9)
+                self.assertAllClose(engine.predict(frames[1:2]), keypoints[1:2])
+
+                results = engine.benchmark(batch_sizes=[1, 2], num_iters=3, num_warmup=1)
+                engine.close()
+
+                self.assertEqual(sorted(results.keys()), [1, 2])
+                for result in results.values():
+                    self.assertLessEqual(result['p50'], result['p95'])
+                    self.assertLessEqual(result['p95'], result['p99'])
+        finally:
+            shutil.rmtree(export_dir)
+
+
+
+if __name__ == '__main__':
+    tf.test.main()
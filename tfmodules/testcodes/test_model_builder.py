@@ -0,0 +1,115 @@
+# Copyright 2018 Jaewook Kang (jwkang10@gmail.com)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===================================================================================
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+from os import getcwd
+from os import chdir
+
+chdir('..')
+sys.path.insert(0,getcwd())
+print ('getcwd() = %s' % getcwd())
+
+import tensorflow as tf
+import numpy as np
+
+# custom packages
+from path_manager import TF_MODULE_DIR
+from path_manager import TF_MODEL_DIR
+from path_manager import TF_CNN_MODULE_DIR
+
+sys.path.insert(0,TF_MODULE_DIR)
+sys.path.insert(0,TF_MODEL_DIR)
+sys.path.insert(0,TF_CNN_MODULE_DIR)
+
+from model_builder import get_model
+from model_builder import fp32_master_getter
+from model_config  import ModelConfig
+from model_config  import DEFAULT_INPUT_RESOL
+from model_config  import DEFAULT_HG_INOUT_RESOL
+from model_config  import NUM_OF_KEYPOINTS
+
+
+class ModelBuilderTest(tf.test.TestCase):
+
+    def test_fp32_master_getter(self):
+        '''
+            This test checks below:
+            - whether the variables asked in float16 are created in float32
+              and given as a float16 cast
+            - whether the batch norm params are given in float32
+            - whether the gradients reach the float32 variables
+        '''
+        with tf.Graph().as_default():
+            with tf.variable_scope('fp16', custom_getter=fp32_master_getter):
+                weights = tf.get_variable('weights', shape=[3, 3], dtype=tf.float16,
+                                          initializer=tf.ones_initializer())
+                beta    = tf.get_variable('beta', shape=[3], dtype=tf.float16,
+                                          initializer=tf.zeros_initializer())
+                bias    = tf.get_variable('bias', shape=[3], dtype=tf.float32,
+                                          initializer=tf.zeros_initializer())
+
+            self.assertEqual(weights.dtype, tf.float16)
+            self.assertEqual(beta.dtype.base_dtype, tf.float32)
+            self.assertEqual(bias.dtype.base_dtype, tf.float32)
+
+            variables = tf.global_variables()
+            self.assertEqual(len(variables), 3)
+            for variable in variables:
+                self.assertEqual(variable.dtype.base_dtype, tf.float32)
+
+            loss    = tf.reduce_sum(tf.cast(weights, tf.float32))
+            grads   = tf.gradients(loss, tf.trainable_variables())
+            self.assertEqual(grads[0].dtype, tf.float32)
+
+            with self.test_session() as sess:
+                sess.run(tf.global_variables_initializer())
+                self.assertAllClose(sess.run(grads[0]), np.ones([3, 3]))
+
+
+
+    def test_reduced_precision_model(self):
+        '''
+            This test checks below:
+            - whether get_model() in float16 gives float32 heatmaps
+              of the float32 model shape
+            - whether all the model variables are in float32
+        '''
+        for dtype in [tf.float32, tf.float16]:
+            with tf.Graph().as_default():
+                model_config        = ModelConfig()
+                model_config.dtype  = dtype
+
+                ch_in = tf.placeholder(dtype=tf.float32,
+                                       shape=[2, int(DEFAULT_INPUT_RESOL), int(DEFAULT_INPUT_RESOL), 3])
+                out_heatmap, mid_heatmaps, _ = get_model(ch_in          =ch_in,
+                                                         model_config   =model_config,
+                                                         scope          ='model')
+
+                self.assertEqual(out_heatmap.dtype, tf.float32)
+                self.assertEqual(out_heatmap.get_shape().as_list(),
+                                 [2, int(DEFAULT_HG_INOUT_RESOL), int(DEFAULT_HG_INOUT_RESOL), NUM_OF_KEYPOINTS])
+                for heatmaps in mid_heatmaps:
+                    self.assertEqual(heatmaps.dtype, tf.float32)
+
+                for variable in tf.global_variables():
+                    self.assertEqual(variable.dtype.base_dtype, tf.float32)
+
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -45,10 +45,12 @@ sys.path.insert(0,TF_MODULE_DIR)
 sys.path.insert(0,TF_MODEL_DIR)
 
 from model_config import DEFAULT_INPUT_CHNUM
+from model_config import DEFAULT_HG_INOUT_RESOL
 from train_config import TrainConfig
 from train_config import PreprocessingConfig
 
 import data_loader_tpu
+import preprocessor
 from preprocessor import preprocess_for_train
 from test_fn_and_util import _heatmap_generator
 from test_fn_and_util import dataset_parser
@@ -61,6 +63,48 @@ train_config   = TrainConfig()
 class PreprocessorTest(tf.test.TestCase):
 
 
+    def test_heatmaps_generator(self):
+        '''
+            This test checks below:
+            - whether the vectorized _heatmaps_generator() gives
+              the stack of _heatmap_generator() per keypoint
+        '''
+        keypoints_input     = tf.placeholder(dtype=tf.int32, shape=[4, 2])
+        orig_height_input   = tf.placeholder(dtype=tf.int32)
+        orig_width_input    = tf.placeholder(dtype=tf.int32)
+        is_flip_input       = tf.placeholder(dtype=tf.float32, shape=[1])
+        random_ang_rad_input= tf.placeholder(dtype=tf.float32, shape=[1])
+
+        heatmap_args = {'image_orig_height' : orig_height_input,
+                        'image_orig_width'  : orig_width_input,
+                        'is_flip'           : is_flip_input,
+                        'random_ang_rad'    : random_ang_rad_input,
+                        'gaussian_ksize'    : preproc_config.heatmap_std}
+
+        heatmap_stacked_op  = tf.stack([preprocessor._heatmap_generator(label_list=tf.unstack(keypoints_input[n]),
+                                                                         **heatmap_args)
+                                        for n in range(0, 4)], axis=2)
+        heatmap_op          = preprocessor._heatmaps_generator(keypoints=keypoints_input, **heatmap_args)
+
+        rng = np.random.RandomState(0)
+        with self.test_session() as sess:
+            for n in range(0, 20):
+                height, width = rng.randint(100, 1000, size=2)
+                feed_dict = {keypoints_input     : np.stack([rng.randint(-10, width + 10, size=4),
+                                                             rng.randint(-10, height + 10, size=4)], axis=1),
+                             orig_height_input   : height,
+                             orig_width_input    : width,
+                             is_flip_input       : [float(n % 2)],
+                             random_ang_rad_input: [rng.uniform(-0.1, 0.1)]}
+
+                heatmap_stacked, heatmap = sess.run([heatmap_stacked_op, heatmap_op], feed_dict=feed_dict)
+
+                self.assertEqual(heatmap.shape, (DEFAULT_HG_INOUT_RESOL, DEFAULT_HG_INOUT_RESOL, 4))
+                self.assertAllClose(heatmap_stacked, heatmap, rtol=1e-5, atol=1e-6)
+
+
+
+
     def test_preprocessor(self):
         '''
             This test checks below:
@@ -0,0 +1,110 @@
+# Copyright 2018 Jaewook Kang (jwkang10@gmail.com)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===================================================================================
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+from os import getcwd
+from os import chdir
+
+chdir('..')
+sys.path.insert(0,getcwd())
+print ('getcwd() = %s' % getcwd())
+
+import tensorflow as tf
+import numpy as np
+
+# custom packages
+from path_manager import TF_MODULE_DIR
+
+sys.path.insert(0,TF_MODULE_DIR + '/util')
+
+from run_pck_eval import get_pck_curves
+from run_pck_eval import get_latency_stats
+from run_pck_eval import get_input_keypoints
+from model_config import DEFAULT_INPUT_RESOL
+from model_config import DEFAULT_HG_INOUT_RESOL
+
+
+class RunPckEvalTest(tf.test.TestCase):
+
+    def test_pck_curves(self):
+        '''
+            This test checks below:
+            - whether PCKh and PCK are normalized by the head-neck distance
+              and the shoulder width of each sample
+            - whether the invisible joints and the samples without the normalizer
+              joints are not counted
+        '''
+        # head, neck, lshoulder, rshoulder with head-neck 10 and shoulder width 40
+        label = np.array([[50.0, 20.0, 1.0],
+                          [50.0, 30.0, 1.0],
+                          [70.0, 40.0, 1.0],
+                          [30.0, 40.0, 1.0]], dtype=np.float32)
+        labels      = np.stack([label, label, label])
+        preds       = labels[:, :, 0:2].copy()
+
+        # errors of 4 pixels on the head of the first sample
+        # and on the neck of the second one
+        preds[0, 0, 0] += 4.0
+        preds[1, 1, 1] += 4.0
+
+        # the third sample without the head is out of PCKh
+        labels[2, 0, 2] = 0.0
+
+        thresholds  = np.array([0.05, 0.2, 0.5], dtype=np.float32)
+        curves      = get_pck_curves(pred_keypoints =preds,
+                                     label_keypoints=labels,
+                                     thresholds     =thresholds)
+
+        # 4 / 10 for PCKh
+        self.assertAllClose(curves['pckh']['head'], [0.5, 0.5, 1.0])
+        self.assertAllClose(curves['pckh']['neck'], [0.5, 0.5, 1.0])
+        self.assertAllClose(curves['pckh']['lshoulder'], [1.0, 1.0, 1.0])
+        self.assertAllClose(curves['pckh']['total'], [0.75, 0.75, 1.0])
+        self.assertEqual(curves['num_of_joints_h'],
+                         {'head': 2, 'neck': 2, 'lshoulder': 2, 'rshoulder': 2})
+
+        # 4 / 40 for PCK where the invisible head is not counted
+        self.assertAllClose(curves['pck']['head'], [0.5, 1.0, 1.0])
+        self.assertAllClose(curves['pck']['neck'], [2.0 / 3.0, 1.0, 1.0])
+        self.assertAllClose(curves['pck']['total'], [9.0 / 11.0, 1.0, 1.0])
+        self.assertEqual(curves['num_of_joints'],
+                         {'head': 2, 'neck': 3, 'lshoulder': 3, 'rshoulder': 3})
+
+        stats = get_latency_stats(np.arange(1, 101))
+        self.assertAllClose([stats['mean'], stats['p50'], stats['max']], [50.5, 50.5, 100.0])
+
+    def test_input_keypoints(self):
+        '''
+            This test checks below:
+            - whether the heatmap keypoints are mapped to the input pixels
+              by the pixel-center convention of the labels without a shift
+        '''
+        scale           = DEFAULT_INPUT_RESOL / DEFAULT_HG_INOUT_RESOL
+        input_keypoints = np.array([[0.0, 0.0], [1.5, 1.5], [100.0, 37.25]], dtype=np.float32)
+
+        # the label heatmaps are rendered at (x + 0.5) / scale - 0.5
+        heatmap_keypoints = (input_keypoints + 0.5) / scale - 0.5
+        self.assertAllClose(get_input_keypoints(heatmap_keypoints), input_keypoints, atol=1e-4)
+
+        # the center of the first heatmap pixel is the center of the first scale input pixels
+        self.assertAllClose(get_input_keypoints([0.0, 0.0]), [(scale - 1.0) / 2.0] * 2)
+
+
+
+if __name__ == '__main__':
+    tf.test.main()
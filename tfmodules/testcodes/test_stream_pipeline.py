@@ -0,0 +1,277 @@
+# Copyright 2018 Jaewook Kang (jwkang10@gmail.com)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===================================================================================
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import os
+import time
+import shutil
+import tempfile
+from os import getcwd
+from os import chdir
+
+chdir('..')
+sys.path.insert(0,getcwd())
+print ('getcwd() = %s' % getcwd())
+
+import cv2
+import tensorflow as tf
+import numpy as np
+
+# custom packages
+from path_manager import TF_MODULE_DIR
+
+sys.path.insert(0,TF_MODULE_DIR)
+
+from stream_pipeline import get_posture_features
+from stream_pipeline import KeypointSmoother
+from stream_pipeline import PostureScorer
+from stream_pipeline import StreamPipeline
+from stream_pipeline import benchmark_streams
+from stream_pipeline import compare_tracking
+
+NUM_OF_FRAMES   = 20
+FRAME_HEIGHT    = 48
+FRAME_WIDTH     = 64
+
+# head, neck, lshoulder, rshoulder of an upright posture
+UPRIGHT_KEYPOINTS = np.array([[50.0, 20.0, 1.0],
+                              [50.0, 50.0, 1.0],
+                              [70.0, 60.0, 1.0],
+                              [30.0, 60.0, 1.0]], dtype=np.float32)
+
+# a textured scene panning right by a pixel per frame for the tracking
+TEXTURE_HEIGHT  = 120
+TEXTURE_WIDTH   = 160
+INDEX_BLOCK_SIZE= 12
+TEXTURE_KEYPOINTS = np.array([[80.0, 30.0, 1.0],
+                              [80.0, 60.0, 1.0],
+                              [105.0, 80.0, 1.0],
+                              [55.0, 80.0, 1.0]], dtype=np.float32)
+
+
+def _write_video(path):
+    '''
+        a video whose n-th frame is filled with n
+    '''
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 30.0, (FRAME_WIDTH, FRAME_HEIGHT))
+    for n in range(0, NUM_OF_FRAMES):
+        writer.write(np.full([FRAME_HEIGHT, FRAME_WIDTH, 3], 10 * n, dtype=np.uint8))
+    writer.release()
+
+
+
+def _write_texture_video(path, scene_cut_frame=None):
+    '''
+        a blurred noise panning right by a pixel per frame
+        with the frame index in the static top-left block.
+        The texture is replaced from scene_cut_frame
+    '''
+    def get_texture(seed):
+        texture = np.random.RandomState(seed).rand(TEXTURE_HEIGHT, TEXTURE_WIDTH + NUM_OF_FRAMES)
+        texture = cv2.GaussianBlur(texture.astype(np.float32), (0, 0), 2.0)
+        texture = (texture - texture.min()) / (texture.max() - texture.min()) * 255.0
+        return texture.astype(np.uint8)
+
+    textures    = [get_texture(seed=0), get_texture(seed=1)]
+    writer      = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 30.0, (TEXTURE_WIDTH, TEXTURE_HEIGHT))
+    for n in range(0, NUM_OF_FRAMES):
+        texture = textures[1 if scene_cut_frame is not None and n >= scene_cut_frame else 0]
+        frame   = texture[:, NUM_OF_FRAMES - n:NUM_OF_FRAMES - n + TEXTURE_WIDTH].copy()
+        frame[0:INDEX_BLOCK_SIZE, 0:INDEX_BLOCK_SIZE] = 10 * n
+        writer.write(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+    writer.release()
+
+
+
+def _get_texture_keypoints(frame_index):
+    keypoints = TEXTURE_KEYPOINTS.copy()
+    keypoints[:, 0] += frame_index
+    return keypoints
+
+
+
+class _FrameIndexEngine(object):
+    '''
+        predict() of the texture keypoints panned by the frame index in the top-left block
+    '''
+    def __init__(self):
+        self.batch_sizes = []
+
+    def predict(self, frames):
+        self.batch_sizes.append(len(frames))
+        return np.stack([_get_texture_keypoints(int(round(frame[0:INDEX_BLOCK_SIZE,
+                                                                0:INDEX_BLOCK_SIZE].mean() / 10.0)))
+                         for frame in frames])
+
+
+
+class _FrameValueEngine(object):
+    '''
+        predict() of the upright keypoints whose head score is the frame value
+    '''
+    def __init__(self, delay_sec=0.0):
+        self.delay_sec      = delay_sec
+        self.batch_sizes    = []
+
+    def predict(self, frames):
+        time.sleep(self.delay_sec)
+        self.batch_sizes.append(len(frames))
+        keypoints = np.tile(UPRIGHT_KEYPOINTS[np.newaxis], [len(frames), 1, 1])
+        keypoints[:, 0, 2] = [frame.mean() / 10.0 for frame in frames]
+        return keypoints
+
+
+
+class StreamPipelineTest(tf.test.TestCase):
+
+    def test_posture_score(self):
+        '''
+            This test checks below:
+            - whether the head height ratio and the neck angle are of the keypoints
+            - whether the turtle score is given after the calibration frames
+              by the drop of the head height from the upright posture
+        '''
+        posture = get_posture_features(UPRIGHT_KEYPOINTS)
+        self.assertAllClose([posture['head_height_ratio'], posture['neck_angle_deg']], [1.0, 0.0])
+
+        turtle_keypoints        = UPRIGHT_KEYPOINTS.copy()
+        turtle_keypoints[0, :2] = [60.0, 40.0]
+        posture = get_posture_features(turtle_keypoints)
+        self.assertAllClose([posture['head_height_ratio'], posture['neck_angle_deg']], [0.5, 45.0])
+
+        scorer = PostureScorer(calibration_frames=3, turtle_threshold=0.25)
+        for _ in range(0, 2):
+            self.assertIsNone(scorer.update(UPRIGHT_KEYPOINTS)['turtle_score'])
+        self.assertAllClose(scorer.update(UPRIGHT_KEYPOINTS)['turtle_score'], 0.0)
+
+        posture = scorer.update(turtle_keypoints)
+        self.assertAllClose(posture['turtle_score'], 0.5)
+        self.assertTrue(posture['is_turtle'])
+
+        smoother = KeypointSmoother(alpha=0.5, min_score=0.1)
+        smoother.update(UPRIGHT_KEYPOINTS)
+        turtle_keypoints[1, 2] = 0.0
+        smoothed = smoother.update(turtle_keypoints)
+        self.assertAllClose(smoothed[0, :2], [55.0, 30.0])
+        self.assertAllClose(smoothed[1], UPRIGHT_KEYPOINTS[1])
+
+
+
+    def test_offline_streams(self):
+        '''
+            This test checks below:
+            - whether all the frames of the video files are inferred in order
+              in batches across the streams without drops
+            - whether the realtime streams drop the stale frames under a slow inference
+        '''
+        video_dir = tempfile.mkdtemp()
+        try:
+            sources = [os.path.join(video_dir, 'video%d.avi' % n) for n in range(0, 2)]
+            for source in sources:
+                _write_video(source)
+
+            results     = []
+            engine      = _FrameValueEngine()
+            pipeline    = StreamPipeline(engine         =engine,
+                                         sources        =sources + sources[:1],
+                                         max_batch_size =4,
+                                         max_queue_size =2,
+                                         is_realtime    =False,
+                                         result_fn      =lambda *result: results.append(result))
+            stats       = pipeline.run()
+
+            self.assertEqual(stats['num_inferred'], 3 * NUM_OF_FRAMES)
+            self.assertEqual(stats['num_dropped'], 0)
+            self.assertGreater(max(engine.batch_sizes), 1)
+            self.assertLessEqual(max(engine.batch_sizes), 4)
+            for stream_id in range(0, 3):
+                frame_indexes = [frame_index for n, frame_index, _, _ in results if n == stream_id]
+                self.assertEqual(frame_indexes, list(range(0, NUM_OF_FRAMES)))
+
+            # the frame value through the decoding
+            head_scores = [keypoints[0, 2] for n, frame_index, keypoints, _ in results
+                           if n == 0 and frame_index == 0]
+            self.assertAllClose(head_scores, [0.0], atol=0.2)
+
+            results = benchmark_streams(engine          =_FrameValueEngine(delay_sec=0.1),
+                                        sources         =sources,
+                                        stream_counts   =[1, 2],
+                                        max_queue_size  =2,
+                                        is_realtime     =True)
+            for num_of_streams, stats in results.items():
+                self.assertEqual(stats['num_of_streams'], num_of_streams)
+                self.assertGreater(stats['num_dropped'], 0)
+                self.assertEqual(stats['num_inferred'] + stats['num_dropped'], num_of_streams * NUM_OF_FRAMES)
+                self.assertGreater(stats['fps'], 0.0)
+        finally:
+            shutil.rmtree(video_dir)
+
+
+
+    def test_keypoint_tracking(self):
+        '''
+            This test checks below:
+            - whether the network runs every detection interval of the frames
+              and the keypoints are tracked by the optical flow in between
+            - whether a scene cut fails the tracking for a detection ahead of the interval
+            - whether compare_tracking() reports the tracking against the per-frame inference
+        '''
+        video_dir = tempfile.mkdtemp()
+        try:
+            sources = [os.path.join(video_dir, 'texture.avi'),
+                       os.path.join(video_dir, 'scene_cut.avi')]
+            _write_texture_video(sources[0])
+            _write_texture_video(sources[1], scene_cut_frame=7)
+
+            results     = []
+            engine      = _FrameIndexEngine()
+            pipeline    = StreamPipeline(engine             =engine,
+                                         sources            =sources,
+                                         max_batch_size     =4,
+                                         is_realtime        =False,
+                                         smoothing_alpha    =1.0,
+                                         detection_interval =5,
+                                         result_fn          =lambda *result: results.append(result))
+            stats       = pipeline.run()
+
+            self.assertEqual(stats['num_inferred'], 2 * NUM_OF_FRAMES)
+            self.assertLessEqual(max(engine.batch_sizes), 2)
+
+            # detections at 0, 5, 10, 15 and at the scene cut of 7 instead of 10
+            self.assertEqual(stats['streams'][0]['num_detected'], NUM_OF_FRAMES // 5)
+            self.assertEqual(stats['streams'][1]['num_detected'], NUM_OF_FRAMES // 5 + 1)
+
+            for stream_id, frame_index, keypoints, _ in results:
+                self.assertAllClose(keypoints, _get_texture_keypoints(frame_index), atol=1.0)
+
+            reports = compare_tracking(engine               =_FrameIndexEngine(),
+                                       sources              =sources[:1],
+                                       detection_intervals  =[5],
+                                       smoothing_alpha      =1.0)
+            self.assertEqual(reports[1]['num_detected'], NUM_OF_FRAMES)
+            self.assertAllClose(reports[5]['detection_ratio'], 0.2)
+            self.assertLess(reports[5]['keypoint_err_px'], 1.0)
+            self.assertLess(reports[5]['keypoint_err_ratio'], 0.02)
+            self.assertGreater(reports[5]['speedup'], 0.0)
+        finally:
+            shutil.rmtree(video_dir)
+
+
+
+if __name__ == '__main__':
+    tf.test.main()
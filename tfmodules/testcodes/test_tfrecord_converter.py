@@ -0,0 +1,218 @@
+# Copyright 2018 Jaewook Kang (jwkang10@gmail.com)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===================================================================================
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import os
+import json
+import shutil
+import tempfile
+from os import getcwd
+from os import chdir
+
+chdir('..')
+sys.path.insert(0,getcwd())
+print ('getcwd() = %s' % getcwd())
+
+import tensorflow as tf
+import numpy as np
+
+# image processing tools
+import cv2
+
+# custom packages
+from path_manager import TF_MODULE_DIR
+from path_manager import TPU_DATALOAD_DIR
+
+sys.path.insert(0,TF_MODULE_DIR)
+sys.path.insert(0,TPU_DATALOAD_DIR)
+
+import tfrecord_converter
+from utils import get_jpeg_shape
+from utils import get_image_stats
+from utils import RunningStats
+from train_config import PreprocessingConfig
+
+NUM_OF_IMAGES   = 23
+NUM_OF_SHARDS   = 4
+
+
+class TfrecordConverterTest(tf.test.TestCase):
+
+    def _make_dataset(self, data_dir):
+        '''
+            random jpegs of various sizes with the label jsons
+        '''
+        rng = np.random.RandomState(0)
+        os.makedirs(os.path.join(data_dir, 'images'))
+        os.makedirs(os.path.join(data_dir, 'labels'))
+
+        image_list = []
+        label_list = []
+        for n in range(0, NUM_OF_IMAGES):
+            height, width = int(rng.randint(50, 400)), int(rng.randint(50, 400))
+            image_path = os.path.join(data_dir, 'images', 'im%04d.jpg' % n)
+            label_path = os.path.join(data_dir, 'labels', 'im%04d.json' % n)
+
+            cv2.imwrite(image_path, (rng.rand(height, width, 3) * 255.0).astype(np.uint8))
+            with open(label_path, 'w') as label_file:
+                json.dump(dict((part, [float(rng.randint(0, width)), float(rng.randint(0, height)), 1.0])
+                               for part in ['head', 'neck', 'Rshoulder', 'Lshoulder']), label_file)
+
+            image_list.append(image_path)
+            label_list.append(label_path)
+
+        return image_list, label_list
+
+
+
+    def test_jpeg_shape(self):
+        '''
+            This test checks below:
+            - whether get_jpeg_shape() gives the decoded shape
+              for baseline, progressive and grayscale jpegs
+        '''
+        rng = np.random.RandomState(0)
+        for is_progressive in [False, True]:
+            for channel in [1, 3]:
+                height, width = int(rng.randint(1, 2000)), int(rng.randint(1, 2000))
+                image = (rng.rand(height, width, channel) * 255.0).astype(np.uint8)
+
+                _, image_jpeg = cv2.imencode('.jpg', image,
+                                             [int(cv2.IMWRITE_JPEG_PROGRESSIVE), int(is_progressive)])
+
+                self.assertEqual(get_jpeg_shape(image_jpeg.tobytes()), (height, width, channel))
+
+        with self.assertRaises(ValueError):
+            get_jpeg_shape(b'\x89PNG\r\n\x1a\n')
+
+
+
+    def test_running_stats(self):
+        '''
+            This test checks below:
+            - whether the chunked stats give np.mean() / np.std() per channel and in total
+            - whether merged stats of image parts give the stats of the whole
+            - whether dataset_stats.json is loaded by PreprocessingConfig
+        '''
+        rng     = np.random.RandomState(0)
+        image   = (rng.rand(123, 77, 3) * 255.0).astype(np.uint8)
+
+        for chunk_pixels in [1, 1000, 65536]:
+            image_stats = get_image_stats(image, chunk_pixels=chunk_pixels)
+            total_stats = image_stats.get_total()
+
+            self.assertAllClose(image_stats.mean, image.reshape(-1, 3).mean(axis=0))
+            self.assertAllClose(image_stats.get_std(), image.reshape(-1, 3).std(axis=0))
+            self.assertAllClose(total_stats.mean[0], image.mean())
+            self.assertAllClose(total_stats.get_std()[0], image.std())
+
+        merged_stats = RunningStats(num_channels=3)
+        for part in [image[:10], image[10:11], image[11:]]:
+            merged_stats.merge_stats(RunningStats.from_dict(get_image_stats(part).to_dict()))
+        self.assertAllClose(merged_stats.get_std(), image.reshape(-1, 3).std(axis=0))
+
+        out_dir = tempfile.mkdtemp()
+        try:
+            stats_path      = tfrecord_converter.write_dataset_stats(merged_stats, 1, out_dir)
+            preproc_config  = PreprocessingConfig()
+            preproc_config.load_dataset_stats(stats_path)
+
+            self.assertAllClose(preproc_config.MEAN_RGB, image.reshape(-1, 3).mean(axis=0) / 255.0)
+            self.assertAllClose(preproc_config.STDDEV_RGB, image.reshape(-1, 3).std(axis=0) / 255.0)
+        finally:
+            shutil.rmtree(out_dir)
+
+
+
+    def test_balanced_shards(self):
+        '''
+            This test checks below:
+            - whether every image is in a single shard with its label
+            - whether the shard bytes differ by one image at most
+        '''
+        data_dir = tempfile.mkdtemp()
+        try:
+            image_list, label_list  = self._make_dataset(data_dir)
+            shards                  = tfrecord_converter.get_balanced_shards(image_list, label_list,
+                                                                             NUM_OF_SHARDS)
+
+            pairs = [pair for shard in shards for pair in shard]
+            self.assertEqual(sorted(pairs), sorted(zip(image_list, label_list)))
+
+            shard_bytes = [sum([os.path.getsize(image_path) for image_path, _ in shard]) for shard in shards]
+            max_image_bytes = max([os.path.getsize(image_path) for image_path in image_list])
+            self.assertLessEqual(max(shard_bytes) - min(shard_bytes), max_image_bytes)
+        finally:
+            shutil.rmtree(data_dir)
+
+
+
+    def test_sharded_conversion(self):
+        '''
+            This test checks below:
+            - whether the shards hold every image once
+            - whether a rerun keeps the complete shards and writes a missing one
+        '''
+        data_dir    = tempfile.mkdtemp()
+        out_dir     = os.path.join(data_dir, 'tfrecords')
+        try:
+            image_list, label_list = self._make_dataset(data_dir)
+            tfrecord_converter.to_tfrecords_sharded(image_list, label_list, out_dir, 'train',
+                                                    NUM_OF_SHARDS, num_workers=2)
+
+            shard_paths = sorted(os.path.join(out_dir, name) for name in os.listdir(out_dir)
+                                 if not name.endswith(tfrecord_converter.SHARD_STATS_SUFFIX))
+            self.assertEqual([os.path.basename(path) for path in shard_paths],
+                             ['train-%05d-of-%05d' % (n, NUM_OF_SHARDS) for n in range(NUM_OF_SHARDS)])
+
+            # interrupted run; a shard missing
+            os.remove(shard_paths[1])
+            mtime_kept = os.path.getmtime(shard_paths[0])
+            dataset_stats = tfrecord_converter.to_tfrecords_sharded(image_list, label_list, out_dir, 'train',
+                                                                    NUM_OF_SHARDS, num_workers=2)
+            self.assertEqual(os.path.getmtime(shard_paths[0]), mtime_kept)
+
+            # the stats of the kept shards come from their sidecars
+            pixels = np.concatenate([cv2.imread(path)[:, :, ::-1].reshape(-1, 3) for path in image_list])
+            self.assertEqual(dataset_stats.count, pixels.shape[0])
+            self.assertAllClose(dataset_stats.mean, pixels.mean(axis=0))
+            self.assertAllClose(dataset_stats.get_std(), pixels.std(axis=0))
+
+            filenames = []
+            for shard_path in shard_paths:
+                for record in tf.python_io.tf_record_iterator(shard_path):
+                    example = tf.train.Example.FromString(record)
+                    feature = example.features.feature
+                    image   = cv2.imread(os.path.join(data_dir, 'images',
+                                                      feature['filename'].bytes_list.value[0].decode('utf-8')))
+
+                    self.assertEqual(feature['height'].int64_list.value[0], image.shape[0])
+                    self.assertEqual(feature['width'].int64_list.value[0], image.shape[1])
+                    self.assertAllClose(feature['mean'].float_list.value[0], image.mean(), rtol=1e-5)
+                    self.assertAllClose(feature['std'].float_list.value[0], image.std(), rtol=1e-5)
+                    filenames.append(feature['filename'].bytes_list.value[0])
+
+            self.assertEqual(sorted(filenames),
+                             sorted(os.path.basename(path).encode('utf-8') for path in image_list))
+        finally:
+            shutil.rmtree(data_dir)
+
+
+
+if __name__ == '__main__':
+    tf.test.main()
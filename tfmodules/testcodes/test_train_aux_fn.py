@@ -0,0 +1,239 @@
+# Copyright 2018 Jaewook Kang (jwkang10@gmail.com)
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===================================================================================
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import os
+import json
+import shutil
+import tempfile
+from os import getcwd
+from os import chdir
+
+chdir('..')
+sys.path.insert(0,getcwd())
+print ('getcwd() = %s' % getcwd())
+
+import tensorflow as tf
+import numpy as np
+
+# custom packages
+from path_manager import TF_MODULE_DIR
+from path_manager import TF_MODEL_DIR
+
+sys.path.insert(0,TF_MODULE_DIR)
+sys.path.insert(0,TF_MODEL_DIR)
+
+from train_aux_fn import get_colormap_lut
+from train_aux_fn import get_heatmap_overlay
+from train_aux_fn import decode_keypoints
+from train_aux_fn import argmax_2d
+from train_aux_fn import normalize_image
+from train_aux_fn import save_input_norm
+from train_aux_fn import load_input_norm
+from train_aux_fn import get_eval_process_argv
+from train_config import PreprocessingConfig
+
+HEATMAP_SIZE    = 64
+HEATMAP_SIGMA   = 1.5
+
+
+def _get_gaussian_heatmaps(keypoints):
+    '''
+        BxHxWxK gaussian heatmaps peaked at the BxKx2 (x, y) keypoints
+    '''
+    grid_y, grid_x  = np.mgrid[0:HEATMAP_SIZE, 0:HEATMAP_SIZE].astype(np.float32)
+    dist_x          = grid_x[np.newaxis, :, :, np.newaxis] - keypoints[:, np.newaxis, np.newaxis, :, 0]
+    dist_y          = grid_y[np.newaxis, :, :, np.newaxis] - keypoints[:, np.newaxis, np.newaxis, :, 1]
+    return np.exp(-(dist_x ** 2 + dist_y ** 2) / (2.0 * HEATMAP_SIGMA ** 2)).astype(np.float32)
+
+
+
+class TrainAuxFnTest(tf.test.TestCase):
+
+    def test_heatmap_overlay(self):
+        '''
+            This test checks below:
+            - whether the jet colormap goes from dark blue through green to dark red
+            - whether the overlay blends the colored heatmap over the RGB of the BGR images
+              scaled per sample
+        '''
+        lut = get_colormap_lut()
+        self.assertAllClose(lut[0], [0.0, 0.0, 0.5])
+        self.assertAllClose(lut[len(lut) // 2], [0.5, 1.0, 0.5], atol=0.01)
+        self.assertAllClose(lut[-1], [0.5, 0.0, 0.0])
+
+        rng         = np.random.RandomState(0)
+        images      = rng.rand(3, HEATMAP_SIZE, HEATMAP_SIZE, 3).astype(np.float32) * 100.0 + 50.0
+        heatmap     = rng.rand(3, HEATMAP_SIZE, HEATMAP_SIZE).astype(np.float32) * 0.5
+        heatmap[:, 10, 20] = 3.0
+        heatmap[:, 30, 40] = -1.0
+
+        with self.test_session() as sess:
+            overlay = sess.run(get_heatmap_overlay(heatmap=tf.constant(heatmap),
+                                                   images =tf.constant(images),
+                                                   alpha  =0.5))
+
+        self.assertEqual(overlay.shape, images.shape)
+        self.assertEqual(overlay.dtype, np.uint8)
+
+        for n in range(0, 3):
+            image_rgb = (images[n, :, :, ::-1] - images[n].min()) / (images[n].max() - images[n].min())
+            self.assertAllClose(overlay[n, 10, 20], np.round((0.5 * image_rgb[10, 20] + 0.5 * lut[-1]) * 255.0),
+                                atol=1.0)
+            self.assertAllClose(overlay[n, 30, 40], np.round((0.5 * image_rgb[30, 40] + 0.5 * lut[0]) * 255.0),
+                                atol=1.0)
+
+
+
+    def test_normalize_image(self):
+        '''
+            This test checks below:
+            - whether the uint8 and the float images of the same pixels
+              give the same model input
+            - whether the input is normalized per channel in the BGR order
+            - whether the dataset stats loaded by load_dataset_stats() change the normalization
+        '''
+        preproc_config  = PreprocessingConfig()
+        images          = np.random.RandomState(0).randint(0, 256, size=(2, 8, 8, 3)).astype(np.uint8)
+
+        with self.test_session() as sess:
+            normalized_uint8, normalized_float = sess.run(
+                [normalize_image(tf.constant(images), preproc_config.MEAN_RGB, preproc_config.STDDEV_RGB),
+                 normalize_image(tf.constant(images.astype(np.float32)),
+                                 preproc_config.MEAN_RGB, preproc_config.STDDEV_RGB)])
+
+        self.assertEqual(normalized_uint8.dtype, np.float32)
+        self.assertAllEqual(normalized_uint8, normalized_float)
+
+        for channel, rgb_channel in enumerate([2, 1, 0]):
+            self.assertAllClose(normalized_uint8[:, :, :, channel],
+                                (images[:, :, :, channel] / 255.0 - preproc_config.MEAN_RGB[rgb_channel])
+                                / preproc_config.STDDEV_RGB[rgb_channel], atol=1e-5)
+
+        # the dataset stats of tfrecord_converter.py replace the imagenet values
+        stats_fd, stats_path = tempfile.mkstemp(suffix='.json')
+        try:
+            with os.fdopen(stats_fd, 'w') as stats_file:
+                json.dump({'mean_rgb': [0.5, 0.4, 0.3], 'stddev_rgb': [0.1, 0.2, 0.25]}, stats_file)
+            preproc_config.load_dataset_stats(stats_path)
+        finally:
+            os.remove(stats_path)
+
+        with self.test_session() as sess:
+            normalized_stats = sess.run(normalize_image(tf.constant(images),
+                                                        preproc_config.MEAN_RGB, preproc_config.STDDEV_RGB))
+
+        self.assertAllClose(normalized_stats,
+                            (images / 255.0 - [0.3, 0.4, 0.5]) / [0.25, 0.2, 0.1], atol=1e-5)
+        self.assertGreater(np.abs(normalized_stats - normalized_uint8).min(), 0.0)
+
+
+
+    def test_input_norm(self):
+        '''
+            This test checks below:
+            - whether a run without the input normalization has none to load
+            - whether the stats saved by save_input_norm() are loaded back for the export
+        '''
+        model_dir = tempfile.mkdtemp()
+        try:
+            self.assertIsNone(load_input_norm(model_dir))
+
+            save_input_norm(model_dir, mean_rgb=[0.5, 0.4, 0.3], stddev_rgb=[0.1, 0.2, 0.25])
+            mean_rgb, stddev_rgb = load_input_norm(model_dir)
+        finally:
+            shutil.rmtree(model_dir)
+
+        self.assertAllClose(mean_rgb,   [0.5, 0.4, 0.3])
+        self.assertAllClose(stddev_rgb, [0.1, 0.2, 0.25])
+
+
+
+    def test_decode_keypoints(self):
+        '''
+            This test checks below:
+            - whether the decoding without refinement gives the integer argmax
+              of every channel as argmax_2d() over a dynamic batch
+            - whether the refinements locate the sub-pixel peaks
+              closer than the integer argmax
+        '''
+        rng         = np.random.RandomState(0)
+        keypoints   = rng.uniform(low=5.0, high=HEATMAP_SIZE - 5.0, size=(3, 4, 2)).astype(np.float32)
+        heatmaps    = _get_gaussian_heatmaps(keypoints)
+
+        heatmaps_ph = tf.placeholder(dtype=tf.float32, shape=[None, HEATMAP_SIZE, HEATMAP_SIZE, 4])
+        decode_ops  = dict((refine, decode_keypoints(heatmaps_ph, refine=refine))
+                           for refine in [None, 'quadratic', 'soft_argmax'])
+        argmax_op   = argmax_2d(heatmaps_ph[:, :, :, 1:2])
+
+        with self.test_session() as sess:
+            decoded, argmax = sess.run([decode_ops, argmax_op], feed_dict={heatmaps_ph: heatmaps})
+            decoded_one     = sess.run(decode_ops[None], feed_dict={heatmaps_ph: heatmaps[:1]})
+
+        self.assertEqual(decoded[None].shape, (3, 4, 2))
+        self.assertAllEqual(decoded[None], np.round(keypoints))
+        self.assertAllEqual(decoded_one, decoded[None][:1])
+        self.assertAllEqual(argmax, decoded[None][:, 1, :])
+
+        argmax_err = np.abs(decoded[None] - keypoints).max()
+        for refine in ['quadratic', 'soft_argmax']:
+            refine_err = np.abs(decoded[refine] - keypoints).max()
+            tf.logging.info('[test_decode_keypoints] %s max err = %s (argmax %s)'
+                            % (refine, refine_err, argmax_err))
+            self.assertLess(refine_err, 0.5 * argmax_err)
+
+        with self.assertRaises(ValueError):
+            decode_keypoints(heatmaps_ph, refine='bicubic')
+
+    def test_eval_process_argv(self):
+        '''
+            This test checks below:
+            - whether the background eval process takes the flags of the trainer
+              with its own --mode and --model_dir in either form of the flags
+            - whether the device flags of the training are replaced
+              for the single device of the eval process
+        '''
+        eval_flags  = ['--mode=eval',
+                       '--model_dir=/model/run-1/',
+                       '--num_replicas=1',
+                       '--num_virtual_cpus=0',
+                       '--prefetch_device=']
+
+        eval_argv   = get_eval_process_argv(argv=['--mode=train_and_eval_async',
+                                                  '--data_dir=/data',
+                                                  '--model_dir', '/model',
+                                                  '--train_steps', '100',
+                                                  '-mode', 'train_and_eval_async',
+                                                  '--num_replicas=4',
+                                                  '--num_virtual_cpus', '4',
+                                                  '--prefetch_device=/gpu:0',
+                                                  '--is_live_eval=False'],
+                                            model_dir='/model/run-1/')
+
+        self.assertEqual(eval_argv, ['--data_dir=/data',
+                                     '--train_steps', '100',
+                                     '--is_live_eval=False'] + eval_flags)
+
+        # a flag whose name starts with model_dir is kept
+        self.assertEqual(get_eval_process_argv(argv=['--model_dir_local=/tmp'], model_dir='/model/run-1/'),
+                         ['--model_dir_local=/tmp'] + eval_flags)
+
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -238,6 +238,101 @@ def make_gaussian_heatmap(size_h, size_w, x0,y0,fwhm=3):
 
 
 
+def _heatmaps_generator(keypoints,
+                        image_orig_height,
+                        image_orig_width,
+                        is_flip,
+                        random_ang_rad,
+                        use_bfloat16=False,
+                        gaussian_ksize=3):
+    """Vectorized _heatmap_generator() over the keypoints.
+    Args:
+    keypoints: `Tensor` of (num_keypoints, 2) (x, y) in the original image coordinate
+    Returns:
+    (DEFAULT_HG_INOUT_RESOL, DEFAULT_HG_INOUT_RESOL, num_keypoints) heatmap `Tensor`
+    rendered by a single broadcast exp, the same as stacking
+    _heatmap_generator() of each keypoint along axis=2.
+    """
+    with tf.name_scope(name='heatmaps_generator',values=[keypoints,
+                                                        image_orig_height,
+                                                        image_orig_width,
+                                                        is_flip,
+                                                        random_ang_rad]):
+        keypoints = tf.cast(keypoints, dtype=tf.float32)
+        x0 = keypoints[:, 0]
+        y0 = keypoints[:, 1]
+
+        # reflection of aspect ratio by resizing to DEFAULT_INPUT_RESOL =============
+        aspect_ratio_height = DEFAULT_INPUT_RESOL / tf.cast(image_orig_height,dtype=tf.float32)
+        aspect_ratio_width  = DEFAULT_INPUT_RESOL / tf.cast(image_orig_width, dtype=tf.float32)
+
+        resized_x0 = x0 * aspect_ratio_width
+        resized_y0 = y0 * aspect_ratio_height
+
+        fliped_x0   = (1.0 - is_flip) * resized_x0 + is_flip * (DEFAULT_INPUT_RESOL - resized_x0)
+        fliped_y0   = resized_y0
+
+        # reflection of rotation =============
+        rotated_x0 = (fliped_x0 - DEFAULT_INPUT_RESOL/2.0) * tf.cos(random_ang_rad) \
+                     - (fliped_y0 - DEFAULT_INPUT_RESOL/2.0) * tf.sin(random_ang_rad) \
+                     + DEFAULT_INPUT_RESOL/2.0
+        rotated_y0 = (fliped_x0 - DEFAULT_INPUT_RESOL/2.0) * tf.sin(random_ang_rad) \
+                     + (fliped_y0 - DEFAULT_INPUT_RESOL/2.0) * tf.cos(random_ang_rad) \
+                     + DEFAULT_INPUT_RESOL / 2.0
+
+        # resizing by model to  DEFAULT_HG_INOUT_RESOL
+        aspect_ratio_by_model = DEFAULT_HG_INOUT_RESOL / DEFAULT_INPUT_RESOL
+
+        heatmap_x0 = rotated_x0 * aspect_ratio_by_model
+        heatmap_y0 = rotated_y0 * aspect_ratio_by_model
+
+        # max min bound regularization =============
+        heatmap_x0 = tf.minimum(x=heatmap_x0,y=DEFAULT_HG_INOUT_RESOL)
+        heatmap_y0 = tf.minimum(x=heatmap_y0,y=DEFAULT_HG_INOUT_RESOL)
+
+        heatmap_x0 = tf.maximum(x=heatmap_x0,y=0.0)
+        heatmap_y0 = tf.maximum(x=heatmap_y0,y=0.0)
+
+        # heatmap generation
+        label_heatmap = make_gaussian_heatmaps(size_h=DEFAULT_HG_INOUT_RESOL,
+                                               size_w=DEFAULT_HG_INOUT_RESOL,
+                                               fwhm  =gaussian_ksize,
+                                               x0    =heatmap_x0,
+                                               y0    =heatmap_y0)
+
+        label_heatmap = tf.image.convert_image_dtype(image=label_heatmap,
+                                                     dtype=tf.bfloat16 if use_bfloat16 else tf.float32)
+
+        # normalization per keypoint
+        label_heatmap = label_heatmap / (tf.reduce_mean(label_heatmap, axis=[0, 1], keepdims=True)
+                                         * DEFAULT_HG_INOUT_RESOL*DEFAULT_HG_INOUT_RESOL)
+
+    return label_heatmap
+
+
+
+
+def make_gaussian_heatmaps(size_h, size_w, x0, y0, fwhm=3):
+    """ Make square gaussian kernels of the keypoints along the last axis.
+    x0, y0 are (num_keypoints,) tensors; the grid and the centers
+    are broadcast against each other into a single exp.
+    """
+    if size_h > size_w:
+        size = size_h
+    else:
+        size = size_w
+
+    x = np.arange(0, size, 1, dtype=np.float32)[np.newaxis, :, np.newaxis]
+    y = np.arange(0, size, 1, dtype=np.float32)[:, np.newaxis, np.newaxis]
+
+    heatmap = tf.exp(-4. * tf.log(2.) * ((x - x0) ** 2. + (y - y0) ** 2.) \
+                     / fwhm ** 2.)
+
+    return heatmap
+
+
+
+
 
 
 
@@ -275,45 +370,17 @@ def preprocess_image(image_bytes,
 
 
         # label heatmap generation
-        label_heatmap_head = _heatmap_generator(label_list      =label_list[0],
-                                                image_orig_height=image_orig_height,
-                                                image_orig_width =image_orig_width,
-                                                is_flip          = is_flip,
-                                                random_ang_rad   = random_ang_rad,
-                                                use_bfloat16     =use_bfloat16,
-                                                gaussian_ksize=preproc_config.heatmap_std)
-
-        label_heatmap_neck = _heatmap_generator(label_list      =label_list[1],
-                                                image_orig_height=image_orig_height,
-                                                image_orig_width =image_orig_width,
-                                                is_flip          = is_flip,
-                                                random_ang_rad   = random_ang_rad,
-                                                use_bfloat16     =use_bfloat16,
-                                                gaussian_ksize=preproc_config.heatmap_std)
-
-        label_heatmap_Lshoulder = _heatmap_generator(label_list =label_list[2],
-                                                    image_orig_height=image_orig_height,
-                                                    image_orig_width =image_orig_width,
-                                                    is_flip          = is_flip,
-                                                    random_ang_rad   = random_ang_rad,
-                                                    use_bfloat16     =use_bfloat16,
-                                                    gaussian_ksize=preproc_config.heatmap_std)
-
-        label_heatmap_Rshoulder = _heatmap_generator(label_list =label_list[3],
-                                                    image_orig_height=image_orig_height,
-                                                    image_orig_width =image_orig_width,
-                                                    is_flip          = is_flip,
-                                                    random_ang_rad   = random_ang_rad,
-                                                    use_bfloat16     =use_bfloat16,
-                                                    gaussian_ksize=preproc_config.heatmap_std)
-
-
-
-
-        label_heatmap           = tf.stack([label_heatmap_head,
-                                            label_heatmap_neck,
-                                            label_heatmap_Rshoulder,
-                                            label_heatmap_Lshoulder],axis=2)
+        # label_list is in (head, neck, Lshoulder, Rshoulder) order
+        # while the heatmap channels are in (head, neck, Rshoulder, Lshoulder) order
+        keypoints = tf.stack([tf.stack(label_list[keypoint_idx][0:2]) for keypoint_idx in [0, 1, 3, 2]])
+
+        label_heatmap = _heatmaps_generator(keypoints        =keypoints,
+                                            image_orig_height=image_orig_height,
+                                            image_orig_width =image_orig_width,
+                                            is_flip          =is_flip,
+                                            random_ang_rad   =random_ang_rad,
+                                            use_bfloat16     =use_bfloat16,
+                                            gaussian_ksize   =preproc_config.heatmap_std)
 
         tf.logging.info('[preprocessor] preprocessing pipeline building complete')
     return image, label_heatmap
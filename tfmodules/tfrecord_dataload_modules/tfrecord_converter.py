@@ -13,6 +13,8 @@
 # ===================================================================================
 # -*- coding: utf-8 -*-
 import os
+import heapq
+import multiprocessing
 from glob import glob
 from datetime import datetime
 import argparse
@@ -23,6 +25,13 @@ from PIL import Image
 import tensorflow as tf
 
 from utils import progress_bar
+from utils import get_jpeg_shape
+from utils import get_image_stats
+from utils import RunningStats
+
+
+DATASET_STATS_FILENAME = 'dataset_stats.json'
+SHARD_STATS_SUFFIX     = '.stats.json'
 
 def _int64_feature(value):
     """Wrapper for inserting int64 features into Example proto."""
@@ -46,8 +55,80 @@ def _float_feature(value):
 
 
 
+def _make_example(image_jpeg, label, filename, shape, mean, std):
+    """Builds the Example proto of an image and its label."""
+    if not isinstance(filename, bytes):
+        filename = filename.encode('utf-8')
+
+    return tf.train.Example(
+            features=tf.train.Features(
+                feature=
+                {
+                    'height'    : _int64_feature(shape[0]),
+                    'width'     : _int64_feature(shape[1]),
+                    'channel'   : _int64_feature(shape[2]),
+                    'image'     : _bytes_feature(image_jpeg),
+                    # 'image': _bytes_feature(image.tostring()),
+                    'label_head_x'          : _int64_feature(np.round(label['head'][0]).astype(np.int64)),
+                    'label_head_y'          : _int64_feature(np.round(label['head'][1]).astype(np.int64)),
+                    'label_head_occ'        : _int64_feature(np.round(label['head'][2]).astype(np.int64)),
+                    'label_neck_x'          : _int64_feature(np.round(label['neck'][0]).astype(np.int64)),
+                    'label_neck_y'          : _int64_feature(np.round(label['neck'][1]).astype(np.int64)),
+                    'label_neck_occ'        : _int64_feature(np.round(label['neck'][2]).astype(np.int64)),
+                    'label_Rshoulder_x'     : _int64_feature(np.round(label['Rshoulder'][0]).astype(np.int64)),
+                    'label_Rshoulder_y'     : _int64_feature(np.round(label['Rshoulder'][1]).astype(np.int64)),
+                    'label_Rshoulder_occ'   : _int64_feature(np.round(label['Rshoulder'][2]).astype(np.int64)),
+                    'label_Lshoulder_x'     : _int64_feature(np.round(label['Lshoulder'][0]).astype(np.int64)),
+                    'label_Lshoulder_y'     : _int64_feature(np.round(label['Lshoulder'][1]).astype(np.int64)),
+                    'label_Lshoulder_occ'   : _int64_feature(np.round(label['Lshoulder'][2]).astype(np.int64)),
+                    'mean'              : _float_feature(np.float32(mean)),
+                    'std'               : _float_feature(np.float32(std)),
+                    'filename'          : _bytes_feature(filename),
+                }
+            )
+        )
+
+
+
+
+def _merge_as_rgb(dataset_stats, image_stats):
+    """Folds per-channel image stats into the 3-channel dataset stats.
+        A grayscale image counts for all the three channels.
+    """
+    if image_stats.mean.shape[0] == 1:
+        dataset_stats.merge(image_stats.count,
+                            np.repeat(image_stats.mean, 3),
+                            np.repeat(image_stats.m2, 3))
+    else:
+        dataset_stats.merge(image_stats.count, image_stats.mean[:3], image_stats.m2[:3])
+
+
+
+
+def write_dataset_stats(dataset_stats, num_images, out_dir):
+    """Writes the dataset-level per-channel mean and std
+        in the [0, 1] scale of PreprocessingConfig.MEAN_RGB / STDDEV_RGB
+        to <out_dir>/dataset_stats.json (see PreprocessingConfig.load_dataset_stats()).
+    """
+    stats_path = os.path.join(out_dir, DATASET_STATS_FILENAME)
+    with open(stats_path, 'w') as stats_file:
+        json.dump({'num_images'     : num_images,
+                   'num_pixels'     : dataset_stats.count,
+                   'mean_rgb'       : (dataset_stats.mean / 255.0).tolist(),
+                   'stddev_rgb'     : (dataset_stats.get_std() / 255.0).tolist(),
+                   'running_stats'  : dataset_stats.to_dict()}, stats_file, indent=2)
+
+    print("Dataset stats written to", stats_path)
+    return stats_path
+
+
+
+
 def to_tfrecords(image_list, label_list, reader, tfrecords_name):
-    """Converts a dataset to tfrecords."""
+    """Converts a dataset to tfrecords.
+        :return: RunningStats of the rgb channels over the dataset
+    """
+    dataset_stats = RunningStats(num_channels=3)
 
     print("Start converting", tfrecords_name)
     # options = tf.python_io.TFRecordOptions(tf.python_io.TFRecordCompressionType.GZIP)
@@ -71,41 +152,143 @@ def to_tfrecords(image_list, label_list, reader, tfrecords_name):
                    where values of annotation are casted from float32 to int32
 
                '''
-        string_set = tf.train.Example(
-                features=tf.train.Features(
-                    feature=
-                    {
-                        'height'    : _int64_feature(image.shape[0]),
-                        'width'     : _int64_feature(image.shape[1]),
-                        'channel'   : _int64_feature(image.shape[2]),
-                        'image'     : _bytes_feature(image_jpeg),
-                        # 'image': _bytes_feature(image.tostring()),
-                        'label_head_x'          : _int64_feature(np.round(label['head'][0]).astype(np.int64)),
-                        'label_head_y'          : _int64_feature(np.round(label['head'][1]).astype(np.int64)),
-                        'label_head_occ'        : _int64_feature(np.round(label['head'][2]).astype(np.int64)),
-                        'label_neck_x'          : _int64_feature(np.round(label['neck'][0]).astype(np.int64)),
-                        'label_neck_y'          : _int64_feature(np.round(label['neck'][1]).astype(np.int64)),
-                        'label_neck_occ'        : _int64_feature(np.round(label['neck'][2]).astype(np.int64)),
-                        'label_Rshoulder_x'     : _int64_feature(np.round(label['Rshoulder'][0]).astype(np.int64)),
-                        'label_Rshoulder_y'     : _int64_feature(np.round(label['Rshoulder'][1]).astype(np.int64)),
-                        'label_Rshoulder_occ'   : _int64_feature(np.round(label['Rshoulder'][2]).astype(np.int64)),
-                        'label_Lshoulder_x'     : _int64_feature(np.round(label['Lshoulder'][0]).astype(np.int64)),
-                        'label_Lshoulder_y'     : _int64_feature(np.round(label['Lshoulder'][1]).astype(np.int64)),
-                        'label_Lshoulder_occ'   : _int64_feature(np.round(label['Lshoulder'][2]).astype(np.int64)),
-                        'mean'              : _float_feature(image.mean().astype(np.float32)),
-                        'std'               : _float_feature(image.std().astype(np.float32)),
-                        'filename'          : _bytes_feature(filename),
-                    }
-                )
-            )
+        # chunked one-pass stats instead of image.mean() / image.std()
+        # which promote the whole image to float64
+        image_stats     = get_image_stats(image)
+        total_stats     = image_stats.get_total()
+        _merge_as_rgb(dataset_stats, image_stats)
+
+        string_set = _make_example(image_jpeg   =image_jpeg,
+                                   label        =label,
+                                   filename     =filename,
+                                   shape        =image.shape,
+                                   mean         =total_stats.mean[0],
+                                   std          =total_stats.get_std()[0])
 
         writer.write(string_set.SerializeToString())
         progress_bar(len(image_list), img_n + 1, image_path)
 
     writer.close()
+    return dataset_stats
+
+
+
+
+def _read_example(image_path, label_path):
+    """Reads an image and its label into an Example.
+        The jpeg is decoded only for the mean and std;
+        its shape comes from the jpeg header.
+        :return: (Example, per-channel RunningStats of the image)
+    """
+    with open(image_path, 'rb') as f:
+        image_jpeg = f.read()
+
+    with open(label_path) as label_file:
+        label = json.load(label_file)
+
+    image_stats = get_image_stats(np.array(Image.open(image_path)).astype(np.uint8))
+    total_stats = image_stats.get_total()
 
+    example = _make_example(image_jpeg   =image_jpeg,
+                            label        =label,
+                            filename     =os.path.basename(image_path),
+                            shape        =get_jpeg_shape(image_jpeg),
+                            mean         =total_stats.mean[0],
+                            std          =total_stats.get_std()[0])
+    return example, image_stats
+
+
+
+
+def _write_shard(shard):
+    """Writes a single shard in a worker process.
+        A shard is first written to <name>.tmp and renamed when complete,
+        so a shard under its final name is never partial and is skipped on resume.
+        The rgb stats of the shard are kept in <name>.stats.json, written before the rename.
+        :return: (shard path, whether written, RunningStats dict of the shard)
+    """
+    stats_path = shard['out_path'] + SHARD_STATS_SUFFIX
+    if os.path.exists(shard['out_path']) and os.path.exists(stats_path):
+        with open(stats_path) as stats_file:
+            return shard['out_path'], False, json.load(stats_file)
+
+    shard_stats = RunningStats(num_channels=3)
+
+    tmp_path = shard['out_path'] + '.tmp'
+    writer = tf.python_io.TFRecordWriter(path=tmp_path)
+    for image_path, label_path in zip(shard['image_list'], shard['label_list']):
+        example, image_stats = _read_example(image_path, label_path)
+        writer.write(example.SerializeToString())
+        _merge_as_rgb(shard_stats, image_stats)
+    writer.close()
 
-def main(train_dir, eval_dir, out_dir):
+    with open(stats_path, 'w') as stats_file:
+        json.dump(shard_stats.to_dict(), stats_file)
+
+    os.rename(tmp_path, shard['out_path'])
+    return shard['out_path'], True, shard_stats.to_dict()
+
+
+
+
+def get_balanced_shards(image_list, label_list, num_shards):
+    """Splits (image, label) pairs into num_shards lists of about the same bytes.
+        Greedy largest-first assignment to the lightest shard,
+        deterministic for the same file list so that a resumed run
+        plans the same shards.
+    """
+    pairs = sorted(zip(sorted(image_list), sorted(label_list)),
+                   key=lambda pair: (-os.path.getsize(pair[0]), pair[0]))
+
+    shards      = [[] for _ in range(num_shards)]
+    shard_heap  = [(0, shard_idx) for shard_idx in range(num_shards)]
+    for image_path, label_path in pairs:
+        shard_bytes, shard_idx = heapq.heappop(shard_heap)
+        shards[shard_idx].append((image_path, label_path))
+        heapq.heappush(shard_heap, (shard_bytes + os.path.getsize(image_path), shard_idx))
+
+    return [sorted(shard) for shard in shards]
+
+
+
+
+def to_tfrecords_sharded(image_list, label_list, out_dir, prefix, num_shards, num_workers=None):
+    """Converts a dataset to num_shards size-balanced tfrecord files
+        <prefix>-00000-of-000NN by a process pool.
+        Shards already in out_dir are kept, so an interrupted run resumes.
+        :return: RunningStats of the rgb channels over the dataset
+    """
+    if num_workers is None or num_workers <= 0:
+        num_workers = multiprocessing.cpu_count()
+
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    shards = []
+    for shard_idx, shard in enumerate(get_balanced_shards(image_list, label_list, num_shards)):
+        shards.append({'out_path'  : os.path.join(out_dir, '%s-%05d-of-%05d' % (prefix, shard_idx, num_shards)),
+                       'image_list': [image_path for image_path, _ in shard],
+                       'label_list': [label_path for _, label_path in shard]})
+
+    print("Start converting", prefix, "into", num_shards, "shards")
+    dataset_stats = RunningStats(num_channels=3)
+
+    pool = multiprocessing.Pool(processes=num_workers)
+    try:
+        for shard_n, (out_path, is_written, shard_stats) in enumerate(pool.imap_unordered(_write_shard, shards)):
+            dataset_stats.merge_stats(RunningStats.from_dict(shard_stats))
+            progress_bar(num_shards, shard_n + 1,
+                         out_path if is_written else out_path + ' (exists)')
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return dataset_stats
+
+
+
+
+def main(train_dir, eval_dir, out_dir, num_shards=None, num_workers=None):
     train_data_list = glob(os.path.join(train_dir + 'images/', "*.jp*"))
     eval_data_list = glob(os.path.join(eval_dir   + 'images/', "*.jp*"))
 
@@ -135,8 +318,18 @@ def main(train_dir, eval_dir, out_dir):
     eval_out_path   = os.path.join(out_dir, 'eval-dataset.tfrecord')
 
 
-    to_tfrecords(train_data_list,   train_label_list,   reader, train_out_path)
-    to_tfrecords(eval_data_list,    eval_label_list,    reader, eval_out_path)
+    if num_shards is None:
+        train_stats = to_tfrecords(train_data_list,   train_label_list,   reader, train_out_path)
+        to_tfrecords(eval_data_list,    eval_label_list,    reader, eval_out_path)
+    else:
+        # the eval set is small; at least 100 images per eval shard
+        train_stats = to_tfrecords_sharded(train_data_list, train_label_list, out_dir, 'train',
+                                           num_shards, num_workers)
+        to_tfrecords_sharded(eval_data_list, eval_label_list, out_dir, 'eval',
+                             max(1, min(num_shards, len(eval_data_list) // 100)), num_workers)
+
+    # the normalization constants come from the training set only
+    write_dataset_stats(train_stats, len(train_data_list), out_dir)
 
 
 if __name__ == "__main__":
@@ -172,5 +365,22 @@ if __name__ == "__main__":
         required=False
     )
 
+    parser.add_argument(
+        '--num-shards',
+        default=None,
+        type=int,
+        help='number of size-balanced train-NNNNN-of-NNNNN shards written in parallel;'
+             ' a single train-dataset.tfrecord if not given',
+        required=False
+    )
+
+    parser.add_argument(
+        '--num-workers',
+        default=None,
+        type=int,
+        help='number of converter processes for --num-shards',
+        required=False
+    )
+
     args = parser.parse_args()
-    main(args.train_data_dir, args.eval_data_dir, args.out_dir)
+    main(args.train_data_dir, args.eval_data_dir, args.out_dir, args.num_shards, args.num_workers)
@@ -13,6 +13,9 @@
 # ===================================================================================
 # -*- coding: utf-8 -*-
 import sys
+import struct
+
+import numpy as np
 
 
 def progress_bar(total, progress, state_msg):
@@ -32,3 +35,124 @@ def progress_bar(total, progress, state_msg):
                                                     status)
     sys.stdout.write(progress_bar)
     sys.stdout.flush()
+
+
+
+# start-of-frame markers carrying the frame size;
+# 0xC4 (DHT), 0xC8 (JPG) and 0xCC (DAC) share the range but are not frames
+JPEG_SOF_MARKERS = [0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                    0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF]
+
+
+def get_jpeg_shape(image_jpeg):
+    """
+    Reads (height, width, channel) from the SOF segment of jpeg bytes
+    by walking the marker segments, without decoding the image.
+    """
+    data = bytearray(image_jpeg)
+    if data[0:2] != bytearray(b'\xff\xd8'):
+        raise ValueError('[get_jpeg_shape] not a jpeg (no SOI marker)')
+
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            raise ValueError('[get_jpeg_shape] corrupted jpeg at byte %d' % pos)
+
+        # markers may be preceded by any number of 0xFF fill bytes
+        while data[pos] == 0xFF and pos + 1 < len(data):
+            pos += 1
+        marker  = data[pos]
+        pos     += 1
+
+        # standalone markers without a length
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            continue
+
+        segment_len = struct.unpack_from('>H', data, pos)[0]
+        if marker in JPEG_SOF_MARKERS:
+            # length, precision, height, width, number of components
+            _, height, width, channel = struct.unpack_from('>BHHB', data, pos + 2)
+            return height, width, channel
+
+        pos += segment_len
+
+    raise ValueError('[get_jpeg_shape] no SOF marker found')
+
+
+
+class RunningStats(object):
+    """
+    Per-channel running mean and variance of uint8 pixels.
+    Pixel chunks are folded in by the parallel form of the Welford update
+    (Chan et al.), so only a chunk is ever promoted to float
+    and the accumulators of the shards merge exactly.
+    """
+
+    def __init__(self, num_channels, count=0, mean=None, m2=None):
+        self.count  = count
+        self.mean   = np.zeros(num_channels) if mean is None else np.array(mean, dtype=np.float64)
+        self.m2     = np.zeros(num_channels) if m2 is None else np.array(m2, dtype=np.float64)
+
+
+    def merge(self, count, mean, m2):
+        if count == 0:
+            return
+        total       = self.count + count
+        delta       = mean - self.mean
+        self.mean   = self.mean + delta * (float(count) / total)
+        self.m2     = self.m2 + m2 + delta ** 2 * (float(self.count) * count / total)
+        self.count  = total
+
+
+    def merge_stats(self, other):
+        self.merge(other.count, other.mean, other.m2)
+
+
+    def update(self, pixels):
+        """
+        :param pixels: (num_pixels, num_channels) uint8 chunk
+        """
+        if pixels.shape[0] == 0:
+            return
+        chunk       = pixels.astype(np.float64)
+        chunk_mean  = chunk.mean(axis=0)
+        self.merge(chunk.shape[0], chunk_mean, ((chunk - chunk_mean) ** 2).sum(axis=0))
+
+
+    def get_std(self):
+        return np.sqrt(self.m2 / max(self.count, 1))
+
+
+    def get_total(self):
+        """
+        :return: a single channel RunningStats over all the channels
+        """
+        total = RunningStats(num_channels=1)
+        for channel in range(self.mean.shape[0]):
+            total.merge(self.count, self.mean[channel:channel + 1], self.m2[channel:channel + 1])
+        return total
+
+
+    def to_dict(self):
+        return {'count': self.count, 'mean': self.mean.tolist(), 'm2': self.m2.tolist()}
+
+
+    @classmethod
+    def from_dict(cls, stats_dict):
+        return cls(num_channels =len(stats_dict['mean']),
+                   count        =stats_dict['count'],
+                   mean         =stats_dict['mean'],
+                   m2           =stats_dict['m2'])
+
+
+
+def get_image_stats(image, chunk_pixels=65536):
+    """
+    Per-channel RunningStats of a uint8 image of (height, width) or (height, width, channel)
+    without promoting the whole image to float
+    """
+    pixels  = image.reshape(image.shape[0] * image.shape[1], -1)
+    stats   = RunningStats(num_channels=pixels.shape[1])
+    for begin in range(0, pixels.shape[0], chunk_pixels):
+        stats.update(pixels[begin:begin + chunk_pixels])
+    return stats
@@ -13,8 +13,9 @@
 # ===================================================================================
 # -*- coding: utf-8 -*-
 #! /usr/bin/env python
-import tfplot
-import tfplot.summary
+import os
+import json
+
 import tensorflow as tf
 import numpy as np
 
@@ -27,6 +28,7 @@ from model_config  import NUM_OF_KEYPOINTS
 from train_config  import TrainConfig
 from train_config  import FLAGS
 from tensorflow.contrib import summary
+from tensorflow.python.client import device_lib
 
 
 # config instance generation
@@ -40,6 +42,22 @@ LR_SCHEDULE = [
     (1.0, 5), (0.1, 20), (0.01, 60), (0.001, 80), (1e-6, 300)
 ]
 
+# sub-pixel refinement of decode_keypoints()
+KEYPOINT_REFINE_MODES   = [None, 'quadratic', 'soft_argmax']
+SOFT_ARGMAX_RADIUS      = 2
+SOFT_ARGMAX_BETA        = 10.0
+
+# flags of the background eval process replacing those of the trainer.
+# It sees the devices of --eval_visible_devices only, so a single one
+# without the replicas and the prefetch device of the training
+EVAL_PROCESS_FLAGS      = {'mode':              'eval',
+                           'num_replicas':      1,
+                           'num_virtual_cpus':  0,
+                           'prefetch_device':   ''}
+
+# the input normalization of a run (--is_input_normalized) next to its checkpoints
+INPUT_NORM_FILENAME     = 'input_norm.json'
+
 
 def learning_rate_schedule(current_epoch):
     """Handles linear scaling rule, gradual warmup, and LR decay.
@@ -80,25 +98,262 @@ def learning_rate_exp_decay(current_epoch):
 
 
 
+def get_train_devices(num_replicas=0, session_config=None):
+    '''
+        get_train_devices()
+        lists the local GPUs for the data parallel training,
+        or the CPUs if no GPU is found.
+        device_count={'CPU': n} of session_config gives n virtual CPU devices
+        to run the data parallel training without GPUs.
+
+        :param num_replicas: number of the devices to use; 0 for all of them
+        :param session_config: tf.ConfigProto of the training session
+        :return: list of the device names
+    '''
+    local_devices = device_lib.list_local_devices(session_config=session_config)
+
+    devices = [device.name for device in local_devices if device.device_type == 'GPU']
+    if not devices:
+        devices = [device.name for device in local_devices if device.device_type == 'CPU']
+
+    if num_replicas > len(devices):
+        raise ValueError('[get_train_devices] num_replicas = %s but only %s devices: %s'
+                         % (num_replicas, len(devices), devices))
+    if num_replicas > 0:
+        devices = devices[:num_replicas]
+
+    return devices
+
+
+
+
+def get_distribution_strategy(devices):
+    '''
+        get_distribution_strategy()
+        gives MirroredStrategy over the devices for RunConfig(train_distribute=).
+        Each replica runs model_fn on its own batch and the gradients are
+        summed over the replicas. None for a single device.
+    '''
+    if len(devices) <= 1:
+        return None
+    return tf.contrib.distribute.MirroredStrategy(devices=devices)
+
+
+
+
+def get_eval_process_argv(argv, model_dir):
+    '''
+        get_eval_process_argv()
+        the command line arguments of the background eval process of --mode=train_and_eval_async.
+        The flags of the trainer are passed on but those of EVAL_PROCESS_FLAGS
+        given in either the --flag=value or the --flag value form, which are replaced.
+
+        :param argv: sys.argv[1:] of the trainer
+        :param model_dir: run dir of the checkpoints to evaluate
+        :return: list of the arguments
+    '''
+    eval_flags  = dict(EVAL_PROCESS_FLAGS, model_dir=model_dir)
+
+    eval_argv   = []
+    is_value    = False
+    for n, arg in enumerate(argv):
+        if is_value:
+            # the value of the flag skipped
+            is_value = False
+            continue
+        if arg == '--':
+            eval_argv += argv[n:]
+            break
+
+        flag_name = arg.lstrip('-').split('=')[0] if arg.startswith('-') else None
+        if flag_name in eval_flags:
+            is_value = '=' not in arg
+            continue
+        eval_argv.append(arg)
+
+    return eval_argv + ['--%s=%s' % (flag_name, eval_flags[flag_name])
+                        for flag_name in sorted(eval_flags.keys())]
+
+
+
+
+def get_regularization_loss(num_replicas=1, scope=None):
+    '''
+        get_regularization_loss()
+        the weight regularization loss of a replica.
+        Every replica adds it to its loss and the strategy sums the gradients
+        over the replicas, so each takes 1 / num_replicas of it
+        to keep the weight of the single device training.
+
+        :param num_replicas: number of the data parallel replicas of the training; 1 otherwise
+    '''
+    loss_regularizer = tf.losses.get_regularization_loss(scope=scope)
+    if num_replicas > 1:
+        loss_regularizer /= float(num_replicas)
+    return loss_regularizer
+
+
+
+
+def normalize_image(images, mean_rgb, stddev_rgb, scope=None):
+    '''
+        normalize_image()
+
+        the input normalization of the network shared by model_fn and the export.
+        The uint8 and the float images of the same pixels give the same output.
+
+        :param images: NxHxWx3 BGR images in [0, 255] of any dtype
+        :param mean_rgb: per-channel mean in [0, 1] in the RGB order as of PreprocessingConfig.MEAN_RGB
+        :param stddev_rgb: per-channel stddev in [0, 1] in the RGB order as of PreprocessingConfig.STDDEV_RGB
+        :return: NxHxWx3 float32 images of zero mean and unit variance
+    '''
+    with tf.name_scope(name=scope, default_name='feature_norm', values=[images]):
+        images = tf.cast(images, tf.float32) / 255.0
+
+        # the coco images are in the BGR order of cv2
+        images -= tf.constant(mean_rgb[::-1],   shape=[1, 1, 3], dtype=tf.float32)
+        images /= tf.constant(stddev_rgb[::-1], shape=[1, 1, 3], dtype=tf.float32)
+    return images
+
+
+
+
+def save_input_norm(model_dir, mean_rgb, stddev_rgb):
+    '''
+        save_input_norm()
+        records the normalize_image() stats of a run trained with --is_input_normalized
+        for gen_tflite_coreml.py to normalize the export alike
+    '''
+    with open(os.path.join(model_dir, INPUT_NORM_FILENAME), 'w') as fp:
+        json.dump({'mean_rgb':      [float(value) for value in mean_rgb],
+                   'stddev_rgb':    [float(value) for value in stddev_rgb]}, fp)
+
+
+
+
+def load_input_norm(model_dir):
+    '''
+        load_input_norm()
+        :return: (mean_rgb, stddev_rgb) of save_input_norm(),
+            or None for a run without the input normalization
+    '''
+    input_norm_path = os.path.join(model_dir, INPUT_NORM_FILENAME)
+    if not os.path.exists(input_norm_path):
+        return None
+
+    with open(input_norm_path, 'r') as fp:
+        input_norm = json.load(fp)
+    return input_norm['mean_rgb'], input_norm['stddev_rgb']
+
+
+
+
+def decode_keypoints(heatmaps, refine=None, scope=None):
+    '''
+        decode_keypoints()
+
+        decodes the keypoints of all the heatmap channels at once.
+        The batch size can be dynamic.
+
+        :param heatmaps: BxHxWxK heatmaps
+        :param refine: sub-pixel refinement of the argmax
+            - None          : integer argmax coordinates
+            - 'quadratic'   : peak of the parabola through the argmax
+                              and its two neighbors along each axis
+            - 'soft_argmax' : mean coordinates under the softmax of the heatmap
+                              around the argmax
+        :param scope: scope
+        :return: BxKx2 float32 (x, y) of the keypoints in heatmap pixels
+    '''
+    # input format: BxHxWxK
+    assert len(heatmaps.get_shape()) == 4
+
+    if refine not in KEYPOINT_REFINE_MODES:
+        raise ValueError('[decode_keypoints] Unknown refine = %s' % str(refine))
+
+    with tf.name_scope(name=scope, default_name='decode_keypoints',values=[heatmaps]):
+        heatmaps        = tf.cast(heatmaps, tf.float32)
+        heatmaps_shape  = tf.shape(heatmaps)
+        height          = heatmaps_shape[1]
+        width           = heatmaps_shape[2]
+
+        # BxKxHxW flattened along the height and width axes
+        heatmaps_bkhw   = tf.transpose(heatmaps, [0, 3, 1, 2])
+        flat_heatmaps   = tf.reshape(heatmaps_bkhw, [-1, height * width])
+
+        # argmax of the flat heatmaps to 2D coordinates
+        argmax      = tf.argmax(flat_heatmaps, axis=1, output_type=tf.int32)
+        argmax_x    = argmax % width
+        argmax_y    = argmax // width
+
+        keypoints_x = tf.cast(argmax_x, tf.float32)
+        keypoints_y = tf.cast(argmax_y, tf.float32)
+
+        if refine == 'quadratic':
+            # the values are picked by one_hot() without the *_like() and range() ops
+            # which are constants of the static batch size of an exported graph
+            def get_values(index):
+                return tf.reduce_sum(flat_heatmaps * tf.one_hot(index, height * width), axis=1)
+
+            center = get_values(argmax)
+
+            def get_offset(coord, size, stride):
+                # no refinement at the borders
+                is_inner    = tf.logical_and(coord > 0, coord < size - 1)
+                step        = tf.cast(is_inner, tf.int32) * stride
+
+                prev_value  = get_values(argmax - step)
+                next_value  = get_values(argmax + step)
+
+                curvature   = prev_value - 2.0 * center + next_value
+                is_peak     = tf.cast(curvature < 0.0, tf.float32)
+                offset      = 0.5 * (prev_value - next_value) / tf.minimum(curvature, -1e-6)
+                return tf.clip_by_value(offset * is_peak, -0.5, 0.5)
+
+            keypoints_x += get_offset(argmax_x, width, 1)
+            keypoints_y += get_offset(argmax_y, height, width)
+
+        elif refine == 'soft_argmax':
+            grid_x  = tf.cast(tf.range(width), tf.float32)
+            grid_y  = tf.cast(tf.range(height), tf.float32)
+
+            # window of SOFT_ARGMAX_RADIUS around the argmax
+            mask_x  = tf.abs(grid_x[tf.newaxis, :] - keypoints_x[:, tf.newaxis]) <= SOFT_ARGMAX_RADIUS
+            mask_y  = tf.abs(grid_y[tf.newaxis, :] - keypoints_y[:, tf.newaxis]) <= SOFT_ARGMAX_RADIUS
+            mask    = tf.logical_and(mask_y[:, :, tf.newaxis], mask_x[:, tf.newaxis, :])
+
+            max_values  = tf.reduce_max(flat_heatmaps, axis=1)
+            weights     = tf.exp(SOFT_ARGMAX_BETA *
+                                 (tf.reshape(flat_heatmaps, [-1, height, width])
+                                  - max_values[:, tf.newaxis, tf.newaxis]))
+            weights     = weights * tf.cast(mask, tf.float32)
+            weights     = weights / tf.reduce_sum(weights, axis=[1, 2], keepdims=True)
+
+            keypoints_x = tf.reduce_sum(tf.reduce_sum(weights, axis=1) * grid_x, axis=1)
+            keypoints_y = tf.reduce_sum(tf.reduce_sum(weights, axis=2) * grid_y, axis=1)
+
+        keypoints = tf.stack([keypoints_x, keypoints_y], axis=1)
+        keypoints = tf.reshape(keypoints, [-1, heatmaps_shape[3], 2])
+
+    return keypoints
+
+
+
+
+
 def argmax_2d(tensor):
 
     # input format: BxHxWxD
     assert len(tensor.get_shape()) == 4
 
     with tf.name_scope(name='argmax_2d',values=[tensor]):
-        tensor_shape = tensor.get_shape().as_list()
-
-        # flatten the Tensor along the height and width axes
-        flat_tensor = tf.reshape(tensor, (tensor_shape[0], -1, tensor_shape[3]))
-
-        # argmax of the flat tensor
-        argmax = tf.cast(tf.argmax(flat_tensor, axis=1), tf.float32)
+        keypoints = decode_keypoints(tensor)
 
-        # convert indexes into 2D coordinates
-        argmax_x = argmax % tensor_shape[2]
-        argmax_y = argmax // tensor_shape[2]
+        # (x_1, ..., x_D, y_1, ..., y_D) of each sample
+        num_of_channels = tf.shape(tensor)[3]
+        keypoints_xy    = tf.reshape(tf.transpose(keypoints, [0, 2, 1]), [-1, 2 * num_of_channels])
 
-    return tf.concat((argmax_x, argmax_y), axis=1)
+    return keypoints_xy
 
 
 
@@ -171,6 +426,8 @@ def get_loss_heatmap(pred_heatmaps,
         ### get loss function of each part
         loss_fn         = train_config.heatmap_loss_fn
         # total_losssum = loss_fn(label_heatmaps,pred_heatmaps)
+        # normalized by the batch over all the replicas in the data parallel training,
+        # so the gradients summed over the replicas are of the whole batch
         total_losssum = loss_fn(label_heatmaps - pred_heatmaps) / NUM_OF_KEYPOINTS /train_config.batch_size
 
 
@@ -181,7 +438,7 @@ def get_loss_heatmap(pred_heatmaps,
 
 
 
-def metric_fn(labels, logits,pck_threshold):
+def metric_fn(labels, logits,pck_threshold,refine=None):
     """Evaluation metric function. Evaluates accuracy.
 
     This function is executed on the CPU and should not directly reference
@@ -196,6 +453,7 @@ def metric_fn(labels, logits,pck_threshold):
     Args:
     labels: `Tensor` of labels_heatmap_list
     logits: `Tensor` of logits_heatmap_list
+    refine: sub-pixel refinement of decode_keypoints()
 
     Returns:
     A dict of the metrics to return from evaluation.
@@ -203,17 +461,20 @@ def metric_fn(labels, logits,pck_threshold):
 
     with tf.name_scope('metric_fn',values=[labels, logits,pck_threshold]):
 
-        # get predicted coordinate
-        pred_head_xy       = argmax_2d(logits[:,:,:,0:1])
-        pred_neck_xy       = argmax_2d(logits[:,:,:,1:2])
-        pred_lshoulder_xy  = argmax_2d(logits[:,:,:,2:3])
-        pred_rshoulder_xy  = argmax_2d(logits[:,:,:,3:4])
+        # get predicted coordinate of all the keypoints at once
+        pred_xy            = decode_keypoints(logits, refine=refine, scope='pred_keypoints')
+        label_xy           = decode_keypoints(labels, refine=refine, scope='label_keypoints')
 
+        pred_head_xy       = pred_xy[:, 0, :]
+        pred_neck_xy       = pred_xy[:, 1, :]
+        pred_lshoulder_xy  = pred_xy[:, 2, :]
+        pred_rshoulder_xy  = pred_xy[:, 3, :]
 
-        label_head_xy      = argmax_2d(labels[:,:,:,0:1])
-        label_neck_xy      = argmax_2d(labels[:,:,:,1:2])
-        label_lshoulder_xy = argmax_2d(labels[:,:,:,2:3])
-        label_rshoulder_xy = argmax_2d(labels[:,:,:,3:4])
+
+        label_head_xy      = label_xy[:, 0, :]
+        label_neck_xy      = label_xy[:, 1, :]
+        label_lshoulder_xy = label_xy[:, 2, :]
+        label_rshoulder_xy = label_xy[:, 3, :]
 
 
         # error distance measure
@@ -286,8 +547,9 @@ def summary_fn(mode,
                total_mid_losssum_list=None,
                learning_rate=None):
     '''
-
-        code ref: https://github.com/wookayin/tensorflow-plot
+        summary_fn()
+        The heatmap overlays of the first FLAGS.summary_max_outputs samples
+        are rendered in-graph by get_heatmap_overlay()
     '''
 
     tf.summary.scalar(name='loss', tensor=loss, family='outlayer')
@@ -297,12 +559,13 @@ def summary_fn(mode,
         tf.summary.scalar(name='learning_rate', tensor=learning_rate, family='outlayer')
 
 
-    batch_size          = FLAGS.train_batch_size
-    resized_input_image = tf.image.resize_bicubic(images= input_images,
+    max_outputs         = FLAGS.summary_max_outputs
+    # the input images are in bfloat16 from the data loader of --precision=bfloat16
+    resized_input_image = tf.image.resize_bicubic(images= tf.cast(input_images[:max_outputs], tf.float32),
                                                   size=[int(DEFAULT_HG_INOUT_RESOL),
                                                         int(DEFAULT_HG_INOUT_RESOL)],
                                                   align_corners=False)
-    tf.logging.info ('[summary_fn] batch_size = %s' % batch_size)
+    tf.logging.info ('[summary_fn] max_outputs = %s' % max_outputs)
     tf.logging.info ('[summary_fn] resized_input_image.shape= %s' % resized_input_image.get_shape().as_list())
     tf.logging.info ('[summary_fn] label_heatmap.shape= %s' % label_heatmap.get_shape().as_list())
     tf.logging.info ('[summary_fn] pred_out_heatmap.shape= %s' % pred_out_heatmap.get_shape().as_list())
@@ -314,19 +577,19 @@ def summary_fn(mode,
         summary_name_pred_mid_heatmap       = "pred_mid_heatmap_summary"
 
         for keypoint_index in range(0,NUM_OF_KEYPOINTS):
-            tfplot.summary.plot_many(name           =summary_name_true_heatmap + '_' +
-                                                     str(keypoint_index),
-                                     plot_func      =overlay_attention_batch,
-                                     in_tensors     =[label_heatmap[:,:,:,keypoint_index],
-                                                      resized_input_image],
-                                     max_outputs    =batch_size)
+            tf.summary.image(name           =summary_name_true_heatmap + '_' +
+                                             str(keypoint_index),
+                             tensor         =get_heatmap_overlay(
+                                                 heatmap=label_heatmap[:max_outputs,:,:,keypoint_index],
+                                                 images =resized_input_image),
+                             max_outputs    =max_outputs)
 
-            tfplot.summary.plot_many(name           =summary_name_pred_out_heatmap + '_' +
-                                                     str(keypoint_index),
-                                     plot_func      =overlay_attention_batch,
-                                     in_tensors     =[pred_out_heatmap[:,:,:,keypoint_index],
-                                                      resized_input_image],
-                                     max_outputs    =batch_size)
+            tf.summary.image(name           =summary_name_pred_out_heatmap + '_' +
+                                             str(keypoint_index),
+                             tensor         =get_heatmap_overlay(
+                                                 heatmap=pred_out_heatmap[:max_outputs,:,:,keypoint_index],
+                                                 images =resized_input_image),
+                             max_outputs    =max_outputs)
 
 
         if mode == tf.estimator.ModeKeys.TRAIN:
@@ -339,13 +602,13 @@ def summary_fn(mode,
                                   family='midlayer')
 
                 for keypoint_index in range(0,NUM_OF_KEYPOINTS):
-                    tfplot.summary.plot_many(name       =summary_name_pred_mid_heatmap + '_' +
-                                                         str(keypoint_index) +
-                                                         '_hgstage'+str(n),
-                                             plot_func  =overlay_attention_batch,
-                                             in_tensors =[pred_mid_heatmap[n][:, :, :, keypoint_index],
-                                                          resized_input_image],
-                                             max_outputs=batch_size)
+                    tf.summary.image(name       =summary_name_pred_mid_heatmap + '_' +
+                                                 str(keypoint_index) +
+                                                 '_hgstage'+str(n),
+                                     tensor     =get_heatmap_overlay(
+                                                     heatmap=pred_mid_heatmap[n][:max_outputs, :, :, keypoint_index],
+                                                     images =resized_input_image),
+                                     max_outputs=max_outputs)
 
     return tf.summary.merge_all()
 
@@ -354,22 +617,45 @@ def summary_fn(mode,
 
 
 
-def overlay_attention_batch(attention, image,
-                            alpha=0.5, cmap='jet'):
+def get_colormap_lut(num_of_levels=256):
+    '''
+        get_colormap_lut()
+        :return: the lookup table <num_of_levels x 3> of the 'jet' colormap in RGB of [0, 1]
+    '''
+    levels  = np.linspace(0.0, 1.0, num_of_levels)
+    lut     = np.stack([np.clip(1.5 - np.abs(4.0 * levels - offset), 0.0, 1.0)
+                        for offset in [3.0, 2.0, 1.0]], axis=1)
+    return lut.astype(np.float32)
+
+
+
+
+def _scale_per_sample(tensor):
+    # min-max scaling of every sample to [0, 1] as matplotlib imshow() does
+    axis        = list(range(1, tensor.get_shape().ndims))
+    min_value   = tf.reduce_min(tensor, axis=axis, keepdims=True)
+    max_value   = tf.reduce_max(tensor, axis=axis, keepdims=True)
+    return (tensor - min_value) / tf.maximum(max_value - min_value, 1e-6)
+
 
-    fig = tfplot.Figure(figsize=(4, 4))
-    ax = fig.add_subplot(1, 1, 1)
-    ax.axis('off')
-    # fig.subplots_adjust(0, 0, 1, 1)  # get rid of margins
 
-    # print (attention.shape)
-    # print (image.shape)
-    # print ('[tfplot] attention  =%s' % attention)
-    # print ('[tfplot] image      =%s' % image)
-    image = image.astype(np.uint8)
-    H, W = attention.shape
-    ax.imshow(image, extent=[0, H, 0, W])
-    ax.imshow(attention, cmap=cmap,
-              alpha=alpha, extent=[0, H, 0, W])
 
-    return fig
\ No newline at end of file
+def get_heatmap_overlay(heatmap, images, alpha=0.5, scope=None):
+    '''
+        get_heatmap_overlay()
+        colors the heatmap by the jet colormap and blends it over the images in-graph
+
+        :param heatmap: heatmaps of a single keypoint <N x H x W>
+        :param images:  the coco images in the BGR order of cv2 <N x H x W x 3>
+        :param alpha:   opacity of the heatmap
+        :return: uint8 RGB overlays <N x H x W x 3> for tf.summary.image()
+    '''
+    with tf.name_scope(name=scope, default_name='heatmap_overlay', values=[heatmap, images]):
+        lut     = get_colormap_lut()
+        heatmap = _scale_per_sample(tf.cast(heatmap, tf.float32))
+        levels  = tf.cast(tf.round(heatmap * (lut.shape[0] - 1)), tf.int32)
+        colors  = tf.gather(tf.constant(lut), levels)
+
+        images  = tf.reverse(_scale_per_sample(tf.cast(images, tf.float32)), axis=[3])
+        overlay = (1.0 - alpha) * images + alpha * colors
+        return tf.cast(tf.round(overlay * 255.0), tf.uint8)
@@ -14,6 +14,9 @@
 # -*- coding: utf-8 -*-
 #! /usr/bin/env python
 
+import json
+import multiprocessing
+
 import tensorflow as tf
 from absl import flags
 
@@ -59,17 +62,97 @@ class TrainConfig(object):
         self.heatmap_loss_fn        = tf.nn.l2_loss
         self.metric_fn              = tf.metrics.root_mean_squared_error
 
+        # sub-pixel refinement of the keypoint decoding in metric_fn
+        # ''           : integer argmax on the heatmap grid as argmax_2d()
+        # 'quadratic'  : parabola fit around the argmax
+        # 'soft_argmax': softmax-weighted mean around the argmax
+        # The PCK of a refinement is not comparable with the one of the integer argmax
+        self.keypoint_refine        = ''
+
 
 
         self.tf_data_type   = tf.float32
         self.is_image_summary = False
 
+        # data loader mode
+        # 'py_func'  : parsing by tf.py_func (bound to one core by the GIL)
+        # 'multiproc': parsing by a pool of worker processes
+        # 'prebaked' : streaming the augmented records of gen_prebaked_dataset.py
+        #              from prebake_dir (training only)
+        # 'in_graph' : parsing by the TF ops of dataset_augment_tf.py
+        #              over num_dataloader_workers threads
+        self.dataloader_mode        = 'py_func'
+        self.num_dataloader_workers = multiprocessing.cpu_count()
+        self.prebake_dir            = ''
+
+        # directory of the preprocessed evaluation set cache; '' for no caching.
+        # The evaluation set is preprocessed once per dataset and preprocessing config,
+        # then streamed in batches of eval_cache_batch_size
+        self.eval_cache_dir         = ''
+        self.eval_cache_batch_size  = 32
+
+        # label mode
+        # 'heatmap'  : the data loader renders the label heatmaps
+        # 'keypoints': the data loader gives (x, y, visible) of the keypoints
+        #              and model_fn renders the heatmaps per batch
+        self.label_mode             = 'heatmap'
+
+        # keep the images in uint8 from the data loader to model_fn
+        # where they are cast to the 0-255 float images of the float transport
+        self.is_uint8_transport     = False
+
+        # normalize the model input by MEAN_RGB and STDDEV_RGB in model_fn
+        # and in the export; off for the raw 0-255 BGR input the checkpoints
+        # so far were trained with
+        self.is_input_normalized    = False
+
+        # device to stage the input batches on, e.g. '/gpu:0'; '' for none
+        self.prefetch_device        = ''
+
+        # number of the data parallel replicas of the training;
+        # 0 for all the GPUs found, or all the CPU devices without GPU.
+        # train_config.batch_size is split over the replicas
+        self.num_replicas           = 0
+
+        # number of the virtual CPU devices; 0 for the default single one.
+        # To run the data parallel training on CPU without GPUs
+        self.num_virtual_cpus       = 0
+
+        # static loss scale of the float16 training (--precision=float16)
+        # to keep the small gradients from flushing to zero
+        self.loss_scale             = 128.0
+
+        # decoded image cache in total over the dataloader workers of the training,
+        # e.g. 4096; 0 for no caching. The decoded images are spilled
+        # to image_cache_dir as .npy files if given
+        self.image_cache_mbytes     = 0
+        self.image_cache_dir        = ''
+
 
     def show_info(self):
         tf.logging.info('------------------------')
         tf.logging.info('[train_config] Use opt_fn   : %s' % str(self.opt_fn))
         tf.logging.info('[train_config] Use loss_fn  : %s' % str(self.heatmap_loss_fn))
         tf.logging.info('[train_config] Use metric_fn: %s' % str(self.metric_fn))
+        tf.logging.info('[train_config] Use keypoint_refine: %s' % str(self.keypoint_refine))
+        tf.logging.info('[train_config] Use dataloader_mode: %s' % str(self.dataloader_mode))
+        if self.dataloader_mode in ['multiproc', 'in_graph']:
+            tf.logging.info('[train_config] Use num_dataloader_workers: %s' % str(self.num_dataloader_workers))
+        if self.dataloader_mode == 'prebaked':
+            tf.logging.info('[train_config] Use prebake_dir: %s' % str(self.prebake_dir))
+        tf.logging.info('[train_config] Use eval_cache_dir: %s' % str(self.eval_cache_dir))
+        if self.eval_cache_dir:
+            tf.logging.info('[train_config] Use eval_cache_batch_size: %s' % str(self.eval_cache_batch_size))
+        tf.logging.info('[train_config] Use label_mode: %s' % str(self.label_mode))
+        tf.logging.info('[train_config] Use is_uint8_transport: %s' % str(self.is_uint8_transport))
+        tf.logging.info('[train_config] Use is_input_normalized: %s' % str(self.is_input_normalized))
+        tf.logging.info('[train_config] Use prefetch_device: %s' % str(self.prefetch_device))
+        tf.logging.info('[train_config] Use num_replicas: %s' % str(self.num_replicas))
+        if self.num_virtual_cpus > 0:
+            tf.logging.info('[train_config] Use num_virtual_cpus: %s' % str(self.num_virtual_cpus))
+        tf.logging.info('[train_config] Use loss_scale: %s' % str(self.loss_scale))
+        tf.logging.info('[train_config] Use image_cache_mbytes: %s' % str(self.image_cache_mbytes))
+        tf.logging.info('[train_config] Use image_cache_dir: %s' % str(self.image_cache_dir))
 
 
 
@@ -83,6 +166,10 @@ class PreprocessingConfig(object):
         self.is_scale                   = True
         self.is_resize_shortest_edge    = True
 
+        # compose the above augmentations into one affine matrix
+        # applied by a single cv2.warpAffine() (see pose_affine_random())
+        self.is_fused_affine            = False
+
         # this is when classification task
         # which has an input as pose coordinate
         # self.is_label_coordinate_norm   = False
@@ -90,6 +177,11 @@ class PreprocessingConfig(object):
         # for ground true heatmap generation
         self.heatmap_std        = 6.0
 
+        # render the heatmap directly at DEFAULT_HG_INOUT_RESOL
+        # instead of at the image size followed by resizing.
+        # Off until the labels of the two paths are checked to agree
+        self.is_heatmap_at_target_resol = False
+
         self.MIN_AUGMENT_ROTATE_ANGLE_DEG = -5.0
         self.MAX_AUGMENT_ROTATE_ANGLE_DEG = 5.0
 
@@ -97,6 +189,26 @@ class PreprocessingConfig(object):
         self.MEAN_RGB = [0.485, 0.456, 0.406]
         self.STDDEV_RGB = [0.229, 0.224, 0.225]
 
+        # dataset_stats.json by tfrecord_converter.py replacing the above
+        # imagenet values by load_dataset_stats(); '' for the imagenet values.
+        # They normalize the model input with TrainConfig.is_input_normalized
+        self.dataset_stats_path = ''
+
+
+
+    def load_dataset_stats(self, dataset_stats_path):
+        '''
+            load_dataset_stats()
+            sets MEAN_RGB and STDDEV_RGB to the per-channel stats of the dataset
+            :param dataset_stats_path: dataset_stats.json written by tfrecord_converter.py
+        '''
+        with open(dataset_stats_path, 'r') as stats_file:
+            dataset_stats = json.load(stats_file)
+
+        self.MEAN_RGB           = [float(value) for value in dataset_stats['mean_rgb']]
+        self.STDDEV_RGB         = [float(value) for value in dataset_stats['stddev_rgb']]
+        self.dataset_stats_path = dataset_stats_path
+
 
     def show_info(self):
         tf.logging.info('------------------------')
@@ -105,12 +217,17 @@ class PreprocessingConfig(object):
         tf.logging.info('[train_config] Use is_flipping: %s'    % str(self.is_flipping))
         tf.logging.info('[train_config] Use is_scale: %s'       % str(self.is_scale))
         tf.logging.info('[train_config] Use is_resize_shortest_edge: %s' % str(self.is_resize_shortest_edge))
+        tf.logging.info('[train_config] Use is_fused_affine: %s' % str(self.is_fused_affine))
 
         if self.is_rotate:
 
             tf.logging.info('[train_config] MIN_ROTATE_ANGLE_DEG: %s' % str(self.MIN_AUGMENT_ROTATE_ANGLE_DEG))
             tf.logging.info('[train_config] MAX_ROTATE_ANGLE_DEG: %s' % str(self.MAX_AUGMENT_ROTATE_ANGLE_DEG))
         tf.logging.info('[train_config] Use heatmap_std: %s'    % str(self.heatmap_std))
+        tf.logging.info('[train_config] Use is_heatmap_at_target_resol: %s' % str(self.is_heatmap_at_target_resol))
+        tf.logging.info('[train_config] Use dataset_stats_path: %s' % str(self.dataset_stats_path))
+        tf.logging.info('[train_config] Use MEAN_RGB: %s'       % str(self.MEAN_RGB))
+        tf.logging.info('[train_config] Use STDDEV_RGB: %s'     % str(self.STDDEV_RGB))
         tf.logging.info('------------------------')
 
 
@@ -142,6 +259,10 @@ flags.DEFINE_bool(
     'is_summary_heatmap', default=True,
     help=('Give True when storing heatmap image in tensorboard'))
 
+flags.DEFINE_integer(
+    'summary_max_outputs', default=4,
+    help=('Number of the samples of a batch whose heatmaps are stored in tensorboard'))
+
 flags.DEFINE_bool(
     'is_ckpt_init', default=False,
     help=('Give True when initializating weight by pre-trained check points')
@@ -199,7 +320,19 @@ flags.DEFINE_string(
 flags.DEFINE_string(
     # 'mode', default='train_and_eval',
     'mode', default='train',
-    help='One of {"train_and_eval", "train", "eval"}.')
+    help=('One of {"train_and_eval", "train_and_eval_async", "train", "eval"}.'
+          ' "train_and_eval_async" trains in a single run and evaluates the checkpoints'
+          ' of every --steps_per_eval in a background process of --mode=eval.'))
+
+flags.DEFINE_bool(
+    'is_live_eval', default=True,
+    help=('In --mode=eval, build the eval graph and session once and only restore'
+          ' the variables for every new checkpoint instead of Estimator.evaluate().'))
+
+flags.DEFINE_string(
+    'eval_visible_devices', default='',
+    help=('CUDA_VISIBLE_DEVICES of the background eval process of --mode=train_and_eval_async.'
+          ' "" runs the evaluation on CPU, leaving the GPUs to the training.'))
 
 flags.DEFINE_integer(
     'train_steps', default=train_config.total_train_steps,
@@ -213,6 +346,73 @@ flags.DEFINE_integer(
 flags.DEFINE_integer(
     'eval_batch_size', default=train_config.batch_size_eval, help='Batch size for evaluation.')
 
+flags.DEFINE_string(
+    'dataloader_mode', default=train_config.dataloader_mode,
+    help=('One of {"py_func", "multiproc", "prebaked", "in_graph"}. "multiproc" runs the image decode,'
+          ' augmentation and heatmap generation in a pool of worker processes.'
+          ' "prebaked" streams the records of gen_prebaked_dataset.py for training.'
+          ' "in_graph" runs them as TF ops with no python per sample.'))
+
+flags.DEFINE_integer(
+    'num_dataloader_workers', default=train_config.num_dataloader_workers,
+    help=('Number of worker processes for --dataloader_mode=multiproc'
+          ' and num_parallel_calls for --dataloader_mode=in_graph.'))
+
+flags.DEFINE_string(
+    'prebake_dir', default=train_config.prebake_dir,
+    help='The directory of the prebaked shards for --dataloader_mode=prebaked.')
+
+flags.DEFINE_string(
+    'eval_cache_dir', default=train_config.eval_cache_dir,
+    help=('The directory to cache the preprocessed evaluation set in. The evaluation set is'
+          ' preprocessed once and the later evaluations stream the cache in batches of'
+          ' TrainConfig.eval_cache_batch_size.'))
+
+flags.DEFINE_string(
+    'label_mode', default=train_config.label_mode,
+    help=('One of {"heatmap", "keypoints"}. "keypoints" ships the (x, y, visible) of the keypoints'
+          ' through the input pipeline and renders the label heatmaps per batch in model_fn.'))
+
+flags.DEFINE_bool(
+    'is_uint8_transport', default=train_config.is_uint8_transport,
+    help=('Keep the images in uint8 through the input pipeline. model_fn casts them'
+          ' to float, so the model input is the same as of the float images.'))
+
+flags.DEFINE_bool(
+    'is_input_normalized', default=train_config.is_input_normalized,
+    help=('Normalize the model input by MEAN_RGB and STDDEV_RGB of PreprocessingConfig'
+          ' in model_fn. Recorded next to the checkpoints for gen_tflite_coreml.py'
+          ' to normalize the export alike. Off for the raw 0-255 BGR input.'))
+
+flags.DEFINE_string(
+    'prefetch_device', default=train_config.prefetch_device,
+    help='The device to stage the input batches on by prefetch_to_device(), e.g. /gpu:0.')
+
+flags.DEFINE_integer(
+    'num_replicas', default=train_config.num_replicas,
+    help=('Number of the data parallel replicas for training. 0 for all the GPUs found,'
+          ' or all the CPU devices without GPU. TrainConfig.batch_size is split over the replicas.'))
+
+flags.DEFINE_integer(
+    'num_virtual_cpus', default=train_config.num_virtual_cpus,
+    help='Number of the virtual CPU devices to run the data parallel training without GPUs.')
+
+flags.DEFINE_string(
+    'dataset_stats_path', default='',
+    help=('dataset_stats.json of tfrecord_converter.py. If given, its per-channel mean and std'
+          ' replace the imagenet MEAN_RGB and STDDEV_RGB of PreprocessingConfig'
+          ' normalizing the model input with --is_input_normalized.'))
+
+flags.DEFINE_integer(
+    'image_cache_mbytes', default=train_config.image_cache_mbytes,
+    help=('Memory budget in MB of the decoded image cache over all the dataloader workers'
+          ' of the training. 0 disables the cache.'))
+
+flags.DEFINE_string(
+    'image_cache_dir', default=train_config.image_cache_dir,
+    help=('The directory where the decoded images are spilled as memory-mapped .npy files'
+          ' such that a restarted training skips the jpeg decoding.'))
+
 flags.DEFINE_integer(
     'num_train_images', default=train_config.trainset_size, help='Size of training data set.')
 
@@ -287,7 +487,13 @@ flags.DEFINE_bool(
 
 flags.DEFINE_string(
     'precision', default='float32',
-    help=('Precision to use; one of: {bfloat16, float32}'))
+    help=('Precision to use; one of: {bfloat16, float16, float32}.'
+          ' bfloat16 and float16 keep the variables in float32.'
+          ' trainer_gpu.py takes float16 or float32 as bfloat16 is of TPU only.'))
+
+flags.DEFINE_float(
+    'loss_scale', default=train_config.loss_scale,
+    help='Static loss scale for --precision=float16.')
 
 flags.DEFINE_float(
     'base_learning_rate', default=train_config.learning_rate_base,
@@ -308,3 +514,9 @@ flags.DEFINE_float(
     help=('Threshold to measure percentage for correct keypoints')
 )
 
+flags.DEFINE_string(
+    'keypoint_refine', default=train_config.keypoint_refine,
+    help=('Sub-pixel refinement of the keypoint decoding in the metrics:'
+          ' one of {quadratic, soft_argmax}, or empty for the integer argmax.')
+)
+
@@ -31,6 +31,7 @@ import tensorflow as tf
 import numpy as np
 from datetime import datetime
 from subprocess import check_output
+from subprocess import Popen
 
 # directory path addition
 from path_manager import TF_MODULE_DIR
@@ -53,10 +54,13 @@ sys.path.insert(0,COCO_DATALOAD_DIR)
 
 ### data loader
 import data_loader_coco
+import dataset_augment_tf
 
 ### models
 from model_builder import get_model
 from model_config  import ModelConfig
+from model_config  import DEFAULT_INPUT_RESOL
+from model_config  import DEFAULT_HG_INOUT_RESOL
 
 #### training config
 from train_config  import TrainConfig
@@ -71,6 +75,14 @@ from train_aux_fn import learning_rate_exp_decay
 from train_aux_fn import get_heatmap_activation
 from train_aux_fn import metric_fn
 from train_aux_fn import summary_fn
+from train_aux_fn import get_train_devices
+from train_aux_fn import get_distribution_strategy
+from train_aux_fn import normalize_image
+from train_aux_fn import save_input_norm
+from train_aux_fn import get_regularization_loss
+from train_aux_fn import get_eval_process_argv
+
+from eval_runner  import LiveEvaluator
 
 from tensorflow.contrib.training.python.training import evaluation
 from tensorflow.python.estimator import estimator
@@ -102,17 +114,34 @@ def model_fn(features,
 
     if isinstance(features, dict):
         features = features['feature']
-    if FLAGS.data_format == 'channels_first':
-        assert not FLAGS.transpose_input    # channels_first only for GPU
-        features = tf.transpose(features, [0, 3, 1, 2])
+
     if FLAGS.transpose_input and mode != tf.estimator.ModeKeys.PREDICT:
         features = tf.transpose(features, [3, 0, 1, 2])  # HWCN to NHWC
 
+    if FLAGS.is_input_normalized:
+        # Standardization to the image by zero mean and unit variance
+        # of the uint8 (--is_uint8_transport) and the float images alike in NHWC
+        features = normalize_image(images       =features,
+                                   mean_rgb     =preproc_config.MEAN_RGB,
+                                   stddev_rgb   =preproc_config.STDDEV_RGB,
+                                   scope        ='feature_norm')
+    elif features.dtype == tf.uint8:
+        # the same 0-255 input as of the float images
+        features = tf.cast(features, tf.float32)
+
+    if FLAGS.data_format == 'channels_first':
+        assert not FLAGS.transpose_input    # channels_first only for GPU
+        features = tf.transpose(features, [0, 3, 1, 2])
 
-    # with tf.name_scope(name='feature_norm',values=[features]):
-    #     # Standardization to the image by zero mean and unit variance.
-    #     features -= tf.constant(preproc_config.MEAN_RGB,   shape=[1, 1, 3], dtype=features.dtype)
-    #     features /= tf.constant(preproc_config.STDDEV_RGB, shape=[1, 1, 3], dtype=features.dtype)
+    if FLAGS.label_mode == 'keypoints':
+        # the label heatmaps of the batch are rendered here
+        # from the (x, y, visible) keypoints at the input resolution
+        labels = dataset_augment_tf.render_keypoint_heatmaps(
+            keypoints   =labels,
+            sigma       =preproc_config.heatmap_std,
+            scale       =(DEFAULT_HG_INOUT_RESOL / DEFAULT_INPUT_RESOL,
+                          DEFAULT_HG_INOUT_RESOL / DEFAULT_INPUT_RESOL),
+            target_size =(int(DEFAULT_HG_INOUT_RESOL), int(DEFAULT_HG_INOUT_RESOL)))
 
     # set input_shape
     features.set_shape(features.get_shape().merge_with(
@@ -228,7 +257,9 @@ def model_fn(features,
     with tf.name_scope(name='total_loss', values=[total_out_losssum,
                                                   total_mid_losssum_acc]):
         # Collect weight regularizer loss =====
-        loss_regularizer = tf.losses.get_regularization_loss()
+        # which is summed over the replicas of the training with the gradients
+        loss_regularizer = get_regularization_loss(
+            num_replicas=FLAGS.num_replicas if mode == tf.estimator.ModeKeys.TRAIN else 1)
         loss = total_out_losssum + total_mid_losssum_acc + loss_regularizer
 
 
@@ -265,7 +296,15 @@ def model_fn(features,
         '''
         update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
         with tf.control_dependencies(update_ops):
-            train_op = optimizer.minimize(loss, global_step)
+            if model_config.dtype == tf.float16:
+                # the gradients of the scaled loss are unscaled
+                # before the update of the float32 master weights
+                grads_and_vars  = optimizer.compute_gradients(loss * FLAGS.loss_scale)
+                grads_and_vars  = [(grad / FLAGS.loss_scale, var)
+                                   for grad, var in grads_and_vars if grad is not None]
+                train_op        = optimizer.apply_gradients(grads_and_vars, global_step)
+            else:
+                train_op = optimizer.minimize(loss, global_step)
 
         if FLAGS.is_extra_summary:
             summary_op = summary_fn(mode                    =mode,
@@ -292,7 +331,9 @@ def model_fn(features,
     elif mode == tf.estimator.ModeKeys.EVAL:
         # in case of Estimator metric_ops must be in a form of dictionary
         tf.logging.info('Create Metric Ops')
-        metric_ops          = metric_fn(labels, logits_out_heatmap, pck_threshold=FLAGS.pck_threshold)
+        metric_ops          = metric_fn(labels, logits_out_heatmap,
+                                        pck_threshold   =FLAGS.pck_threshold,
+                                        refine          =FLAGS.keypoint_refine or None)
 
         if FLAGS.is_extra_summary:
             summary_op = summary_fn(mode                    =mode,
@@ -321,74 +362,132 @@ def model_fn(features,
 
 
 
+def start_eval_process(model_dir):
+    '''
+        start_eval_process()
+        runs this trainer in --mode=eval as a background process
+        which evaluates the checkpoints of model_dir as they are saved
+        and ends after the checkpoint of --train_steps.
+        The flags of this process are passed on by get_eval_process_argv()
+        but the device flags, as it sees --eval_visible_devices only.
+    '''
+    cmd = [sys.executable, os.path.abspath(sys.argv[0])] + \
+          get_eval_process_argv(argv=sys.argv[1:], model_dir=model_dir)
+
+    env = dict(os.environ)
+    env['CUDA_VISIBLE_DEVICES'] = FLAGS.eval_visible_devices
+
+    tf.logging.info('[start_eval_process] cmd=%s' % ' '.join(cmd))
+    return Popen(cmd, env=env)
+
+
+
+
 def main(unused_argv):
 
+    if FLAGS.dataset_stats_path:
+        preproc_config.load_dataset_stats(FLAGS.dataset_stats_path)
+
+    # no bfloat16 kernels of Conv2D and FusedBatchNorm on CPU and GPU in TF 1.9;
+    # bfloat16 is of the TPU trainer only
+    assert FLAGS.precision in ['float16', 'float32'], \
+        ('Invalid value for --precision flag; must be float16 or float32 on GPU.')
+    model_config.dtype = tf.as_dtype(FLAGS.precision)
+
     model_config.show_info()
     train_config.show_info()
     preproc_config.show_info()
 
-    ## ckpt dir create
-    now = datetime.utcnow().strftime("%Y%m%d%H%M%S")
-    curr_model_dir      = "{}/run-{}/".format(FLAGS.model_dir, now)
-    curr_model_dir_local= "{}/run-{}/".format(EXPORT_MODEL_DIR,now)
+    if FLAGS.mode == 'eval':
+        # the eval mode watches the checkpoints of a run dir given by --model_dir
+        tf.logging.info('[main] data dir = %s'%FLAGS.data_dir)
+        tf.logging.info('[main] model dir = %s'%FLAGS.model_dir)
+        tf.logging.info('------------------------')
+
+    else:
+        ## ckpt dir create
+        now = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+        curr_model_dir      = "{}/run-{}/".format(FLAGS.model_dir, now)
+        curr_model_dir_local= "{}/run-{}/".format(EXPORT_MODEL_DIR,now)
+
+        tf.logging.info('[main] data dir = %s'%FLAGS.data_dir)
+        tf.logging.info('[main] model dir = %s'%curr_model_dir)
+        tf.logging.info('[main] config logging dir  = %s'%curr_model_dir_local)
+        tf.logging.info('------------------------')
 
-    tf.logging.info('[main] data dir = %s'%FLAGS.data_dir)
-    tf.logging.info('[main] model dir = %s'%curr_model_dir)
-    tf.logging.info('[main] config logging dir  = %s'%curr_model_dir_local)
-    tf.logging.info('------------------------')
+        if not tf.gfile.Exists(curr_model_dir):
+            tf.gfile.MakeDirs(curr_model_dir)
 
-    if not tf.gfile.Exists(curr_model_dir):
-        tf.gfile.MakeDirs(curr_model_dir)
+        if not tf.gfile.Exists(curr_model_dir_local):
+            tf.gfile.MakeDirs(curr_model_dir_local)
 
-    if not tf.gfile.Exists(curr_model_dir_local):
-        tf.gfile.MakeDirs(curr_model_dir_local)
+        FLAGS.model_dir = curr_model_dir
 
-    FLAGS.model_dir = curr_model_dir
+        # # logging config information
+        tf.logging.info(str(train_config_dict))
+        tf.logging.info(str(model_config_dict))
+        tf.logging.info(str(preproc_config_dict))
 
-    # # logging config information
-    tf.logging.info(str(train_config_dict))
-    tf.logging.info(str(model_config_dict))
-    tf.logging.info(str(preproc_config_dict))
+        train_config_filename   = curr_model_dir_local + 'train_config' + '.json'
+        model_config_filename   = curr_model_dir_local + 'model_config' + '.json'
+        preproc_config_filename = curr_model_dir_local + 'preproc_config' + '.json'
 
-    train_config_filename   = curr_model_dir_local + 'train_config' + '.json'
-    model_config_filename   = curr_model_dir_local + 'model_config' + '.json'
-    preproc_config_filename = curr_model_dir_local + 'preproc_config' + '.json'
+        with open(train_config_filename, 'w') as fp:
+            json.dump(str(train_config_dict), fp)
 
-    with open(train_config_filename, 'w') as fp:
-        json.dump(str(train_config_dict), fp)
+        with open(model_config_filename, 'w') as fp:
+            json.dump(str(model_config_dict), fp)
 
-    with open(model_config_filename, 'w') as fp:
-        json.dump(str(model_config_dict), fp)
+        with open(preproc_config_filename, 'w') as fp:
+            json.dump(str(preproc_config_dict), fp)
 
-    with open(preproc_config_filename, 'w') as fp:
-        json.dump(str(preproc_config_dict), fp)
+        # for gen_tflite_coreml.py to normalize the export as the training
+        if FLAGS.is_input_normalized:
+            save_input_norm(model_dir   =curr_model_dir_local,
+                            mean_rgb    =preproc_config.MEAN_RGB,
+                            stddev_rgb  =preproc_config.STDDEV_RGB)
 
 
-    try:
-        cmd = "sudo gsutil cp -r {} {}".format(curr_model_dir_local + '* ', curr_model_dir)
-        print ('[main] cmd=%s'%cmd)
-        check_output(cmd,shell=True)
-        tf.logging.info('[main] success logging config in bucket')
-    except:
-        tf.logging.info('[main] failure logging config in bucket')
+        try:
+            cmd = "sudo gsutil cp -r {} {}".format(curr_model_dir_local + '* ', curr_model_dir)
+            print ('[main] cmd=%s'%cmd)
+            check_output(cmd,shell=True)
+            tf.logging.info('[main] success logging config in bucket')
+        except:
+            tf.logging.info('[main] failure logging config in bucket')
 
 
     # for CPU or GPU use
     config = tf.ConfigProto(allow_soft_placement=True,
                             log_device_placement=False,
                             gpu_options=tf.GPUOptions(allow_growth=True))
+    if FLAGS.num_virtual_cpus > 0:
+        config.device_count['CPU'] = FLAGS.num_virtual_cpus
+
+    # data parallel training over the devices found
+    train_devices       = get_train_devices(num_replicas     =FLAGS.num_replicas,
+                                            session_config   =config)
+    FLAGS.num_replicas  = len(train_devices)
+    tf.logging.info('[main] train devices = %s' % train_devices)
+
+    prefetch_device = FLAGS.prefetch_device
+    if FLAGS.num_replicas > 1 and prefetch_device:
+        # MirroredStrategy places the batches of the replicas on their devices
+        tf.logging.info('[main] prefetch_device is ignored for %s replicas' % FLAGS.num_replicas)
+        prefetch_device = ''
 
 
     config = tf.estimator.RunConfig(
                 model_dir                       =FLAGS.model_dir,
                 tf_random_seed                  =None,
                 save_summary_steps              =FLAGS.summary_step,
-                save_checkpoints_steps          =max(600, FLAGS.iterations_per_loop),
+                save_checkpoints_steps          =FLAGS.steps_per_eval if FLAGS.mode == 'train_and_eval_async'
+                                                 else max(600, FLAGS.iterations_per_loop),
                 session_config                  = config,
                 keep_checkpoint_max             =5,
                 keep_checkpoint_every_n_hours   =10000,
                 log_step_count_steps            =FLAGS.log_step_count_steps,
-                train_distribute                =None)
+                train_distribute                =get_distribution_strategy(train_devices))
 
     dontbeturtle_estimator  = tf.estimator.Estimator(
                 model_dir          = FLAGS.model_dir,
@@ -407,12 +506,31 @@ def main(unused_argv):
         is_training     =is_training,
         data_dir        =FLAGS.data_dir,
         transpose_input =FLAGS.transpose_input,
-        use_bfloat16    =False) for is_training in [True, False]]
+        use_bfloat16    =False,
+        dataloader_mode =FLAGS.dataloader_mode,
+        num_workers     =FLAGS.num_dataloader_workers,
+        image_cache_mbytes  =FLAGS.image_cache_mbytes if is_training else 0,
+        image_cache_dir     =FLAGS.image_cache_dir,
+        prebake_dir         =FLAGS.prebake_dir,
+        label_mode          =FLAGS.label_mode,
+        is_uint8_transport  =FLAGS.is_uint8_transport,
+        prefetch_device     =prefetch_device,
+        num_replicas        =FLAGS.num_replicas if is_training else 1,
+        eval_cache_dir      =FLAGS.eval_cache_dir) for is_training in [True, False]]
 
 
 
     if FLAGS.mode == 'eval':
-        eval_steps = FLAGS.num_eval_images // FLAGS.eval_batch_size
+        eval_steps = FLAGS.num_eval_images // dataset_eval.eval_batch_size
+
+        live_evaluator = None
+        if FLAGS.is_live_eval:
+            # the eval graph, the metric ops and the session are built once.
+            # A checkpoint only restores the variables
+            live_evaluator = LiveEvaluator(model_fn         =model_fn,
+                                           input_fn         =dataset_eval.input_fn,
+                                           model_dir        =FLAGS.model_dir,
+                                           session_config   =config.session_config)
 
         # Run evaluation when there's a new checkpoint
         for ckpt in evaluation.checkpoints_iterator(
@@ -421,10 +539,15 @@ def main(unused_argv):
 
             try:
                 start_timestamp = time.time()  # This time will include compilation time
-                eval_results = dontbeturtle_estimator.evaluate(
-                    input_fn        =dataset_eval.input_fn,
-                    steps           =eval_steps,
-                    checkpoint_path =ckpt)
+                if live_evaluator is not None:
+                    eval_results = live_evaluator.evaluate(
+                        checkpoint_path =ckpt,
+                        steps           =eval_steps)
+                else:
+                    eval_results = dontbeturtle_estimator.evaluate(
+                        input_fn        =dataset_eval.input_fn,
+                        steps           =eval_steps,
+                        checkpoint_path =ckpt)
 
                 elapsed_time = int(time.time() - start_timestamp)
                 tf.logging.info('Eval results: %s. Elapsed seconds: %d' %
@@ -445,12 +568,16 @@ def main(unused_argv):
                 tf.logging.info(
                     'Checkpoint %s no longer exists, skipping checkpoint' % ckpt)
 
+        if live_evaluator is not None:
+            live_evaluator.close()
+
     else:   # FLAGS.mode == 'train' or FLAGS.mode == 'train_and_eval'
         current_step = estimator._load_global_step_from_checkpoint_dir(FLAGS.model_dir)  # pylint: disable=protected-access,line-too-long
         batchnum_per_epoch = FLAGS.num_train_images // FLAGS.train_batch_size
 
         tf.logging.info('[main] num_train_images=%s' % FLAGS.num_train_images)
         tf.logging.info('[main] train_batch_size=%s' % FLAGS.train_batch_size)
+        tf.logging.info('[main] num_replicas=%s' % FLAGS.num_replicas)
         tf.logging.info('[main] batchnum_per_epoch=%s' % batchnum_per_epoch)
         tf.logging.info('[main] Training for %d steps (%.2f epochs in total). Current'
                         ' step %d.' % (FLAGS.train_steps,
@@ -465,6 +592,32 @@ def main(unused_argv):
                 max_steps   =FLAGS.train_steps)
             tf.logging.info('[main] Training only')
 
+        elif FLAGS.mode == 'train_and_eval_async':
+            # a single train() keeps the graph, the session and the input pipeline
+            # over the whole training. The checkpoints saved every --steps_per_eval
+            # are evaluated by a background process
+            tf.logging.info('[main] Training and Evaluation in a background process')
+            eval_process = start_eval_process(FLAGS.model_dir)
+
+            try:
+                dontbeturtle_estimator.train(
+                    input_fn    =dataset_train.input_fn,
+                    max_steps   =FLAGS.train_steps)
+            except:
+                eval_process.terminate()
+                raise
+
+            # up to the evaluation of the final checkpoint
+            eval_process.wait()
+            if eval_process.returncode != 0:
+                # not to report the run as done without its evaluation
+                raise RuntimeError('[main] eval process failed with the return code %d'
+                                   % eval_process.returncode)
+
+            elapsed_time = int(time.time() - start_timestamp)
+            tf.logging.info('Finished training up to step %d. Elapsed seconds %d.' %
+                            (FLAGS.train_steps, elapsed_time))
+
         else:
             assert FLAGS.mode == 'train_and_eval'
             tf.logging.info('[main] Training and Evaluation')
@@ -481,12 +634,12 @@ def main(unused_argv):
                 current_step = next_checkpoint
 
                 # Evaluate the model on the most recent model in --model_dir.
-                # Since evaluation happens in batches of --eval_batch_size, some images
+                # Since evaluation happens in batches of dataset_eval.eval_batch_size, some images
                 # may be consistently excluded modulo the batch size.
                 tf.logging.info('Starting to evaluate.')
                 eval_results    = dontbeturtle_estimator.evaluate(
                     input_fn    =dataset_eval.input_fn,
-                    steps       =FLAGS.num_eval_images // FLAGS.eval_batch_size)
+                    steps       =FLAGS.num_eval_images // dataset_eval.eval_batch_size)
 
                 tf.logging.info('Eval results: %s' % eval_results)
 
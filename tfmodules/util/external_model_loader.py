@@ -54,13 +54,19 @@ class ModelLoader(object):
             self._mode='notsupp'
 
         # public
-        self.model_graph = tf.Graph()
+        self.model_graph    = tf.Graph()
+        # session of the restored variables in the meta mode
+        self.model_session  = None
         print ('-------------------------------------')
 
 
 
 
-    def load_model(self,clear_devices=True):
+    def load_model(self,clear_devices=True,input_map=None):
+        '''
+            input_map: dict of the tensor names in the loaded graph to the tensors
+                of self.model_graph replacing them, e.g. a placeholder of a larger batch
+        '''
 
         tf.reset_default_graph()
         model_file_path = path_manager.EXPORT_DIR + self._filename
@@ -73,15 +79,17 @@ class ModelLoader(object):
                     graph_def.ParseFromString(f.read())
 
                     # Import the graph from "graph_def" into current default graph
-                    _ = tf.import_graph_def(graph_def=graph_def,name='')
+                    _ = tf.import_graph_def(graph_def=graph_def,input_map=input_map,name='')
 
             elif self._mode == 'meta':
                 print('[ModelLoader] Clear device for meta grpah loading = %s' % clear_devices)
                 meta_loader = tf.train.import_meta_graph(meta_graph_or_file = model_file_path,
-                                                         clear_devices=clear_devices)
+                                                         clear_devices=clear_devices,
+                                                         input_map=input_map)
 
                 sess = tf.Session(graph= self.model_graph)
                 meta_loader.restore(sess,model_file_path[:-5])
+                self.model_session = sess
 
 
         print ("[ModelLoader] Graph loading complete.")
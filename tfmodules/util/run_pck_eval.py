@@ -0,0 +1,358 @@
+# Copyright 2018 Jaewook Kang (jwkang10@gmail.com) All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+# -*- coding: utf-8 -*-
+#! /usr/bin/env python
+'''
+    filename: run_pck_eval.py
+
+    description: offline evaluation of an exported model
+        over the validation set of --data_dir
+
+    - functions
+        - loading a frozen .pb or a ckpt .meta by ModelLoader
+        - running the validation set in batches of --pck_eval_batch_size
+          where the next batches are decoded in a thread during the inference
+        - per-joint PCK and PCKh curves over a sweep of thresholds
+        - a json report with the inference latency per batch
+
+    - usage (from the project home):
+        python ./tfmodules/util/run_pck_eval.py \
+            --data_dir=<coco form dataset dir> \
+            --pck_eval_model=/model/run-xxx/mobile_format/frozen_model.pb \
+            --pck_eval_report=./pck_report.json
+'''
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import time
+import json
+import threading
+from os import getcwd
+
+from six.moves import queue
+from absl import flags
+import tensorflow as tf
+import numpy as np
+
+MODULE_DIR = getcwd() + '/tfmodules'
+sys.path.insert(0,MODULE_DIR)
+
+# directory path addition
+from path_manager import TF_MODULE_DIR
+from path_manager import TF_MODEL_DIR
+from path_manager import TF_CNN_MODULE_DIR
+from path_manager import COCO_DATALOAD_DIR
+
+# PATH INSERSION
+sys.path.insert(0,TF_MODULE_DIR)
+sys.path.insert(0,TF_MODULE_DIR + '/util')
+sys.path.insert(0,TF_MODEL_DIR)
+sys.path.insert(0,TF_CNN_MODULE_DIR)
+sys.path.insert(0,COCO_DATALOAD_DIR)
+
+import data_loader_coco
+from external_model_loader import ModelLoader
+
+from model_config  import DEFAULT_INPUT_RESOL
+from model_config  import DEFAULT_HG_INOUT_RESOL
+from train_config  import FLAGS
+from train_aux_fn  import decode_keypoints
+
+
+KEYPOINT_NAMES  = ['head', 'neck', 'lshoulder', 'rshoulder']
+
+# the joints of the PCK normalizers
+HEAD, NECK, LSHOULDER, RSHOULDER = 0, 1, 2, 3
+
+
+flags.DEFINE_string(
+    'pck_eval_model', default=None,
+    help=('Model to evaluate under EXPORT_DIR as ModelLoader takes;'
+          ' a frozen .pb or a ckpt .meta.'))
+
+flags.DEFINE_string(
+    'pck_eval_input_node', default='model_in:0',
+    help=('Input tensor of the model to evaluate taking the 0-255 BGR images of the data loader.'
+          ' A ckpt .meta of trainer_gpu.py takes the output of the input pipeline,'
+          ' e.g. IteratorGetNext:0.'))
+
+flags.DEFINE_string(
+    'pck_eval_output_node', default='build_network/model/model_out:0',
+    help='Output heatmap tensor of the model to evaluate.')
+
+flags.DEFINE_integer(
+    'pck_eval_batch_size', default=64,
+    help='Batch size of the offline evaluation.')
+
+flags.DEFINE_integer(
+    'pck_eval_prefetch', default=2,
+    help='Number of the batches decoded ahead of the inference.')
+
+flags.DEFINE_float(
+    'pck_eval_max_threshold', default=0.5,
+    help='Largest threshold of the PCK and PCKh curves.')
+
+flags.DEFINE_integer(
+    'pck_eval_num_thresholds', default=51,
+    help='Number of the thresholds from 0 to --pck_eval_max_threshold.')
+
+flags.DEFINE_string(
+    'pck_eval_report', default='./pck_report.json',
+    help='Path of the json report.')
+
+
+
+
+def get_pck_curves(pred_keypoints, label_keypoints, thresholds):
+    '''
+        get_pck_curves()
+
+        per-joint percentage of correct keypoints over all the thresholds at once.
+        - PCKh: the distance is normalized by the head-neck distance of the label
+                as of metric_fn
+        - PCK : the distance is normalized by the shoulder width of the label
+                as the torso size of the four keypoints
+        The joints of invisible labels and the samples without the normalizer
+        joints are not counted.
+
+        :param pred_keypoints:  Nx4x2 (x, y) of the predictions
+        :param label_keypoints: Nx4x3 (x, y, visible) of the labels
+        :param thresholds:      T thresholds on the normalized distances
+        :return: dict of
+            - 'pck', 'pckh': dict of the joint name (and 'total') to the T curve values
+            - 'num_of_joints', 'num_of_joints_h': dict of the joint name to the counted joints
+    '''
+    pred_keypoints  = np.asarray(pred_keypoints, dtype=np.float32)
+    label_keypoints = np.asarray(label_keypoints, dtype=np.float32)
+    thresholds      = np.asarray(thresholds, dtype=np.float32)
+
+    label_xy    = label_keypoints[:, :, 0:2]
+    is_visible  = label_keypoints[:, :, 2] > 0
+
+    # N x 4
+    errdist     = np.sqrt(np.sum(np.square(pred_keypoints - label_xy), axis=2))
+
+    def get_curves(joint_a, joint_b):
+        normalizer  = np.sqrt(np.sum(np.square(label_xy[:, joint_a] - label_xy[:, joint_b]), axis=1))
+        is_valid    = is_visible & (is_visible[:, joint_a] &
+                                    is_visible[:, joint_b] &
+                                    (normalizer > 0))[:, np.newaxis]
+
+        # N x 4 x T
+        normalized_errdist  = errdist / np.maximum(normalizer, 1e-6)[:, np.newaxis]
+        is_correct          = (normalized_errdist[:, :, np.newaxis] <= thresholds) & \
+                              is_valid[:, :, np.newaxis]
+
+        num_of_valid    = is_valid.sum(axis=0)
+        curves          = is_correct.sum(axis=0) / np.maximum(num_of_valid, 1)[:, np.newaxis]
+
+        curve_dict = dict((name, curves[n].tolist()) for n, name in enumerate(KEYPOINT_NAMES))
+        curve_dict['total'] = (is_correct.sum(axis=(0, 1)) / max(num_of_valid.sum(), 1)).tolist()
+        count_dict = dict((name, int(num_of_valid[n])) for n, name in enumerate(KEYPOINT_NAMES))
+        return curve_dict, count_dict
+
+    pck,  num_of_joints     = get_curves(LSHOULDER, RSHOULDER)
+    pckh, num_of_joints_h   = get_curves(HEAD, NECK)
+
+    return {'pck':              pck,
+            'pckh':             pckh,
+            'num_of_joints':    num_of_joints,
+            'num_of_joints_h':  num_of_joints_h}
+
+
+
+
+def get_input_keypoints(heatmap_keypoints):
+    '''
+        get_input_keypoints()
+        maps the keypoints from the heatmap pixels to the input pixels
+        by the pixel-center convention of the labels (see get_keypoint_label())
+        :param heatmap_keypoints: ...x2 (x, y) in the DEFAULT_HG_INOUT_RESOL heatmap pixels
+        :return: ...x2 (x, y) in the DEFAULT_INPUT_RESOL input pixels
+    '''
+    scale = DEFAULT_INPUT_RESOL / DEFAULT_HG_INOUT_RESOL
+    return (np.asarray(heatmap_keypoints, dtype=np.float32) + 0.5) * scale - 0.5
+
+
+
+
+def get_latency_stats(latency_ms):
+    '''
+        get_latency_stats()
+        :return: dict of the mean and percentiles of the latencies in msec
+    '''
+    latency_ms = np.asarray(latency_ms, dtype=np.float64)
+    return {'mean': float(latency_ms.mean()),
+            'p50':  float(np.percentile(latency_ms, 50)),
+            'p95':  float(np.percentile(latency_ms, 95)),
+            'max':  float(latency_ms.max())}
+
+
+
+
+def start_batch_thread(dataset_input, batch_queue):
+    '''
+        start_batch_thread()
+        decodes the batches of the evaluation in a thread with its own graph and session
+        into batch_queue. The first error is put into the queue in place of a batch.
+        :return: number of the batches to come
+    '''
+    graph = tf.Graph()
+    with graph.as_default():
+        iterator    = dataset_input.input_fn().make_initializable_iterator()
+        next_batch  = iterator.get_next()
+
+    # the annotation index is loaded by input_fn()
+    # where the evaluation dataset repeats
+    batch_size      = dataset_input.eval_batch_size
+    num_of_batches  = len(dataset_input.anno_index) // batch_size
+    if num_of_batches == 0:
+        raise ValueError('[run_pck_eval] %d samples are less than a batch of %d'
+                         % (len(dataset_input.anno_index), batch_size))
+
+    def run():
+        try:
+            with tf.Session(graph=graph) as sess:
+                sess.run(iterator.initializer)
+                for _ in range(0, num_of_batches):
+                    batch_queue.put(sess.run(next_batch))
+        except Exception as e:  # pylint: disable=broad-except
+            batch_queue.put(e)
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return num_of_batches
+
+
+
+
+def run_pck_eval(model_filename, dataset_input):
+    '''
+        run_pck_eval()
+        :param model_filename: model under EXPORT_DIR as ModelLoader takes
+        :param dataset_input: data_loader_coco.DataSetInput of the evaluation
+                in the 'keypoints' label_mode
+        :return: dict of the report
+    '''
+    batch_size = dataset_input.eval_batch_size
+
+    # the input of the model is replaced by a placeholder of a dynamic batch
+    model_loader = ModelLoader(subdir_and_filename=model_filename)
+    with model_loader.model_graph.as_default():
+        model_in = tf.placeholder(dtype=tf.float32,
+                                  shape=[None, int(DEFAULT_INPUT_RESOL), int(DEFAULT_INPUT_RESOL), 3],
+                                  name='pck_eval_in')
+    model_graph = model_loader.load_model(input_map={FLAGS.pck_eval_input_node: model_in})
+
+    with model_graph.as_default():
+        heatmaps        = model_graph.get_tensor_by_name(FLAGS.pck_eval_output_node)
+        keypoints_op    = decode_keypoints(heatmaps, refine=FLAGS.keypoint_refine or None)
+
+    sess = model_loader.model_session
+    if sess is None:
+        sess = tf.Session(graph=model_graph)
+
+    # the next batches are decoded during the inference of the current one
+    batch_queue     = queue.Queue(maxsize=FLAGS.pck_eval_prefetch)
+    num_of_batches  = start_batch_thread(dataset_input  =dataset_input,
+                                         batch_queue    =batch_queue)
+
+    pred_keypoints, label_keypoints = [], []
+    latency_ms, wait_ms             = [], []
+    for step in range(0, num_of_batches):
+        start_time  = time.time()
+        batch       = batch_queue.get()
+        if isinstance(batch, Exception):
+            raise batch
+        images, labels = batch
+
+        infer_time  = time.time()
+        keypoints   = sess.run(keypoints_op, feed_dict={model_in: images})
+        end_time    = time.time()
+
+        pred_keypoints.append(get_input_keypoints(keypoints))
+        label_keypoints.append(labels)
+        wait_ms.append((infer_time - start_time) * 1000.0)
+        latency_ms.append((end_time - infer_time) * 1000.0)
+
+        tf.logging.info('[run_pck_eval] batch %d/%d: inference %.1f ms, waiting %.1f ms'
+                        % (step + 1, num_of_batches, latency_ms[-1], wait_ms[-1]))
+    sess.close()
+
+    thresholds  = np.linspace(0.0, FLAGS.pck_eval_max_threshold, FLAGS.pck_eval_num_thresholds)
+    report      = get_pck_curves(pred_keypoints =np.concatenate(pred_keypoints, axis=0),
+                                 label_keypoints=np.concatenate(label_keypoints, axis=0),
+                                 thresholds     =thresholds)
+
+    # the first batch includes the warm-up of the session
+    report.update({'model':             model_filename,
+                   'keypoint_refine':   FLAGS.keypoint_refine,
+                   'num_of_samples':    num_of_batches * batch_size,
+                   'batch_size':        batch_size,
+                   'thresholds':        thresholds.tolist(),
+                   'latency_ms':        get_latency_stats(latency_ms[1:] if num_of_batches > 1 else latency_ms),
+                   'latency_ms_per_batch':  latency_ms,
+                   'wait_ms_per_batch':     wait_ms})
+    return report
+
+
+
+
+def main(unused_argv):
+
+    if FLAGS.pck_eval_model is None:
+        raise ValueError('[run_pck_eval] --pck_eval_model is required')
+
+    dataset_input = data_loader_coco.DataSetInput(
+        is_training     =False,
+        data_dir        =FLAGS.data_dir,
+        transpose_input =False,
+        use_bfloat16    =False,
+        dataloader_mode =FLAGS.dataloader_mode,
+        num_workers     =FLAGS.num_dataloader_workers,
+        image_cache_mbytes  =FLAGS.image_cache_mbytes,
+        image_cache_dir     =FLAGS.image_cache_dir,
+        label_mode          ='keypoints',
+        is_uint8_transport  =False,
+        prefetch_device     ='',
+        eval_cache_dir      ='',
+        eval_batch_size     =FLAGS.pck_eval_batch_size)
+
+    report = run_pck_eval(model_filename=FLAGS.pck_eval_model,
+                          dataset_input =dataset_input)
+
+    with open(FLAGS.pck_eval_report, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    max_threshold_index = len(report['thresholds']) - 1
+    for threshold in [0.1, 0.2, 0.5]:
+        index = int(round(threshold / FLAGS.pck_eval_max_threshold * max_threshold_index))
+        if index <= max_threshold_index:
+            tf.logging.info('[run_pck_eval] PCK@%.1f = %.4f, PCKh@%.1f = %.4f'
+                            % (threshold, report['pck']['total'][index],
+                               threshold, report['pckh']['total'][index]))
+    tf.logging.info('[run_pck_eval] latency per batch = %s ms' % report['latency_ms'])
+    tf.logging.info('[run_pck_eval] report = %s' % FLAGS.pck_eval_report)
+
+
+
+
+if __name__ == '__main__':
+    tf.logging.set_verbosity(tf.logging.INFO)
+    tf.app.run()